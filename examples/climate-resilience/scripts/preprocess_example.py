@@ -4,13 +4,11 @@ sys.dont_write_bytecode = True
 import os
 import pandas as pd
 import numpy as np
-import scipy 
-from scipy import stats
-from sklearn.linear_model import LinearRegression
 import matplotlib.pyplot as plt
 
 from climate_resilience import utils
 from climate_resilience import preprocess as pp
+from climate_resilience import trends
 
 
 def main():
@@ -41,6 +39,9 @@ def main():
     variables = ["pr"]
     with utils.ExecTimeCM("get_per_year_stats()") as et:    # This line is not required to run the function. It is only used to check the function's execution time.
         pp.get_per_year_stats(sites, scenarios, variables, datadir)
+    
+    with utils.ExecTimeCM("get_trends()") as et:    # This line is not required to run the function. It is only used to check the function's execution time.
+        trends.get_trends(sites, datadir)
         
     scenarios = ["historical", "rcp45", "rcp85"]
     variables = ["pr"]
@@ -18,6 +18,11 @@ install_requires = [
     "joblib",
 ]
 
+extras_require = {
+    "parquet": ["pyarrow"],
+    "cube": ["xarray", "netCDF4", "zarr"],
+}
+
 description_file = 'DESCRIPTION.md'
 with open(file=description_file, mode='r', encoding='utf-8') as f:
     pypi_description = f.read()
@@ -41,6 +46,7 @@ setup(
     # include_package_data=True,
     python_requires=">=3.6",
     install_requires=install_requires,
+    extras_require=extras_require,
     # zip_safe=False,
     classifiers=[
         "Programming Language :: Python :: 3",
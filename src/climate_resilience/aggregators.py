@@ -0,0 +1,171 @@
+import warnings
+import numpy as np
+from typing import Callable, Dict
+
+
+# Registry of the named array-level aggregators.
+# Every aggregator reduces a site x day array (nan for missing values) over
+# the last axis and returns one value per site.
+AGGREGATORS: Dict[str, Callable] = {}
+
+# Comparison functions used to get the count and amount stats
+COMPARISON_FUNCTIONS: Dict[str, Callable] = {
+    "gt": np.greater,
+    "lt": np.less,
+    "eq": np.equal,
+}
+
+
+def register_aggregator(name: str) -> Callable:
+    """Decorator to add an array-level aggregator to the AGGREGATORS registry.
+
+    Example Usage:
+        @register_aggregator("wet_days")
+        def wet_days(block, threshold=1.0):
+            return np.sum(block >= threshold, axis=-1)
+
+    Args:
+        name (str): Name used to refer to the aggregator,
+            e.g. get_sub_period_stats(..., agg_function="wet_days").
+    """
+
+    def decorator(func: Callable) -> Callable:
+        AGGREGATORS[name] = func
+        return func
+
+    return decorator
+
+
+def rolling_sum(block: np.ndarray, window: int) -> np.ndarray:
+    """Calculates the rolling sum over the last axis using cumulative sums.
+
+    The value at day 't' is the sum of days 't-window+1' to 't'. Incomplete
+    windows and windows containing nan values are set to nan.
+
+    Args:
+        block (np.ndarray): Site x day array.
+        window (int): Number of days in the rolling window.
+
+    Returns:
+        np.ndarray: Site x day array of rolling sums.
+    """
+
+    valid = ~np.isnan(block)
+    csum = np.cumsum(np.where(valid, block, 0.0), axis=-1)
+    cvalid = np.cumsum(valid, axis=-1)
+
+    out = np.full(block.shape, np.nan)
+    out[..., window-1:] = csum[..., window-1:]
+    out[..., window:] -= csum[..., :-window]
+
+    nvalid = cvalid.copy()
+    nvalid[..., window:] -= cvalid[..., :-window]
+    out[nvalid < window] = np.nan
+    return out
+
+
+def _run_starts(mask: np.ndarray, resets: np.ndarray=None) -> np.ndarray:
+    """Positions of the last axis where a run of True values starts.
+    Runs are also split at the 'resets' positions (e.g. first day of a year)."""
+
+    starts = mask.copy()
+    starts[..., 1:] &= ~mask[..., :-1]
+    if resets is not None:
+        starts[..., resets] = mask[..., resets]
+    return starts
+
+
+def run_lengths(mask: np.ndarray, resets: np.ndarray=None) -> np.ndarray:
+    """Length of the current run of True values at every position of the
+    last axis, e.g. [1, 1, 0, 1] -> [1, 2, 0, 1].
+
+    Args:
+        mask (np.ndarray): Boolean site x day array.
+        resets (np.ndarray, optional): Positions of the last axis where the
+            runs are restarted, e.g. the year offsets. Defaults to None.
+
+    Returns:
+        np.ndarray: Integer site x day array of run lengths.
+    """
+
+    csum = np.cumsum(mask, axis=-1)
+    base = np.where(mask, 0, csum)
+    if resets is not None:
+        base[..., resets] = np.where(mask[..., resets], csum[..., resets] - 1, csum[..., resets])
+    last_reset = np.maximum.accumulate(base, axis=-1)
+    return csum - last_reset
+
+
+def spell_lengths(mask: np.ndarray, resets: np.ndarray=None) -> np.ndarray:
+    """Total length of the run of True values that every position belongs
+    to, e.g. [1, 1, 0, 1] -> [2, 2, 0, 1]. Uses run-length encoding of the
+    flattened array, so there is no Python loop over the sites.
+
+    Args:
+        mask (np.ndarray): Boolean site x day array.
+        resets (np.ndarray, optional): Positions of the last axis where the
+            runs are restarted, e.g. the year offsets. Defaults to None.
+
+    Returns:
+        np.ndarray: Integer site x day array of spell lengths.
+    """
+
+    starts = _run_starts(mask, resets)
+    starts[..., 0] = mask[..., 0]    # runs never continue across sites
+
+    run_ids = np.cumsum(starts.ravel())
+    lengths = np.bincount(run_ids, weights=mask.ravel()).astype(np.int64)
+    return np.where(mask, lengths[run_ids].reshape(mask.shape), 0)
+
+
+@register_aggregator("percentile")
+def percentile(block: np.ndarray, q: float=99) -> np.ndarray:
+    """qth percentile of every site ignoring the nan values."""
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)    # all-nan sites
+        return np.nanpercentile(block, q, axis=-1)
+
+
+@register_aggregator("mean")
+def mean(block: np.ndarray) -> np.ndarray:
+    """Mean of every site ignoring the nan values."""
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)    # all-nan sites
+        return np.nanmean(block, axis=-1)
+
+
+@register_aggregator("max")
+def maximum(block: np.ndarray) -> np.ndarray:
+    """Maximum of every site ignoring the nan values."""
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)    # all-nan sites
+        return np.nanmax(block, axis=-1)
+
+
+@register_aggregator("sum")
+def total(block: np.ndarray) -> np.ndarray:
+    """Sum of every site ignoring the nan values."""
+
+    return np.nansum(block, axis=-1)
+
+
+@register_aggregator("rolling_max")
+def rolling_max(block: np.ndarray, window: int=5) -> np.ndarray:
+    """Maximum of the rolling window sums, e.g. Rx5day for window=5."""
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)    # all-nan sites
+        return np.nanmax(rolling_sum(block, window), axis=-1)
+
+
+@register_aggregator("consecutive_dry_days")
+def consecutive_dry_days(block: np.ndarray, threshold: float=1.0) -> np.ndarray:
+    """Longest spell of consecutive days with values below the threshold,
+    e.g. the CDD index for precipitation in mm/day."""
+
+    if block.shape[-1] == 0:
+        return np.zeros(block.shape[:-1], dtype=np.int64)
+    return run_lengths(block < threshold).max(axis=-1)
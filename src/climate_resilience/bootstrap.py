@@ -0,0 +1,117 @@
+import numpy as np
+from typing import Callable, Dict, List, Tuple
+
+from joblib import Parallel, delayed
+
+
+def block_bootstrap_indices(
+    n_days: int,
+    n_resamples: int=1000,
+    block_length: int=30,
+    seed: int=0,
+) -> np.ndarray:
+    """Generates the day indices of moving block bootstrap resamples.
+
+    Every resample is a concatenation of randomly placed blocks of
+    block_length consecutive days, truncated to n_days, so the day to day
+    autocorrelation of the series is kept within the blocks.
+
+    Args:
+        n_days (int): Number of days of the series.
+        n_resamples (int, optional): Number of resamples. Defaults to 1000.
+        block_length (int, optional): Number of consecutive days per block.
+            Defaults to 30.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        np.ndarray: Resample x day array of int32 day indices.
+    """
+
+    block_length = max(1, min(block_length, n_days))
+    n_blocks = -(-n_days // block_length)
+
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, n_days - block_length + 1, size=(n_resamples, n_blocks), dtype=np.int32)
+    indices = starts[:, :, None] + np.arange(block_length, dtype=np.int32)
+    return indices.reshape(n_resamples, -1)[:, :n_days]
+
+
+def _resample_batch(block: np.ndarray, indices: np.ndarray, statistic: Callable) -> Dict[str, np.ndarray]:
+    """Worker task: evaluates the statistic of a batch of resamples at once.
+    Returns the site x resample array of every statistic."""
+
+    # Site x resample x day array of the resampled values
+    return statistic(block[:, indices])
+
+
+def bootstrap_ci(
+    block: np.ndarray,
+    statistic: Callable,
+    n_resamples: int=1000,
+    block_length: int=30,
+    confidence: float=0.95,
+    seed: int=0,
+    max_elements: int=20_000_000,
+    n_jobs: int=1,
+) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Block bootstrap confidence intervals of statistics of a site x day array.
+
+    The resample indices are generated once and shared by all the sites, so
+    the statistic is evaluated for all the resamples x sites as batched numpy
+    operations on site x resample x day arrays. The resamples are split into
+    batches of at most max_elements values, which can be evaluated in
+    parallel worker processes. The indices do not depend on n_jobs, so the
+    results are reproducible for a given seed.
+
+    Example Usage:
+        ci = bootstrap_ci(block, lambda res: {"p99": np.nanpercentile(res, 99, axis=-1)})
+        low, high = ci["p99"]
+
+    Args:
+        block (np.ndarray): Site x day array (nan for missing values).
+        statistic (Callable): Function that reduces the last axis of an array
+            and returns a dictionary of named statistics, e.g. a wrapped
+            aggregator of aggregators.AGGREGATORS.
+        n_resamples (int, optional): Number of resamples. Defaults to 1000.
+        block_length (int, optional): Number of consecutive days per block.
+            Defaults to 30.
+        confidence (float, optional): Confidence level of the percentile
+            intervals. Defaults to 0.95.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+        max_elements (int, optional): Maximum number of values of a resampled
+            batch. Defaults to 20,000,000, i.e. 160 MB of float64 values.
+        n_jobs (int, optional): Number of worker processes. Defaults to 1.
+
+    Returns:
+        Dict[str, Tuple[np.ndarray, np.ndarray]]: Lower and upper bounds per
+            site of every statistic.
+
+    Raises:
+        ValueError: If confidence is not between 0 and 1.
+    """
+
+    if not 0 < confidence < 1:
+        raise ValueError("Incorrect value for confidence. Expecting a value between 0 and 1.")
+
+    n_sites, n_days = block.shape
+    indices = block_bootstrap_indices(n_days, n_resamples, block_length, seed)
+    batch_size = max(1, max_elements // max(1, n_sites * n_days))
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_resample_batch)(block, indices[i:i+batch_size], statistic)
+        for i in range(0, n_resamples, batch_size)
+    )
+
+    alpha = (1 - confidence) / 2
+    intervals = {}
+    for name in results[0]:
+        values = np.concatenate([result[name] for result in results], axis=1)
+        low, high = np.nanquantile(values, [alpha, 1 - alpha], axis=1)
+        intervals[name] = (low, high)
+    return intervals
+
+
+def ci_colnames(colname: str) -> List[str]:
+    """Names of the lower and upper bound columns of a statistic column."""
+
+    return [f"{colname}_ci_low", f"{colname}_ci_high"]
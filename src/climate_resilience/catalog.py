@@ -0,0 +1,376 @@
+import os
+import json
+import pickle
+import warnings
+import pandas as pd
+from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from climate_resilience import utils
+
+warnings.formatwarning = utils.warning_format
+
+
+CACHE_FILENAME = ".climate_resilience_catalog.pkl"
+
+# Registry of the series that were extended after their preprocess outputs were generated
+STALE_FILENAME = ".climate_resilience_stale.json"
+
+# Stage of the get_climate_ensemble() output (both formats), i.e. the input of the downstream preprocess functions
+ENSEMBLE_STAGE = "climate_ensemble"
+
+# Columns of the catalog records
+CATALOG_COLUMNS = ["path", "kind", "name", "state", "scenario", "variable", "model", "mtime", "size"]
+
+# In-process cache of the catalogs, keyed by the absolute datadir path
+_catalogs = {}
+
+
+def _parse_dirname(dirname: str) -> dict:
+    """Parses '{scenario}_{variable}' or '{scenario}_{variable}_ensemble'
+    directory names. Returns None for any other directory."""
+
+    kind = "model"
+    if dirname.endswith("_ensemble"):
+        kind = "ensemble"
+        dirname = dirname[:-len("_ensemble")]
+
+    if "_" not in dirname:
+        return None
+
+    scenario, variable = dirname.split("_", 1)
+    return {"kind": kind, "scenario": scenario, "variable": variable}
+
+
+def _parse_filename(filename: str, dir_info: dict) -> dict:
+    """Parses '{name}_{state}_{scenario}_{variable}[_{model}].csv' file names
+    of a parsed directory. Returns None for any other file."""
+
+    if not filename.endswith(".csv"):
+        return None
+
+    stem = filename[:-len(".csv")]
+    marker = f"_{dir_info['scenario']}_{dir_info['variable']}"
+    pos = stem.rfind(marker)
+    if pos <= 0:
+        return None
+
+    name_state = stem[:pos]
+    model = stem[pos+len(marker):].lstrip("_") or None
+    if "_" not in name_state:
+        return None
+
+    name, state = name_state.rsplit("_", 1)
+    return {"name": name, "state": state, "model": model}
+
+
+def _scan_subdir(path: str, dirname: str) -> List[dict]:
+    """Scans a single data subdirectory with os.scandir()."""
+
+    dir_info = _parse_dirname(dirname)
+    if dir_info is None:
+        return []
+
+    records = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+
+            file_info = _parse_filename(entry.name, dir_info)
+            if file_info is None:
+                continue
+
+            stat = entry.stat()
+            records.append({
+                "path": entry.path,
+                **dir_info,
+                **file_info,
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+            })
+    return records
+
+
+class Catalog:
+    """Catalog of all the data files in a datadir tree.
+
+    The tree is scanned once and the file names are parsed into
+    (site, state, scenario, variable, model) records, which replaces the
+    os.path.exists() and glob.glob() calls per site in the preprocess
+    functions with dictionary lookups.
+
+    Example Usage:
+        catalog = get_catalog(datadir)
+        catalog.exists(csv_path)
+        catalog.model_files("rcp45", "pr", "AMB", "NM")
+    """
+
+    def __init__(self, datadir: str, records: pd.DataFrame, dir_mtimes: Dict[str, float]) -> None:
+        """Initializes the Catalog object.
+
+        Args:
+            datadir (str): Parent directory containing all the data files.
+            records (pd.DataFrame): One row per data file with the
+                CATALOG_COLUMNS columns.
+            dir_mtimes (Dict[str, float]): Modification times of the
+                subdirectories at the time of the scan.
+        """
+
+        self.datadir = datadir
+        self.records = records
+        self.dir_mtimes = dir_mtimes
+
+        self._paths = set(os.path.abspath(path) for path in records["path"])
+        self._model_files = {}
+        models = records[records["kind"] == "model"].sort_values("path")
+        for path, scenario, variable, name, state in zip(models["path"], models["scenario"], models["variable"], models["name"], models["state"]):
+            self._model_files.setdefault((scenario, variable, name, state), []).append(path)
+
+    def exists(self, path: str) -> bool:
+        """Replacement of os.path.exists() for the cataloged files."""
+
+        return os.path.abspath(path) in self._paths
+
+    def model_files(self, scenario: str, variable: str, name: str, state: str) -> List[str]:
+        """Returns the sorted model CSV files of a site in the
+        '{scenario}_{variable}' directory."""
+
+        return list(self._model_files.get((scenario, variable, name, state), []))
+
+    def is_stale(self) -> bool:
+        """Checks if any directory of the tree was modified after the scan,
+        i.e. files were added or removed. Costs one stat() per directory."""
+
+        try:
+            current = _dir_mtimes(self.datadir)
+        except OSError:
+            return True
+        return current != self.dir_mtimes
+
+
+def _dir_mtimes(datadir: str) -> Dict[str, float]:
+    """Modification times of the direct subdirectories of datadir. Adding or
+    removing a subdirectory changes the keys. The mtime of datadir itself is
+    not used because writing the cache file modifies it."""
+
+    mtimes = {}
+    with os.scandir(datadir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                mtimes[entry.name] = entry.stat().st_mtime
+    return mtimes
+
+
+def build_catalog(datadir: str, n_workers: int=8, use_cache: bool=True) -> Catalog:
+    """Scans the datadir tree once and builds the catalog of the data files.
+
+    The subdirectories are scanned in parallel threads. The catalog is cached
+    in '{datadir}/.climate_resilience_catalog.pkl' together with the
+    directory modification times and reused as long as no directory changed.
+
+    Args:
+        datadir (str): Parent directory containing all the data files.
+        n_workers (int, optional): Number of threads used to scan the
+            subdirectories. Defaults to 8.
+        use_cache (bool, optional): Read and write the on-disk cache.
+            Defaults to True.
+
+    Returns:
+        Catalog: Catalog of the data files.
+    """
+
+    # Absolute paths, so that the cache is valid irrespective of the working directory
+    datadir = os.path.abspath(datadir)
+    cache_path = os.path.join(datadir, CACHE_FILENAME)
+    dir_mtimes = _dir_mtimes(datadir)
+
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached["dir_mtimes"] == dir_mtimes:
+                return Catalog(datadir, cached["records"], dir_mtimes)
+        except Exception as e:
+            warnings.warn(f"Ignoring the unreadable catalog cache {cache_path}: {e}")
+
+    subdirs = list(dir_mtimes)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = executor.map(lambda name: _scan_subdir(os.path.join(datadir, name), name), subdirs)
+        records = [record for result in results for record in result]
+
+    records = pd.DataFrame(records, columns=CATALOG_COLUMNS)
+
+    if use_cache:
+        try:
+            with open(cache_path, "wb") as f:
+                pickle.dump({"dir_mtimes": dir_mtimes, "records": records}, f)
+        except OSError as e:
+            warnings.warn(f"Could not write the catalog cache {cache_path}: {e}")
+
+    return Catalog(datadir, records, dir_mtimes)
+
+
+def get_catalog(datadir: str) -> Catalog:
+    """Returns the catalog of datadir. The catalog is kept in memory and only
+    rebuilt if a directory of the tree was modified.
+
+    Args:
+        datadir (str): Parent directory containing all the data files.
+
+    Returns:
+        Catalog: Catalog of the data files.
+    """
+
+    key = os.path.abspath(datadir)
+    catalog = _catalogs.get(key)
+    if catalog is None or catalog.is_stale():
+        catalog = build_catalog(datadir)
+        _catalogs[key] = catalog
+    return catalog
+
+
+def _read_stale(datadir: str) -> dict:
+    """Reads the stale registry of datadir. Every mark of a site series gets
+    the next version number. Every stage records the version of the series
+    that its output was last regenerated from:
+    {'version': int,
+     'marked': {'{scenario}_{variable}': {'{name}_{state}': version}},
+     'stages': {stage: {'{scenario}_{variable}': {'{name}_{state}': version}}}}"""
+
+    stale_path = os.path.join(datadir, STALE_FILENAME)
+    if not os.path.exists(stale_path):
+        return {"version": 0, "marked": {}, "stages": {}}
+    with open(stale_path, "r") as f:
+        return json.load(f)
+
+
+def _write_stale(datadir: str, stale: dict) -> None:
+    """Atomically replaces the stale registry of datadir."""
+
+    stale_path = os.path.join(datadir, STALE_FILENAME)
+    with open(stale_path + ".tmp", "w") as f:
+        json.dump(stale, f, indent=2, sort_keys=True)
+    os.replace(stale_path + ".tmp", stale_path)
+
+
+def _stage_key(datadir: str, stage: str) -> str:
+    """Output path of a stage relative to datadir, e.g. 'per_year_stats'."""
+
+    return os.path.relpath(os.path.abspath(stage), os.path.abspath(datadir))
+
+
+def mark_stale(datadir: str, scenario: str, variable: str, name: str, state: str) -> None:
+    """Marks the preprocess outputs of a site series as stale, e.g. after new
+    dates were appended to its model files by downloader.append_downloads().
+
+    The series is stale for every stage (output) until that stage is
+    regenerated for the site from current inputs, refer to clear_stale().
+
+    Args:
+        datadir (str): Parent directory containing all the data files.
+        scenario (str): Scenario of the series.
+        variable (str): Variable of the series.
+        name (str): Name Mnemonic of the site.
+        state (str): State code of the site.
+    """
+
+    stale = _read_stale(datadir)
+    stale["version"] += 1
+    stale["marked"].setdefault(f"{scenario}_{variable}", {})[f"{name}_{state}"] = stale["version"]
+    _write_stale(datadir, stale)
+
+
+def stale_sites(datadir: str, stage: str, sites: pd.DataFrame, scenarios: List[str], variables: List[str]) -> pd.DataFrame:
+    """Returns the sites with a series of any of the scenarios and variables
+    that was marked stale after the version that the stage output of the site
+    was last regenerated from, i.e. the sites whose stage output needs to be
+    recomputed. A stage that was regenerated from a stale upstream output is
+    still stale.
+
+    Args:
+        datadir (str): Parent directory containing all the data files.
+        stage (str): Output path of the stage, e.g.
+            os.path.join(datadir, 'climate_ensemble') or the store_dir of
+            series_store.build_series_store().
+        sites (pd.DataFrame): Data Frame containing all the site information.
+        scenarios (List[str]): Scenarios of interest.
+        variables (List[str]): Variables of interest.
+
+    Returns:
+        pd.DataFrame: Subset of the sites.
+    """
+
+    stale = _read_stale(datadir)
+    regenerated = stale["stages"].get(_stage_key(datadir, stage), {})
+
+    keys = set()
+    for sce in scenarios:
+        for var in variables:
+            stage_versions = regenerated.get(f"{sce}_{var}", {})
+            for site, version in stale["marked"].get(f"{sce}_{var}", {}).items():
+                if stage_versions.get(site, 0) < version:
+                    keys.add(site)
+
+    name_state = sites.NameMnemonic.astype(str) + "_" + sites.StateCode.astype(str)
+    return sites[name_state.isin(keys).to_numpy()]
+
+
+def clear_stale(
+    datadir: str,
+    stage: str,
+    regenerated: Dict[Tuple[str, str], List[Tuple[str, str]]],
+    upstream: str=None,
+) -> None:
+    """Records the version of the series that the stage output of the sites
+    was regenerated from. The other stages are not affected.
+
+    A stage that reads the model files directly (upstream is None) is
+    regenerated from the current series. A stage that reads the output of
+    another stage consumes the version recorded for the upstream stage, so
+    its output stays stale until the upstream stage is regenerated first and
+    then the stage itself. A warning is printed for the sites that were
+    regenerated from a stale upstream output.
+
+    Args:
+        datadir (str): Parent directory containing all the data files.
+        stage (str): Output path of the stage, refer to stale_sites().
+        regenerated (Dict[Tuple[str, str], List[Tuple[str, str]]]): The
+            (Name Mnemonic, State code) of the regenerated sites of every
+            (scenario, variable).
+        upstream (str, optional): Output path of the stage that the stage
+            reads, e.g. os.path.join(datadir, ENSEMBLE_STAGE) or a cube.
+            Defaults to None, i.e. the stage reads the model files.
+    """
+
+    # Nothing was ever marked stale in datadir
+    if not os.path.exists(os.path.join(datadir, STALE_FILENAME)):
+        return
+
+    stale = _read_stale(datadir)
+    stage_versions = stale["stages"].setdefault(_stage_key(datadir, stage), {})
+    upstream_versions = {} if upstream is None else stale["stages"].get(_stage_key(datadir, upstream), {})
+
+    # Only the marked series are recorded, which keeps the registry small
+    outdated = []
+    for (scenario, variable), names_states in regenerated.items():
+        marked = stale["marked"].get(f"{scenario}_{variable}", {})
+        for name, state in names_states:
+            site = f"{name}_{state}"
+            if site not in marked:
+                continue
+
+            # Version of the series in the input of the stage
+            if upstream is None:
+                consumed = marked[site]
+            else:
+                consumed = upstream_versions.get(f"{scenario}_{variable}", {}).get(site, 0)
+
+            if consumed < marked[site]:
+                outdated.append(f"{site}_{scenario}_{variable}")
+            stage_versions.setdefault(f"{scenario}_{variable}", {})[site] = consumed
+    _write_stale(datadir, stale)
+
+    if outdated:
+        print(f"WARNING: {len(outdated)} series were read from the stale output {upstream}: {', '.join(outdated)}. "
+              f"{stage} stays stale for them until {upstream} is regenerated first.")
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Tuple
+
+from joblib import Parallel, delayed
+
+from climate_resilience import aggregators
+from climate_resilience import preprocess
+from climate_resilience import series_store
+
+
+def _site_row_ranges(n_sites: int, site_chunk: int) -> List[Tuple[int, int]]:
+    """Splits the site rows into (start, end) chunks."""
+
+    return [(r0, min(r0 + site_chunk, n_sites)) for r0 in range(0, n_sites, site_chunk)]
+
+
+def _year_chunks(dates: np.ndarray, years_per_chunk: int) -> List[Tuple[int, int]]:
+    """Splits the days into (start, end) chunks of whole years."""
+
+    _, starts = preprocess._year_offsets(dates)
+    bounds = np.r_[starts[::years_per_chunk], len(dates)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _site_index(store: series_store.SeriesStore) -> pd.MultiIndex:
+    """(NameMnemonic, StateCode) index of the sites in the store order."""
+
+    return pd.MultiIndex.from_tuples(store.sites, names=["NameMnemonic", "StateCode"])
+
+
+def _annual_stats_task(
+    store_dir: str,
+    scenario: str,
+    variable: str,
+    rows: Tuple[int, int],
+    days: Tuple[int, int],
+    halo_days: int,
+    reducers: List[str],
+) -> Tuple[Tuple[int, int], np.ndarray, Dict[str, np.ndarray]]:
+    """Worker task: annual stats of a site chunk x time chunk block."""
+
+    store = series_store.open_store(store_dir)
+    all_dates = store.dates(scenario, variable)
+
+    # The halo days before the chunk are only used by the rolling window reducers
+    d0 = max(days[0] - halo_days, 0)
+    block = np.array(store._array(scenario, variable)[rows[0]:rows[1], d0:days[1]])
+    years, starts = preprocess._year_offsets(all_dates[days[0]:days[1]])
+    starts = starts + (days[0] - d0)
+
+    stats = {reducer: preprocess.ANNUAL_REDUCERS[reducer](block, starts) for reducer in reducers}
+    return rows, years, stats
+
+
+def annual_stats(
+    store_dir: str,
+    scenario: str,
+    variable: str,
+    reducers: List[str]=None,
+    site_chunk: int=512,
+    years_per_chunk: int=10,
+    halo_days: int=31,
+    n_jobs: int=-1,
+) -> Dict[str, pd.DataFrame]:
+    """Out-of-core version of the get_per_year_stats() calculation.
+
+    The site x day array of the series store is split into site-chunk x
+    time-chunk blocks of whole years. Every block is read from the memory
+    mapped store and reduced by a separate worker process, so the memory of
+    a worker is bounded by site_chunk x (years_per_chunk x 366 + halo_days)
+    values irrespective of the number of sites.
+
+    Args:
+        store_dir (str): Series store generated by
+            series_store.build_series_store().
+        scenario (str): Scenario of interest.
+        variable (str): Variable of interest.
+        reducers (List[str], optional): Annual statistics to calculate.
+            Any key of preprocess.ANNUAL_REDUCERS.
+            Defaults to None, i.e. ['maximum', 'mean', 'std'].
+        site_chunk (int, optional): Number of sites per block. Defaults to 512.
+        years_per_chunk (int, optional): Number of years per block.
+            Defaults to 10.
+        halo_days (int, optional): Number of days before every block that are
+            also read for the rolling window reducers (e.g. 'rx5day').
+            Defaults to 31.
+        n_jobs (int, optional): Number of worker processes. Defaults to -1,
+            i.e. all the CPUs.
+
+    Returns:
+        Dict[str, pd.DataFrame]: Site x year data frame of every reducer.
+
+    Raises:
+        ValueError: If any of the reducers is not one of the specified options.
+    """
+
+    if reducers is None:
+        reducers = ["maximum", "mean", "std"]
+
+    for reducer in reducers:
+        if reducer not in preprocess.ANNUAL_REDUCERS:
+            raise ValueError(f"Incorrect reducer '{reducer}'. Expecting one of these: {' | '.join(preprocess.ANNUAL_REDUCERS)}.")
+
+    store = series_store.open_store(store_dir)
+    dates = store.dates(scenario, variable)
+    all_years, _ = preprocess._year_offsets(dates)
+    year_cols = {year: j for j, year in enumerate(all_years)}
+
+    results = Parallel(n_jobs=n_jobs, verbose=5)(
+        delayed(_annual_stats_task)(store_dir, scenario, variable, rows, days, halo_days, reducers)
+        for rows in _site_row_ranges(len(store.sites), site_chunk)
+        for days in _year_chunks(dates, years_per_chunk)
+    )
+
+    outputs = {reducer: np.full((len(store.sites), len(all_years)), np.nan) for reducer in reducers}
+    for rows, years, stats in results:
+        cols = [year_cols[year] for year in years]
+        for reducer in reducers:
+            outputs[reducer][rows[0]:rows[1], cols] = stats[reducer]
+
+    site_index = _site_index(store)
+    return {reducer: pd.DataFrame(outputs[reducer], index=site_index, columns=all_years) for reducer in reducers}
+
+
+def _site_stats_task(
+    store_dir: str,
+    scenario: str,
+    variable: str,
+    rows: Tuple[int, int],
+    start: str,
+    end: str,
+    agg_function: str,
+    kwargs: dict,
+) -> Tuple[Tuple[int, int], np.ndarray]:
+    """Worker task: aggregation of a site chunk over the date range."""
+
+    store = series_store.open_store(store_dir)
+    i0, i1 = store._offsets(scenario, variable, start, end)
+    block = np.array(store._array(scenario, variable)[rows[0]:rows[1], i0:i1])
+    return rows, aggregators.AGGREGATORS[agg_function](block, **kwargs)
+
+
+def site_stats(
+    store_dir: str,
+    scenario: str,
+    variable: str,
+    agg_function: str="percentile",
+    start: str=None,
+    end: str=None,
+    site_chunk: int=256,
+    n_jobs: int=-1,
+    **kwargs: object
+) -> pd.Series:
+    """Out-of-core aggregation of every site over a date range, e.g. the 99th
+    percentile of calculate_Nth_percentile() or a sub period aggregation of
+    get_sub_period_stats().
+
+    The aggregators need the whole date range of a site, so the store is only
+    split in site chunks. The memory of a worker is bounded by
+    site_chunk x number of days values.
+
+    Args:
+        store_dir (str): Series store generated by
+            series_store.build_series_store().
+        scenario (str): Scenario of interest.
+        variable (str): Variable of interest.
+        agg_function (str, optional): Name of a registered aggregator in
+            aggregators.AGGREGATORS. Defaults to 'percentile'.
+        start (str, optional): First date (inclusive). Defaults to None.
+        end (str, optional): Last date (inclusive). Defaults to None.
+        site_chunk (int, optional): Number of sites per block. Defaults to 256.
+        n_jobs (int, optional): Number of worker processes. Defaults to -1,
+            i.e. all the CPUs.
+        kwargs (object, optional): Parameters of the aggregator,
+            e.g. q=99 for 'percentile'.
+
+    Returns:
+        pd.Series: Aggregated value of every site.
+
+    Raises:
+        ValueError: If agg_function is not a registered aggregator.
+    """
+
+    if agg_function not in aggregators.AGGREGATORS:
+        raise ValueError(f"Incorrect value passed for the 'agg_function'. Expecting one of these: {' | '.join(aggregators.AGGREGATORS)}.")
+
+    store = series_store.open_store(store_dir)
+    results = Parallel(n_jobs=n_jobs, verbose=5)(
+        delayed(_site_stats_task)(store_dir, scenario, variable, rows, start, end, agg_function, kwargs)
+        for rows in _site_row_ranges(len(store.sites), site_chunk)
+    )
+
+    output = np.full(len(store.sites), np.nan)
+    for rows, values in results:
+        output[rows[0]:rows[1]] = values
+
+    return pd.Series(output, index=_site_index(store), name=f"{scenario}_{variable}_{agg_function}")
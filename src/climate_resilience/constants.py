@@ -1,3 +1,7 @@
+import numpy as np
+import pandas as pd
+
+
 CONST = {
     "pr": {
         "multiply": 86400,
@@ -26,6 +30,39 @@ CONST = {
 }
 
 
+# States of each geographical region, in the order of the region codes
+REGION_STATES = {
+    'Southwest': ['CA','NV','AZ','NM','UT','CO'],
+    'Northwest': ['WA', 'OR','ID'],
+    'N. Great Plains': ['MT','WY','ND','SD','NE'],
+    'S. Great Plains': ['KS','OK','TX'],
+    'Southeast': ['LA','AR','TN','KY','MS','AL','GA','FL','SC','NC','VA'],
+    'Midwest': ['MN','IA','MO','WI','IL','IN','MI','OH'],
+    'Northeast': ['ME','VT','NH','MA','RI','CT','NJ','NY','PA','WV','MD','DE'],
+    'Alaska': ['AK'],
+    'Carribean': ['PR', 'VI'],
+    'Hawaii': ['HI'],
+}
+
+# Code of each geographical region
+REGION_CODES = {
+    'Southwest': 1,
+    'Northwest': 2,
+    'N. Great Plains': 3,
+    'S. Great Plains': 4,
+    'Southeast': 5,
+    'Midwest': 6,
+    'Northeast': 7,
+    'Alaska': 8,
+    'Carribean': 9,
+    'Hawaii': 10,
+}
+
+# Lookup tables from the state code to the region and the region code
+STATE_REGIONS = {state: region for region, states in REGION_STATES.items() for state in states}
+STATE_REGION_CODES = {state: REGION_CODES[region] for state, region in STATE_REGIONS.items()}
+
+
 def geog_by_states(state: str) -> str:
     """Returns geographical region based on the input state code.
     
@@ -39,27 +76,9 @@ def geog_by_states(state: str) -> str:
         ValueError: In case the input state is not one of the valid state codes.
     """
     
-    if state in ['CA','NV','AZ','NM','UT','CO']:
-        return 'Southwest'
-    elif state in ['WA', 'OR','ID']:
-        return 'Northwest'
-    elif state in ['MT','WY','ND','SD','NE']:
-        return 'N. Great Plains'
-    elif state in ['KS','OK','TX']:
-        return 'S. Great Plains'
-    elif state in ['LA','AR','TN','KY','MS','AL','GA','FL','SC','NC','VA']:
-        return 'Southeast'
-    elif state in ['MN','IA','MO','WI','IL','IN','MI','OH']:
-        return 'Midwest'
-    elif state in ['ME','VT','NH','MA','RI','CT','NJ','NY','PA','WV','MD','DE']:
-        return 'Northeast'
-    elif state in ['AK']:
-        return 'Alaska'
-    elif state in ['HI']:
-        return 'Hawaii'
-    elif state in ['PR', 'VI']:
-        return 'Carribean'
-    else:
+    try:
+        return STATE_REGIONS[state]
+    except (KeyError, TypeError):
         raise ValueError("Invalid State Code!")
 
 
@@ -76,25 +95,61 @@ def geog_by_states_code(state: str) -> int:
         ValueError: In case the input state is not one of the valid state codes.
     """
     
-    if state in ['CA','NV','AZ','NM','UT','CO']:
-        return 1
-    elif state in ['WA', 'OR','ID']:
-        return 2
-    elif state in ['MT','WY','ND','SD','NE']:
-        return 3
-    elif state in ['KS','OK','TX']:
-        return 4
-    elif state in ['LA','AR','TN','KY','MS','AL','GA','FL','SC','NC','VA']:
-        return 5
-    elif state in ['MN','IA','MO','WI','IL','IN','MI','OH']:
-        return 6
-    elif state in ['ME','VT','NH','MA','RI','CT','NJ','NY','PA','WV','MD','DE']:
-        return 7
-    elif state in ['AK']:
-        return 8
-    elif state in ['HI']:
-        return 10
-    elif state in ['PR', 'VI']:
-        return 9
-    else:
-        raise ValueError("Invalid State Code!")
\ No newline at end of file
+    try:
+        return STATE_REGION_CODES[state]
+    except (KeyError, TypeError):
+        raise ValueError("Invalid State Code!")
+
+
+def _map_states(states: pd.Series, lookup: dict) -> np.ndarray:
+    """Maps the unique state codes through the lookup table once and 
+    broadcasts the result to all the rows using the categorical codes."""
+    
+    states = pd.Categorical(states)
+    invalid = [state for state in states.categories if state not in lookup]
+    if invalid or (states.codes < 0).any():
+        raise ValueError(f"Invalid State Code! {invalid if invalid else 'Missing values'} in the input.")
+    
+    mapped = np.array([lookup[state] for state in states.categories])
+    return mapped[states.codes]
+
+
+def geog_by_states_column(states: pd.Series) -> pd.Series:
+    """Vectorized geog_by_states() for a whole column of state codes, 
+    e.g. sites.StateCode.
+    
+    Args:
+        states (pd.Series): State codes.
+    
+    Returns: 
+        pd.Series: Categorical series of the geographical regions with the 
+            same index as the input. The categories are ordered by the 
+            region codes.
+        
+    Raises:
+        ValueError: In case any of the input states is not one of the valid state codes.
+    """
+    
+    index = states.index if isinstance(states, pd.Series) else None
+    regions = pd.Categorical(_map_states(states, STATE_REGIONS), 
+                             categories=sorted(REGION_CODES, key=REGION_CODES.get))
+    return pd.Series(regions, index=index, name="Region")
+
+
+def geog_by_states_code_column(states: pd.Series) -> pd.Series:
+    """Vectorized geog_by_states_code() for a whole column of state codes, 
+    e.g. sites.StateCode.
+    
+    Args:
+        states (pd.Series): State codes.
+    
+    Returns: 
+        pd.Series: Integer series of the geographical region codes with the 
+            same index as the input.
+        
+    Raises:
+        ValueError: In case any of the input states is not one of the valid state codes.
+    """
+    
+    index = states.index if isinstance(states, pd.Series) else None
+    return pd.Series(_map_states(states, STATE_REGION_CODES), index=index, name="RegionCode")
@@ -0,0 +1,290 @@
+import os
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from typing import List, Tuple
+
+try:
+    import xarray as xr
+except ImportError:
+    xr = None
+
+from climate_resilience import catalog
+from climate_resilience import dataset
+
+
+# Site metadata columns that are stored as coordinates along the site dimension
+SITE_COORDS = ["OBJECTID", "ID", "NameMnemonic", "StateCode", "Latitude", "Longitude"]
+
+# Model coordinate values of the ensemble source
+ENSEMBLE_MODELS = ["ensemble_mean", "ensemble_std"]
+
+
+def _require_xarray() -> None:
+    """Raises an ImportError if the optional xarray dependency is missing."""
+
+    if xr is None:
+        raise ImportError("The NetCDF/Zarr cube requires xarray. \
+            Install it using 'pip install xarray netCDF4 zarr' or 'pip install climate-resilience[cube]'.")
+
+
+def _read_dated_columns(csv_path: str, columns: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads the date column and the value columns of a CSV file.
+    Returns the datetime64[D] dates and a day x column array."""
+
+    df = pd.read_csv(csv_path, usecols=["date"] + columns)
+    dates = pd.to_datetime(df["date"], errors="coerce")
+    valid = dates.notna().to_numpy()
+    return dates[valid].to_numpy().astype("datetime64[D]"), df.loc[valid, columns].to_numpy(dtype=np.float32)
+
+
+def _read_ensemble_partition(dataset_dir: str, scenario: str, variable: str, columns: List[str]) -> pd.DataFrame:
+    """Reads the rows of a scenario and variable of the 'climate_ensemble.parquet'
+    dataset of get_climate_ensemble(). The dates are converted to datetime64[D]."""
+
+    df = dataset.read_dataset(dataset_dir, columns=["date"] + columns, scenario=scenario, variable=variable)
+    df["date"] = df["date"].to_numpy().astype("datetime64[D]")
+    return df
+
+
+def build_cube(
+    sites: pd.DataFrame,
+    scenarios: List[str],
+    variables: List[str],
+    datadir: str,
+    output_path: str,
+    source: str="models",
+    ensemble_format: str="csv",
+    time_chunk: int=3660,
+    complevel: int=4,
+) -> str:
+    """Converts the CSV series into a single chunked and compressed
+    NetCDF4 or Zarr cube.
+
+    Every variable is a data variable with the dimensions
+    (site, scenario, model, time), i.e. the cube has the dimensions
+    site x scenario x variable x model x time. The site metadata (OBJECTID,
+    ID, NameMnemonic, StateCode, Latitude, Longitude) is stored as coordinates
+    of the site dimension. The time axis is the union of the dates of all the
+    files, missing values are nan. The date columns of all the files are read
+    first to build the time axis, then the files are read and written one
+    variable at a time, so only the array of one variable is held in memory.
+
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information.
+        scenarios (List[str]):  Scenarios of interest.
+        variables (List[str]):  Variables of interest.
+        datadir (str): Parent directory containing all the data files.
+        output_path (str): Path of the output cube. A '.zarr' extension writes
+            a Zarr store, anything else a NetCDF4 file.
+        source (str, optional): Files to convert. Defaults to 'models'.
+            Options: 'models' | 'ensemble'
+            'models': The per-model files downloaded by SitesDownloader in
+                datadir/{scenario}_{variable}/. The model coordinate contains
+                the model names.
+            'ensemble': The output of get_climate_ensemble(), i.e. the
+                datadir/climate_ensemble/{name}_{state}_{scenario}_{variable}.csv
+                files or the datadir/climate_ensemble.parquet dataset. The
+                model coordinate is ['ensemble_mean', 'ensemble_std'].
+        ensemble_format (str, optional): output_format that was used in
+            get_climate_ensemble(). Only used with the 'ensemble' source.
+            Defaults to 'csv'.
+            Options: 'csv' | 'parquet'
+        time_chunk (int, optional): Number of days per chunk. Defaults to 3660.
+        complevel (int, optional): Compression level. Defaults to 4.
+
+    Returns:
+        str: Path of the generated cube.
+
+    Raises:
+        ImportError: If xarray is not installed.
+        ValueError: If the value of source or ensemble_format is not one of
+            the specified options.
+        FileNotFoundError: If none of the files exist.
+    """
+
+    _require_xarray()
+
+    if source not in ["models", "ensemble"]:
+        raise ValueError("Incorrect value for source. Expecting one of these two: 'models' | 'ensemble'.")
+
+    if ensemble_format not in ["csv", "parquet"]:
+        raise ValueError("Incorrect value for ensemble_format. Expecting one of these two: 'csv' | 'parquet'.")
+
+    # The partitions of the parquet ensemble are read one scenario and variable at a time instead of per file
+    dataset_dir = os.path.join(datadir, "climate_ensemble.parquet") if source == "ensemble" and ensemble_format == "parquet" else None
+
+    file_catalog = catalog.get_catalog(datadir)
+    records = file_catalog.records
+    name_state_list = list(zip(sites.NameMnemonic, sites.StateCode))
+
+    if source == "models":
+        model_records = records[(records["kind"] == "model") & records["scenario"].isin(scenarios) & records["variable"].isin(variables)]
+        models = sorted(model_records["model"].dropna().unique())
+    else:
+        models = ENSEMBLE_MODELS
+
+    site_coords = {
+        col: ("site", sites[col].to_numpy()) for col in SITE_COORDS if col in sites
+    }
+    is_zarr = output_path.rstrip("/").endswith(".zarr")
+
+    # The 'climate_ensemble' directory is not part of the catalog, it is listed once instead
+    ensemble_dir = os.path.join(datadir, "climate_ensemble")
+    ensemble_files = set(os.listdir(ensemble_dir)) if source == "ensemble" and os.path.isdir(ensemble_dir) else set()
+
+    # Files and (model, column) cells of every site and scenario of every variable
+    files = {var: [] for var in variables}
+    for s, (name, state) in enumerate(name_state_list):
+        for c, sce in enumerate(scenarios):
+            for var in variables:
+                if source == "models":
+                    for path in file_catalog.model_files(sce, var, name, state):
+                        model = os.path.basename(path)[:-len(".csv")].split(f"_{sce}_{var}_", 1)[-1]
+                        if model in models:
+                            files[var].append((s, c, path, {models.index(model): "mean"}))
+                elif dataset_dir is None:
+                    filename = f"{name}_{state}_{sce}_{var}.csv"
+                    if filename in ensemble_files:
+                        files[var].append((s, c, os.path.join(ensemble_dir, filename), {0: "mean", 1: "std"}))
+
+    if not any(files.values()) and not (dataset_dir is not None and os.path.isdir(dataset_dir)):
+        raise FileNotFoundError(f"No {source} files found in '{datadir}' for the scenarios and variables of interest.")
+
+    # Reading only the dates of all the files first, so that all the variables share the same time axis.
+    # The files usually share a calendar, which is merged into the time axis only once.
+    time = np.array([], dtype="datetime64[D]")
+    calendar = None
+    with tqdm([path for var in variables for _, _, path, _ in files[var]]) as tqdm_paths:
+        tqdm_paths.set_description("Reading dates")
+
+        for path in tqdm_paths:
+            dates, _ = _read_dated_columns(path, [])
+            if calendar is None or not np.array_equal(dates, calendar):
+                calendar = dates
+                time = np.union1d(time, dates)
+
+    if dataset_dir is not None:
+        for sce in scenarios:
+            for var in variables:
+                time = np.union1d(time, _read_ensemble_partition(dataset_dir, sce, var, [])["date"].to_numpy())
+
+    site_index = pd.MultiIndex.from_tuples(name_state_list)
+
+    # Reading and writing one variable at a time. Only the array of this variable is held in memory.
+    regenerated = {}
+    for v, var in enumerate(variables):
+        data = np.full((len(name_state_list), len(scenarios), len(models), len(time)), np.nan, dtype=np.float32)
+        with tqdm(files[var]) as tqdm_files:
+            tqdm_files.set_description(f"Reading '{var}'")
+
+            for s, c, path, columns in tqdm_files:
+                dates, values = _read_dated_columns(path, list(columns.values()))
+                for k, m in enumerate(columns):
+                    data[s, c, m, np.searchsorted(time, dates)] = values[:, k]
+                regenerated.setdefault((scenarios[c], var), set()).add(name_state_list[s])
+
+        if dataset_dir is not None:
+            for c, sce in enumerate(scenarios):
+                df = _read_ensemble_partition(dataset_dir, sce, var, dataset.SITE_COLUMNS + ["mean", "std"])
+                rows = site_index.get_indexer(pd.MultiIndex.from_frame(df[dataset.SITE_COLUMNS]))
+                found = rows >= 0
+                t = np.searchsorted(time, df["date"].to_numpy()[found])
+                data[rows[found], c, 0, t] = df["mean"].to_numpy(dtype=np.float32)[found]
+                data[rows[found], c, 1, t] = df["std"].to_numpy(dtype=np.float32)[found]
+                regenerated.setdefault((sce, var), set()).update(name_state_list[s] for s in np.unique(rows[found]))
+
+        ds = xr.Dataset(
+            {var: (("site", "scenario", "model", "time"), data)},
+            coords={
+                "site": [f"{name}_{state}" for name, state in name_state_list],
+                "scenario": scenarios,
+                "model": models,
+                "time": time.astype("datetime64[ns]"),
+                **site_coords,
+            },
+        )
+
+        chunks = (1, 1, len(models), min(time_chunk, len(time)))
+        if is_zarr:
+            ds.to_zarr(output_path, mode="w" if v == 0 else "a", encoding={var: {"chunks": chunks}})
+        else:
+            encoding = {var: {"zlib": True, "complevel": complevel, "chunksizes": chunks}}
+            ds.to_netcdf(output_path, mode="w" if v == 0 else "a", encoding=encoding)
+
+        # Releasing the array of the variable once it is written
+        del data, ds
+
+    # The ensemble source is only as current as the get_climate_ensemble() output
+    catalog.clear_stale(datadir, output_path, regenerated, upstream=None if source == "models" else os.path.join(datadir, catalog.ENSEMBLE_STAGE))
+    print(f"STATUS UPDATE: The cube generated from build_cube() function is stored as {output_path}.")
+    return output_path
+
+
+def open_cube(path: str) -> "xr.Dataset":
+    """Lazily opens a cube generated by build_cube().
+
+    Args:
+        path (str): Path of the NetCDF4 file or Zarr store.
+
+    Returns:
+        xr.Dataset: The cube.
+
+    Raises:
+        ImportError: If xarray is not installed.
+    """
+
+    _require_xarray()
+
+    if path.rstrip("/").endswith(".zarr"):
+        return xr.open_zarr(path)
+    return xr.open_dataset(path)
+
+
+def cube_block(
+    cube: "xr.Dataset",
+    sites: pd.DataFrame,
+    scenario: str,
+    variable: str,
+    model: str=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads the site x day array of a scenario and variable from the cube in
+    one vectorized read. Days without values for any site are dropped.
+
+    Args:
+        cube (xr.Dataset): Cube opened with open_cube().
+        sites (pd.DataFrame): Sites to return, in this order. Sites missing in
+            the cube are returned as nan rows.
+        scenario (str): Scenario of interest.
+        variable (str): Variable of interest.
+        model (str, optional): Model of interest. Defaults to None, in which
+            case 'ensemble_mean' is used for ensemble cubes and the mean over
+            all the models otherwise.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Dates (datetime64[D]) and the
+            site x day float64 array. No days if the cube does not contain
+            the scenario, variable or model.
+    """
+
+    if variable not in cube.data_vars or scenario not in cube["scenario"].values or \
+            (model is not None and model not in cube["model"].values):
+        return np.array([], dtype="datetime64[D]"), np.full((len(sites), 0), np.nan)
+
+    da = cube[variable].sel(scenario=scenario)
+    if model is None:
+        if ENSEMBLE_MODELS[0] in da["model"].values:
+            da = da.sel(model=ENSEMBLE_MODELS[0])
+        else:
+            da = da.mean("model", skipna=True)
+    else:
+        da = da.sel(model=model)
+
+    keys = [f"{name}_{state}" for name, state in zip(sites.NameMnemonic, sites.StateCode)]
+    da = da.reindex(site=keys)
+
+    block = np.asarray(da.values, dtype=np.float64)
+    dates = da["time"].values.astype("datetime64[D]")
+
+    keep = ~np.all(np.isnan(block), axis=0)
+    return dates[keep], block[:, keep]
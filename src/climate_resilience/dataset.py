@@ -0,0 +1,198 @@
+import os
+import shutil
+import pandas as pd
+from tqdm import tqdm
+from typing import List
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# Columns that identify a site in the partitioned datasets
+SITE_COLUMNS = ["NameMnemonic", "StateCode"]
+
+
+def _require_pyarrow() -> None:
+    """Raises an ImportError if the optional pyarrow dependency is missing."""
+
+    if pa is None:
+        raise ImportError("The 'parquet' output format requires pyarrow. \
+            Install it using 'pip install pyarrow' or 'pip install climate-resilience[parquet]'.")
+
+
+class PartitionedDatasetWriter:
+    """Buffered writer for a single partitioned Parquet dataset.
+
+    Rows of all the sites are collected in memory and written out in large
+    Parquet files, one per partition per flush, instead of one small file per
+    site. The dataset directory follows the hive layout,
+    i.e. 'root_dir/scenario=rcp45/variable=pr/part-0-0.parquet'.
+
+    An existing dataset in root_dir is removed when the writer is created,
+    so the dataset only ever contains the rows written by a single run.
+
+    Example Usage:
+        with PartitionedDatasetWriter(root_dir, ["scenario", "variable"]) as writer:
+            writer.write(df)
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        partition_cols: List[str]=None,
+        buffer_rows: int=5_000_000,
+    ) -> None:
+        """Initializes the PartitionedDatasetWriter object.
+
+        Args:
+            root_dir (str): Output directory of the dataset. Any existing
+                content of the directory is removed.
+            partition_cols (List[str], optional): Columns used to partition
+                the dataset. Defaults to None, i.e. no partitioning.
+            buffer_rows (int, optional): Number of buffered rows after which
+                the buffer is flushed to disk. Defaults to 5,000,000.
+
+        Raises:
+            ImportError: If pyarrow is not installed.
+        """
+
+        _require_pyarrow()
+
+        self.root_dir = root_dir
+        self.partition_cols = partition_cols
+        self.buffer_rows = buffer_rows
+
+        self._buffer = []
+        self._buffered_rows = 0
+        self._n_flushes = 0
+
+        # The file names restart at part-0-0 in every run, so the files of a
+        # previous run would be mixed with (or partially overwritten by) this one
+        if os.path.isdir(self.root_dir):
+            shutil.rmtree(self.root_dir)
+        os.makedirs(self.root_dir)
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Adds the rows to the buffer. The buffer is flushed if it is full.
+
+        Args:
+            df (pd.DataFrame): Rows to be written. Must contain the partition
+                columns.
+        """
+
+        self._buffer.append(df)
+        self._buffered_rows += len(df)
+
+        if self._buffered_rows >= self.buffer_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes all the buffered rows to the dataset."""
+
+        if not self._buffer:
+            return
+
+        table = pa.Table.from_pandas(pd.concat(self._buffer, ignore_index=True), preserve_index=False)
+        pq.write_to_dataset(
+            table,
+            root_path=self.root_dir,
+            partition_cols=self.partition_cols,
+            basename_template=f"part-{self._n_flushes}-{{i}}.parquet",
+        )
+
+        self._buffer = []
+        self._buffered_rows = 0
+        self._n_flushes += 1
+
+    def close(self) -> None:
+        """Flushes the remaining rows."""
+
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_dataset(dataset_dir: str, columns: List[str]=None, **filters: object) -> pd.DataFrame:
+    """Reads a partitioned dataset generated by PartitionedDatasetWriter.
+
+    Args:
+        dataset_dir (str): Directory of the dataset.
+        columns (List[str], optional): Columns to read. Defaults to None,
+            i.e. all the columns.
+        filters (object, optional): Equality filters on any column.
+            Example: read_dataset(dataset_dir, scenario="rcp45", NameMnemonic="AMB")
+
+    Returns:
+        pd.DataFrame: Rows of the dataset that match all the filters.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+    """
+
+    _require_pyarrow()
+
+    pq_filters = [(col, "==", val) for col, val in filters.items()] or None
+    df = pd.read_parquet(dataset_dir, columns=columns, filters=pq_filters)
+
+    # Partition columns are read back as categoricals
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+
+    return df
+
+
+def export_site_csvs(dataset_dir: str, output_dir: str, layout: str) -> None:
+    """Compatibility exporter that writes a partitioned dataset back to the
+    per-site CSV layout of the corresponding preprocess function.
+
+    Args:
+        dataset_dir (str): Directory of the dataset.
+        output_dir (str): Directory where the per-site CSVs are stored.
+        layout (str): CSV layout to generate.
+            Options: 'climate_ensemble' | 'per_year_stats'
+            'climate_ensemble': {name}_{state}_{scenario}_{variable}.csv
+                with the date, mean, and std columns.
+            'per_year_stats': {name}_{state}_PMP.csv with year as index.
+
+    Raises:
+        ValueError: If the value of layout is not one of the specified options.
+    """
+
+    if layout == "climate_ensemble":
+        group_cols = SITE_COLUMNS + ["scenario", "variable"]
+        filename_format = "{0}_{1}_{2}_{3}.csv"
+    elif layout == "per_year_stats":
+        group_cols = SITE_COLUMNS
+        filename_format = "{0}_{1}_PMP.csv"
+    else:
+        raise ValueError("Incorrect value for layout. Expecting one of these two: 'climate_ensemble' | 'per_year_stats'.")
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    df = read_dataset(dataset_dir)
+
+    with tqdm(df.groupby(group_cols, sort=False)) as tqdm_groups:
+        tqdm_groups.set_description("Exporting CSVs")
+
+        for keys, df_site in tqdm_groups:
+            df_site = df_site.drop(columns=group_cols)
+
+            if layout == "climate_ensemble":
+                df_site = df_site.sort_values("date").reset_index(drop=True)
+            else:
+                df_site = df_site.sort_values("year").set_index("year")
+                df_site.index.name = None
+
+            df_site.to_csv(os.path.join(output_dir, filename_format.format(*keys)))
+
+    print(f"STATUS UPDATE: The CSVs exported from '{dataset_dir}' are stored in the '{output_dir}' directory.")
@@ -1,4 +1,5 @@
 import os
+import functools
 import itertools
 import numpy as np
 import pandas as pd
@@ -16,11 +17,229 @@ from joblib import Parallel, delayed
 parallel_function = Parallel(n_jobs=-1, verbose=5)
 
 from climate_resilience import utils
+from climate_resilience import catalog
 from climate_resilience import constants as C
 # import utils
 # import constants as c
 
 
+# Image collection, image frequency and the use of the model of every download mode
+DOWNLOAD_MODES = {
+    "average_daily": {"dataset": "NASA/NEX-GDDP", "freq": "D", "per_model": False},
+    "daily": {"dataset": "NASA/NEX-GDDP", "freq": "D", "per_model": True},
+    "monthly": {"dataset": "NASA/NEX-DCP30_ENSEMBLE_STATS", "freq": "MS", "per_model": False},
+    "monthly_multiband": {"dataset": "NASA/NEX-DCP30_ENSEMBLE_STATS", "freq": "MS", "per_model": False},
+}
+
+# Number of models in NASA/NEX-GDDP, i.e. images per day of an unfiltered scenario
+NEX_GDDP_N_MODELS = 21
+
+# Approximate size of an exported CSV row in bytes for every download mode
+# 'average_daily': system:index, mean and .geo columns
+# 'daily': 'YYYY-MM-DD' date and mean columns
+# 'monthly': 'YYYY-MM' date and mean columns
+# 'monthly_multiband': 'YYYY-MM' date column, plus EXPORT_BAND_BYTES per band
+EXPORT_ROW_BYTES = {
+    "average_daily": 100,
+    "daily": 32,
+    "monthly": 29,
+    "monthly_multiband": 9,
+}
+EXPORT_BAND_BYTES = 20
+
+
+def task_description(mode: str, name: str, state: str, scenario: str, variable: str, model: str) -> str:
+    """Returns the export description, i.e. the output file name, of a 
+    download task. For the 'monthly_multiband' mode, variable is the tuple of 
+    variables (or the '+' joined variables of a plan) and all of them are part 
+    of the description, so different variable sets never share a file."""
+    
+    if mode == "average_daily":
+        return f"{name}_{state}_{scenario}_{variable}_daily"
+    elif mode == "daily":
+        return f"{name}_{state}_{scenario}_{variable}_{model}"
+    elif mode == "monthly":
+        return f"{name}_{state}_{scenario}_{variable}_monthly"
+    elif mode == "monthly_multiband":
+        variables = variable.split("+") if isinstance(variable, str) else variable
+        return f"{name}_{state}_{scenario}_{'-'.join(variables)}_monthly"
+    else:
+        raise ValueError("Incorrect value for mode.")
+
+
+def local_series_path(datadir: str, mode: str, name: str, state: str, scenario: str, variable: str, model: str) -> str:
+    """Returns the path of the local copy of a download task output, i.e.
+    datadir/{scenario}_{variable}/{description}.csv, or
+    datadir/{scenario}_monthly/{description}.csv for the 'monthly_multiband' mode."""
+    
+    dirname = f"{scenario}_monthly" if mode == "monthly_multiband" else f"{scenario}_{variable}"
+    return os.path.join(datadir, dirname, f"{task_description(mode, name, state, scenario, variable, model)}.csv")
+
+
+def _last_date(csv_path: str) -> Optional[pd.Timestamp]:
+    """Reads the last value of the 'date' column of a CSV file without reading
+    the whole file. Returns None if the file has no dated rows."""
+    
+    with open(csv_path, "rb") as f:
+        header = f.readline().decode().strip().split(",")
+        if "date" not in header:
+            return None
+        
+        # Only the tail of the file is read to find the last line
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        tail = b""
+        while size > 0:
+            step = min(4096, size)
+            size -= step
+            f.seek(size)
+            tail = f.read(step) + tail
+            lines = tail.splitlines()
+            if len([line for line in lines if line.strip()]) >= 2 or size == 0:
+                break
+    
+    last_line = [line for line in tail.splitlines() if line.strip()][-1].decode().strip()
+    if last_line.split(",") == header:
+        return None
+    return pd.Timestamp(last_line.split(",")[header.index("date")])
+
+
+# Orders in which the download configurations can be submitted
+SCHEDULING_POLICIES = ["product", "historical_first", "round_robin"]
+
+
+def schedule_download_configs(
+    download_configs: List[Tuple[object]], 
+    policy: str="product", 
+    priorities: dict=None,
+) -> List[Tuple[object]]:
+    """Orders the download configurations for submission. joblib dispatches the 
+    tasks in this order, so it decides which outputs become available first.
+    
+    The configurations are split into (scenario, variable) buckets. The 
+    'round_robin' and 'historical_first' policies interleave the buckets one 
+    site at a time, keeping all the models of a site together, so that 
+    complete site inputs of get_climate_ensemble() arrive early for every 
+    variable instead of one variable after the other.
+    
+    Args:
+        download_configs (List[Tuple[object]]): Configurations in the format 
+            of _download_samples_util().
+        policy (str, optional): Scheduling policy. Defaults to 'product'.
+            Options: 'product' | 'historical_first' | 'round_robin'
+            'product': Original itertools.product() order.
+            'historical_first': The 'historical' scenario buckets first, each 
+                group of buckets interleaved round robin.
+            'round_robin': All the buckets interleaved round robin.
+        priorities (dict, optional): User priorities of the buckets, lower 
+            values are submitted first, e.g. 
+            {"scenario": {"historical": 0, "rcp85": 1}, "variable": {"pr": 0}}. 
+            Scenarios and variables without a priority come last. Buckets of 
+            equal priority are ordered by the policy. Defaults to None.
+    
+    Returns:
+        List[Tuple[object]]: Ordered configurations.
+    
+    Raises:
+        ValueError: If the value of policy is not one of the specified options.
+    """
+    
+    if policy not in SCHEDULING_POLICIES:
+        raise ValueError(f"Incorrect value for policy. Expecting one of these: {' | '.join(SCHEDULING_POLICIES)}.")
+    
+    priorities = priorities or {}
+    scenario_priorities = priorities.get("scenario", {})
+    variable_priorities = priorities.get("variable", {})
+    
+    def rank(scenario: str, variable: str) -> tuple:
+        bucket_rank = (scenario_priorities.get(scenario, np.inf), variable_priorities.get(variable, np.inf))
+        if policy == "historical_first":
+            bucket_rank = (scenario != "historical",) + bucket_rank
+        return bucket_rank
+    
+    if policy == "product":
+        return sorted(download_configs, key=lambda config: rank(config[3], config[1]))
+    
+    # Site units (all the models of a site) per (scenario, variable) bucket
+    buckets = {}
+    for config in download_configs:
+        llns, variable, model, scenario = config
+        units = buckets.setdefault((scenario, variable), {})
+        units.setdefault(llns, []).append(config)
+    
+    ordered = []
+    bucket_keys = sorted(buckets, key=lambda key: rank(*key))
+    for _, keys in itertools.groupby(bucket_keys, key=lambda key: rank(*key)):
+        unit_lists = [list(buckets[key].values()) for key in keys]
+        for units in itertools.zip_longest(*unit_lists):
+            for unit in units:
+                if unit is not None:
+                    ordered.extend(unit)
+    
+    return ordered
+
+
+@functools.lru_cache(maxsize=1024)
+def scaled_collection(
+    backend: object, 
+    dataset: str, 
+    variable: Union[str, Tuple[str]], 
+    scenario: str, 
+    model: Optional[str], 
+    start_date: datetime, 
+    end_date: datetime,
+) -> ee.ImageCollection:
+    """Builds the filtered image collection of a variable with the 
+    multiply/add scaling from C.CONST applied to every image.
+    
+    If a tuple of variables is passed, all the bands are selected at once and 
+    each band is scaled with its own multiply/add values server-side using 
+    constant images.
+    
+    The expression only depends on the dataset, variable, scenario, model and 
+    date range, so it is built once per process and shared by all the 
+    download configurations that only differ in the site geometry.
+    The cache only saves the client-side construction of the expression: 
+    every joblib worker process has its own cache, and every export task 
+    still serializes the full expression graph when it is started.
+    
+    Args:
+        backend (object): Earth Engine API, i.e. the ee module or a 
+            fake_ee.FakeEarthEngine object.
+        dataset (str): Image collection id.
+        variable (Union[str, Tuple[str]]): Variable (band) of interest, or a 
+            tuple of variables.
+        scenario (str): Scenario of interest.
+        model (Optional[str]): Model of interest. No model filter is applied 
+            if None.
+        start_date (datetime): Starting date (inclusive).
+        end_date (datetime): Ending date (exclusive).
+    
+    Returns:
+        ee.ImageCollection: Scaled image collection. The images keep their 
+            'system:time_start' property.
+    """
+    
+    bands = list(variable) if isinstance(variable, tuple) else variable
+    collection = backend.ImageCollection(dataset) \
+                        .filterDate(start_date, end_date) \
+                        .select(bands) \
+                        .filter(backend.Filter.eq('scenario', scenario))
+    if model is not None:
+        collection = collection.filter(backend.Filter.eq('model', model))
+    
+    if isinstance(variable, tuple):
+        # Band-wise scaling. The output bands keep the names of the selected bands.
+        multiply = backend.Image.constant([C.CONST[band]["multiply"] for band in variable])
+        add = backend.Image.constant([C.CONST[band]["add"] for band in variable])
+    else:
+        multiply = C.CONST[variable]["multiply"]
+        add = C.CONST[variable]["add"]
+    return collection.map(lambda img: backend.Image(img.multiply(multiply) \
+                                                       .add(add) \
+                                                       .copyProperties(img, ['system:time_start'])))
+
+
 class SitesDownloader:
     def __init__(
         self, 
@@ -30,6 +249,7 @@ class SitesDownloader:
         longitudes: Optional[Union[Tuple[float], List[float]]]=None,
         latitude_range: Optional[Union[Tuple[float], List[float]]]=None, 
         longitude_range: Optional[Union[Tuple[float], List[float]]]=None,
+        backend: object=None,
     ) -> None:
         """Initializes the SitesDownloader object.
         
@@ -53,6 +273,10 @@ class SitesDownloader:
                 mentioned in the input JSON file. Defaults to None.
                 Must be either a range of min and max values passed as a tuple 
                 or list. Overrides longitudes.
+            backend (object, optional): Earth Engine API to submit the tasks 
+                to. Defaults to None, i.e. the ee module. A 
+                fake_ee.FakeEarthEngine object can be passed for offline 
+                end-to-end and load tests.
         
         Raises:
             ValueError: If latitude range is not a tuple of min, max values, 
@@ -68,6 +292,7 @@ class SitesDownloader:
         """
         
         self.folder = folder
+        self.ee = ee if backend is None else backend
         
         self.site_json_file_path = site_json_file_path
         self.sites = gpd.read_file(self.site_json_file_path)
@@ -105,7 +330,7 @@ class SitesDownloader:
                     raise TypeError("Incorrect input. Check the input for longitudes again.")
 
 
-    def download_model_average_daily(self, start_date: datetime, end_date: datetime, variable: str, scenario: str, geom: ee.Geometry.Point, name: str, state: str) -> ee.batch.Task:
+    def download_model_average_daily(self, start_date: datetime, end_date: datetime, variable: str, scenario: str, geom: ee.Geometry.Point, name: str, state: str, desc_suffix: str="") -> ee.batch.Task:
         """Download average daily data.
         
         Args:
@@ -118,6 +343,8 @@ class SitesDownloader:
             geom (ee.Geometry.Point): Site location in latitude and longitude.
             name (str): Name Mnemonic of the site.
             state (str): Site location state code.
+            desc_suffix (str, optional): Suffix of the export description, e.g. the 
+                start date of an incremental download. Defaults to ''.
         
         Returns:
             ee.batch.Task: Returns the google earth engine task that performs the download process.
@@ -127,23 +354,18 @@ class SitesDownloader:
         if variable not in C.CONST:
             raise ValueError("Incorrect variable.")
             
-        # Get CMIP5 image collection
-        CMIP5 = ee.ImageCollection('NASA/NEX-GDDP') \
-                    .filterDate(start_date, end_date) \
-                    .select(variable) \
-                    .filter(ee.Filter.eq('scenario', scenario)) \
-
-        timeseries = ee.FeatureCollection(CMIP5.map(lambda img: img.multiply(C.CONST[variable]["multiply"]) \
-                                                                    .add(C.CONST[variable]["add"]) \
-                                                                    .reduceRegions(geom, ee.Reducer.mean(), 500) \
+        # Get the (cached) scaled CMIP5 image collection. Only the geometry varies per site.
+        CMIP5 = scaled_collection(self.ee, 'NASA/NEX-GDDP', variable, scenario, None, start_date, end_date)
+
+        timeseries = self.ee.FeatureCollection(CMIP5.map(lambda img: img.reduceRegions(geom, self.ee.Reducer.mean(), 500) \
                                                                     .first() \
                                                    )
                                          )
         
         # Possible destinations for the downloaded files: 
         # toDrive; toCloud; toAsset. We can add support for other destinations later as and when needed.
-        desc_name = f"{name}_{state}_{scenario}_{variable}_daily"
-        my_task = ee.batch.Export.table.toDrive(
+        desc_name = task_description("average_daily", name, state, scenario, variable, None) + desc_suffix
+        my_task = self.ee.batch.Export.table.toDrive(
                             collection = timeseries,
                             fileFormat='csv',
                             folder = os.path.join(self.folder, scenario, variable),
@@ -156,7 +378,7 @@ class SitesDownloader:
         return my_task
 
     
-    def download_historical_daily(self, start_date: datetime, end_date: datetime, variable: str, scenario: str, model: str, geom: ee.Geometry.Point, name: str, state: str) -> ee.batch.Task:
+    def download_historical_daily(self, start_date: datetime, end_date: datetime, variable: str, scenario: str, model: str, geom: ee.Geometry.Point, name: str, state: str, desc_suffix: str="") -> ee.batch.Task:
         """Download daily data.
         
         Args:
@@ -170,6 +392,8 @@ class SitesDownloader:
             geom (ee.Geometry.Point): Site location in latitude and longitude.
             name (str): Name Mnemonic of the site.
             state (str): Site location state code.
+            desc_suffix (str, optional): Suffix of the export description, e.g. the 
+                start date of an incremental download. Defaults to ''.
         
         Returns:
             ee.batch.Task: Returns the google earth engine task that performs the download process.
@@ -179,25 +403,19 @@ class SitesDownloader:
         if variable not in C.CONST:
             raise ValueError("Incorrect variable.")
         
-        # Get CMIP5 image collection
-        CMIP5 = ee.ImageCollection('NASA/NEX-GDDP') \
-                  .filterDate(start_date, end_date) \
-                  .select(variable) \
-                  .filter(ee.Filter.eq('scenario', scenario)) \
-                  .filter(ee.Filter.eq('model', model))
+        # Get the (cached) scaled CMIP5 image collection. Only the geometry varies per site.
+        CMIP5 = scaled_collection(self.ee, 'NASA/NEX-GDDP', variable, scenario, model, start_date, end_date)
 
-        timeseries = ee.FeatureCollection(CMIP5.map(lambda img: img.multiply(C.CONST[variable]["multiply"]) \
-                                                                    .add(C.CONST[variable]["add"]) \
-                                                                    .reduceRegions(geom,ee.Reducer.mean(),500) \
+        timeseries = self.ee.FeatureCollection(CMIP5.map(lambda img: img.reduceRegions(geom,self.ee.Reducer.mean(),500) \
                                                                     .first() \
-                                                                    .set('date', ee.Date(img.date()).format('YYYY-MM-DD')) \
+                                                                    .set('date', self.ee.Date(img.date()).format('YYYY-MM-DD')) \
                                                    )
                                          )
         
         # Possible destinations for the downloaded files: 
         # toDrive; toCloud; toAsset. We can add support for other destinations later as and when needed.
-        desc_name = f"{name}_{state}_{scenario}_{variable}_{model}"
-        my_task = ee.batch.Export.table.toDrive(
+        desc_name = task_description("daily", name, state, scenario, variable, model) + desc_suffix
+        my_task = self.ee.batch.Export.table.toDrive(
                             collection = timeseries,
                             fileFormat='csv',
                             folder = os.path.join(self.folder, scenario, variable),
@@ -208,7 +426,7 @@ class SitesDownloader:
         return my_task
 
 
-    def download_historical_monthly(self, start_date: datetime, end_date: datetime, variable: str, scenario: str, model: str, geom: ee.Geometry.Point, name: str, state: str) -> ee.batch.Task:
+    def download_historical_monthly(self, start_date: datetime, end_date: datetime, variable: str, scenario: str, model: str, geom: ee.Geometry.Point, name: str, state: str, desc_suffix: str="") -> ee.batch.Task:
         """Download monthly data.
         
         Args:
@@ -222,6 +440,8 @@ class SitesDownloader:
             geom (ee.Geometry.Point): Site location in latitude and longitude.
             name (str): Name Mnemonic of the site.
             state (str): Site location state code.
+            desc_suffix (str, optional): Suffix of the export description, e.g. the 
+                start date of an incremental download. Defaults to ''.
         
         Returns:
             ee.batch.Task: Returns the google earth engine task that performs the download process.
@@ -231,24 +451,19 @@ class SitesDownloader:
         if variable not in C.CONST:
             raise ValueError("Incorrect variable.")
         
-        # Get CMIP5 image collection
-        CMIP5 = ee.ImageCollection('NASA/NEX-DCP30_ENSEMBLE_STATS') \
-                  .filterDate(start_date, end_date) \
-                  .select(variable) \
-                  .filter(ee.Filter.eq('scenario', scenario)) \
+        # Get the (cached) scaled CMIP5 image collection. Only the geometry varies per site.
+        CMIP5 = scaled_collection(self.ee, 'NASA/NEX-DCP30_ENSEMBLE_STATS', variable, scenario, None, start_date, end_date)
 
-        timeseries = ee.FeatureCollection(CMIP5.map(lambda img: img.multiply(C.CONST[variable]["multiply"]) \
-                                                                    .add(C.CONST[variable]["add"]) \
-                                                                    .reduceRegions(geom,ee.Reducer.mean(),500) \
+        timeseries = self.ee.FeatureCollection(CMIP5.map(lambda img: img.reduceRegions(geom,self.ee.Reducer.mean(),500) \
                                                                     .first() \
-                                                                    .set('date', ee.Date(img.date()).format('YYYY-MM'))
+                                                                    .set('date', self.ee.Date(img.date()).format('YYYY-MM'))
                                                    )
                                          )
 
         # Possible destinations for the downloaded files: 
         # toDrive; toCloud; toAsset. We can add support for other destinations later as and when needed.
-        desc_name = f"{name}_{state}_{scenario}_{variable}_monthly"
-        my_task = ee.batch.Export.table.toDrive(
+        desc_name = task_description("monthly", name, state, scenario, variable, model) + desc_suffix
+        my_task = self.ee.batch.Export.table.toDrive(
                             collection = timeseries,
                             fileFormat='csv',
                             folder = os.path.join(self.folder, scenario, variable),
@@ -260,30 +475,88 @@ class SitesDownloader:
 
     
     
-    def _download_samples_util(self, download_config: List[object], params: dict, mode: str) -> None:
+    def download_monthly_multiband(self, start_date: datetime, end_date: datetime, variables: List[str], scenario: str, geom: ee.Geometry.Point, name: str, state: str, desc_suffix: str="") -> ee.batch.Task:
+        """Download monthly data of multiple variables in a single task.
+        
+        All the variables are selected as bands of the same images and scaled 
+        server-side, so a single wide table with a 'date' column and one column 
+        per variable is exported instead of one table per variable.
+        
+        Args:
+            start_date (datetime): Starting date of the dataset to download. 
+                Format: YYYY-MM-DD
+            end_date (datetime): Ending date of the dataset to download.
+                Format: YYYY-MM-DD
+            variables (List[str]): Variables of interest, e.g. 
+                ['pr', 'tasmin', 'tasmax', 'pr_mean'].
+            scenario (str): Scenario of interest.
+            geom (ee.Geometry.Point): Site location in latitude and longitude.
+            name (str): Name Mnemonic of the site.
+            state (str): Site location state code.
+            desc_suffix (str, optional): Suffix of the export description, e.g. the 
+                start date of an incremental download. Defaults to ''.
+        
+        Returns:
+            ee.batch.Task: Returns the google earth engine task that performs the download process.
+                Not necessaily useful for basic download commands.
+        """
+        
+        variables = tuple(variables)
+        for variable in variables:
+            if variable not in C.CONST:
+                raise ValueError("Incorrect variable.")
+        
+        # Get the (cached) scaled multi-band CMIP5 image collection. Only the geometry varies per site.
+        CMIP5 = scaled_collection(self.ee, 'NASA/NEX-DCP30_ENSEMBLE_STATS', variables, scenario, None, start_date, end_date)
+        
+        # The mean reduction of a multi-band image has one property per band. 
+        # The output of a single band is named 'mean' unless it is renamed.
+        reducer = self.ee.Reducer.mean() if len(variables) > 1 else self.ee.Reducer.mean().setOutputs(list(variables))
+        timeseries = self.ee.FeatureCollection(CMIP5.map(lambda img: img.reduceRegions(geom,reducer,500) \
+                                                                    .first() \
+                                                                    .set('date', self.ee.Date(img.date()).format('YYYY-MM'))
+                                                   )
+                                         )
+        
+        desc_name = task_description("monthly_multiband", name, state, scenario, variables, None) + desc_suffix
+        my_task = self.ee.batch.Export.table.toDrive(
+                            collection = timeseries,
+                            fileFormat='csv',
+                            folder = os.path.join(self.folder, scenario, "monthly"),
+                            description = desc_name,
+                            selectors=['date'] + list(variables))
+        my_task.start()
+        print(f"Downloading... {desc_name}")
+        return my_task
+    
+    
+    def _download_samples_util(self, download_config: List[object], params: dict, mode: str) -> ee.batch.Task:
         """Private utility function to download all the data samples from Google Earth Engine.
         
         Args:
             download_config (List[object]): List of parameters containing a single download configuration.
                 item 0: Tuple of site Latitude, Longitude, NameMnemonic, and StateCode
-                item 1: Variable
+                item 1: Variable (tuple of variables for the 'monthly_multiband' mode)
                 item 2: Model
                 item 3: Scenario
             params (dict): Dictionary of YAML file parameters.
             mode (str): Type of dataset to download from the Google Earth Engine.
-                Possible values: 'average_daily' | 'daily' | 'monthly'
+                Possible values: 'average_daily' | 'daily' | 'monthly' | 'monthly_multiband'
+        
+        Returns:
+            ee.batch.Task: The started download task.
         
         Raises:
             ee.ee_exception.EEException: Raises this expection if there is some issue with Google Earth Engine authentication.
             ValueError: Raises this exception in following conditions:
                 1. if the number of items in download_config List is not 4.
-                2. if the value for mode is anything other than the 3 options mentioned above.
+                2. if the value for mode is anything other than the 4 options mentioned above.
         """
         
         # Initialize Google Earth Engine
         try:
-            ee.Initialize()
-        except ee.ee_exception.EEException as ee_exp:
+            self.ee.Initialize()
+        except self.ee.ee_exception.EEException as ee_exp:
             raise Exception(f"{ee_exp}\n\n\n \
                    Encountered issue with the Google Earth Engine Authentication. \
                    Try again after proper authentication.\n \
@@ -300,14 +573,15 @@ class SitesDownloader:
         llns_i, variable_i, model_i, scenario_i = download_config
         
         lat, long, name, state = llns_i
-        geoPoint = ee.Geometry.Point(long, lat)
+        geoPoint = self.ee.Geometry.Point(long, lat)
         
         start_date = datetime.strptime(params["start_date"], "%Y-%m-%d")
         end_date = datetime.strptime(params["end_date"], "%Y-%m-%d")
+        desc_suffix = params.get("description_suffix", "")
         
         # Downloading data based on the mode selected
         if mode == "average_daily":
-            self.download_model_average_daily(
+            return self.download_model_average_daily(
                 start_date=start_date, 
                 end_date=end_date, 
                 variable=variable_i, 
@@ -315,10 +589,11 @@ class SitesDownloader:
                 geom=geoPoint, 
                 name=name, 
                 state=state,
+                desc_suffix=desc_suffix,
             )
             
         elif mode == "daily":
-            self.download_historical_daily(
+            return self.download_historical_daily(
                 start_date=start_date, 
                 end_date=end_date, 
                 variable=variable_i, 
@@ -327,10 +602,11 @@ class SitesDownloader:
                 geom=geoPoint, 
                 name=name, 
                 state=state,
+                desc_suffix=desc_suffix,
             )
             
         elif mode == "monthly":
-            self.download_historical_monthly(
+            return self.download_historical_monthly(
                 start_date=start_date, 
                 end_date=end_date, 
                 variable=variable_i, 
@@ -339,46 +615,391 @@ class SitesDownloader:
                 geom=geoPoint, 
                 name=name, 
                 state=state,
+                desc_suffix=desc_suffix,
+            )
+            
+        elif mode == "monthly_multiband":
+            return self.download_monthly_multiband(
+                start_date=start_date, 
+                end_date=end_date, 
+                variables=variable_i, 
+                scenario=scenario_i, 
+                geom=geoPoint, 
+                name=name, 
+                state=state,
+                desc_suffix=desc_suffix,
             )
             
         else:
             raise ValueError("Incorrect value for mode.")
     
     
-    def download_samples(self, params_yaml_file: str, mode: str) -> None:
-        """Download all the data samples from the Google Earth Engine based on
-        YAML file download configuration parameters.
-        
-        Args:
-            params_yaml_files (str): Path to the YAML file containing all the download configuration parameters.
-            mode (str): Type of dataset to download from Google Earth Engine.
-        """
-        
-        params = utils.parse_input_yaml(params_yaml_file)
-        print("STATUS UPDATE: Parsed YAML Params.")
+    def _download_configs(self, params: dict, mode: str=None) -> List[Tuple[object]]:
+        """All download configuration permutations of the sites and the YAML 
+        file parameters, in the format expected by _download_samples_util().
+        The 'monthly_multiband' mode has one configuration per site and 
+        scenario with all the variables and no model."""
         
         # latitude (l), longitude (l), name mnemonic (n), state code (s)
         llns = list(zip(self.sites.Latitude, self.sites.Longitude, self.sites.NameMnemonic, self.sites.StateCode))
         
-        # All download configuration permutations
-        download_configs = list(itertools.product(
+        if mode == "monthly_multiband":
+            return list(itertools.product(
+                llns, 
+                [tuple(params["variables"])], 
+                [None], 
+                params["scenario_future"],
+            ))
+        
+        return list(itertools.product(
             llns, 
             params["variables"], 
             params["models"], 
             params["scenario_future"],
         ))
-        print(f"STATUS UPDATE: Generated {len(download_configs)} download configurations.")
+    
+    
+    def plan_downloads(
+        self, 
+        params_yaml_file: str, 
+        mode: str, 
+        dedup: bool=True, 
+        output_path: str=None, 
+        policy: str="product", 
+        priorities: dict=None,
+    ) -> pd.DataFrame:
+        """Dry run of download_samples(). Lists the tasks that would be 
+        submitted together with the estimated number of images, rows and 
+        exported bytes of every task, without contacting Google Earth Engine.
+        
+        The 'average_daily' and 'monthly' modes do not filter by model, so the 
+        configurations that only differ in the model generate identical tasks 
+        with the same output file. With dedup these are submitted only once.
+        
+        Args:
+            params_yaml_file (str): Path to the YAML file containing all the download configuration parameters.
+            mode (str): Type of dataset to download from Google Earth Engine.
+                Possible values: 'average_daily' | 'daily' | 'monthly' | 'monthly_multiband'
+            dedup (bool, optional): Drop the tasks with duplicate outputs. 
+                Defaults to True.
+            output_path (str, optional): Path of the CSV file that the plan is 
+                written to. The file can be executed with execute_plan(). 
+                Defaults to None, i.e. the plan is not written.
+            policy (str, optional): Submission order of the tasks. Refer to 
+                schedule_download_configs(). Defaults to 'product'.
+            priorities (dict, optional): Scenario and variable priorities. 
+                Refer to schedule_download_configs(). Defaults to None.
+        
+        Returns:
+            pd.DataFrame: One row per task, in the submission order.
+        
+        Raises:
+            ValueError: If the value for mode is not one of the specified options.
+        """
+        
+        if mode not in DOWNLOAD_MODES:
+            raise ValueError("Incorrect value for mode.")
+        
+        params = utils.parse_input_yaml(params_yaml_file)
+        spec = DOWNLOAD_MODES[mode]
+        
+        # Images per task: one per day/month between the dates (end exclusive)
+        dates = pd.date_range(params["start_date"], params["end_date"], freq=spec["freq"])
+        n_dates = int(np.count_nonzero(dates < pd.Timestamp(params["end_date"])))
+        n_images = n_dates if spec["per_model"] or spec["dataset"] != "NASA/NEX-GDDP" else n_dates * NEX_GDDP_N_MODELS
+        row_bytes = EXPORT_ROW_BYTES[mode]
+        if mode == "monthly_multiband":
+            row_bytes += EXPORT_BAND_BYTES * len(params["variables"])
+        
+        rows = []
+        download_configs = schedule_download_configs(self._download_configs(params, mode), policy, priorities)
+        for (lat, long, name, state), variable, model, scenario in download_configs:
+            rows.append({
+                "Latitude": lat,
+                "Longitude": long,
+                "NameMnemonic": name,
+                "StateCode": state,
+                "variable": "+".join(variable) if isinstance(variable, tuple) else variable,
+                "model": model,
+                "scenario": scenario,
+                "mode": mode,
+                "start_date": params["start_date"],
+                "end_date": params["end_date"],
+                "description": task_description(mode, name, state, scenario, variable, model),
+                "folder": os.path.join(self.folder, scenario, "monthly" if mode == "monthly_multiband" else variable),
+                "n_images": n_images,
+                "n_rows": n_images,
+                "est_bytes": n_images * row_bytes,
+            })
+        plan = pd.DataFrame(rows)
+        
+        if dedup and len(plan):
+            plan = plan.drop_duplicates(subset=["folder", "description"]).reset_index(drop=True)
+        
+        if output_path is not None:
+            plan.to_csv(output_path, index=False)
+            print(f"STATUS UPDATE: The download plan with {len(plan)} tasks is stored as {output_path}.")
+        
+        return plan
+    
+
+    def plan_incremental(
+        self,
+        params_yaml_file: str,
+        mode: str,
+        datadir: str,
+        output_path: str=None,
+        policy: str="product",
+        priorities: dict=None,
+    ) -> pd.DataFrame:
+        """Plan of the downloads that extend the local series up to the
+        end_date of the YAML file, e.g. after widening end_date or after the
+        dataset was extended.
+    
+        The last date of every local series is read from the tail of its CSV
+        file (refer to local_series_path()) and only the window after it is
+        planned. The tasks get a '_{YYYYMMDD}' description suffix with the new
+        start date, so the delta files do not overwrite the full exports.
+        Series that are already up to date are dropped and series without a
+        local file are planned in full. After executing the plan, the delta
+        files are appended with append_downloads().
+    
+        Args:
+            params_yaml_file (str): Path to the YAML file containing all the download configuration parameters.
+            mode (str): Type of dataset to download from Google Earth Engine.
+                Possible values: 'daily' | 'monthly' | 'monthly_multiband'
+            datadir (str): Parent directory containing the local series.
+            output_path (str, optional): Path of the CSV file that the plan is
+                written to. Defaults to None, i.e. the plan is not written.
+            policy (str, optional): Submission order of the tasks. Refer to
+                schedule_download_configs(). Defaults to 'product'.
+            priorities (dict, optional): Scenario and variable priorities.
+                Refer to schedule_download_configs(). Defaults to None.
+    
+        Returns:
+            pd.DataFrame: The plan_downloads() plan with per task start_date,
+                description_suffix and local_path columns.
+    
+        Raises:
+            ValueError: If the value for mode is not one of the specified
+                options. The 'average_daily' exports have no date column, so
+                their last date cannot be read.
+        """
+    
+        if mode not in ["daily", "monthly", "monthly_multiband"]:
+            raise ValueError("Incorrect value for mode. Expecting one of these: 'daily' | 'monthly' | 'monthly_multiband'.")
+    
+        plan = self.plan_downloads(params_yaml_file, mode, dedup=True, policy=policy, priorities=priorities)
+        spec = DOWNLOAD_MODES[mode]
+        row_bytes = plan["est_bytes"] // plan["n_images"].clip(lower=1) if len(plan) else None
+    
+        local_paths, start_dates, suffixes, n_images = [], [], [], []
+        for row in plan.itertuples(index=False):
+            local_path = local_series_path(datadir, mode, row.NameMnemonic, row.StateCode, row.scenario, row.variable, row.model)
+            start = pd.Timestamp(row.start_date)
+    
+            last = _last_date(local_path) if os.path.exists(local_path) else None
+            if last is not None:
+                # Next day, or the first day of the next month
+                start = max(start, last + pd.tseries.frequencies.to_offset(spec["freq"]))
+    
+            dates = pd.date_range(start, row.end_date, freq=spec["freq"])
+            local_paths.append(local_path)
+            start_dates.append(start.strftime("%Y-%m-%d"))
+            suffixes.append("" if last is None else f"_{start:%Y%m%d}")
+            n_images.append(int(np.count_nonzero(dates < pd.Timestamp(row.end_date))))
+    
+        if len(plan):
+            plan = plan.assign(
+                start_date=start_dates,
+                description_suffix=suffixes,
+                local_path=local_paths,
+                n_images=n_images,
+                n_rows=n_images,
+                est_bytes=np.array(n_images) * row_bytes,
+            )
+            n_current = int((plan["n_images"] == 0).sum())
+            plan = plan[plan["n_images"] > 0].reset_index(drop=True)
+            print(f"STATUS UPDATE: {n_current} local series are up to date. {len(plan)} series need to be extended.")
+    
+        if output_path is not None:
+            plan.to_csv(output_path, index=False)
+            print(f"STATUS UPDATE: The incremental download plan with {len(plan)} tasks is stored as {output_path}.")
+    
+        return plan
+    
+
+    def estimate_download_plans(self, params_yaml_file: str, modes: List[str]=None) -> pd.DataFrame:
+        """Compares the size of the download plans of all the modes with and 
+        without dedup, e.g. to size a run against the Earth Engine quotas 
+        before submitting any task.
+        
+        Args:
+            params_yaml_file (str): Path to the YAML file containing all the download configuration parameters.
+            modes (List[str], optional): Download modes to compare. 
+                Defaults to None, i.e. ['average_daily', 'daily', 'monthly', 'monthly_multiband'].
+        
+        Returns:
+            pd.DataFrame: One row per mode and dedup option with the number of 
+                tasks, images, rows and the estimated export size.
+        """
         
-        # # Single node download process
-        # for config_i in download_configs:
-        #     self._download_samples_util(download_config=config_i, params=params, mode=mode)
+        if modes is None:
+            modes = ["average_daily", "daily", "monthly", "monthly_multiband"]
         
-        # Parallel download process
-        parallel_function(
+        summaries = []
+        for mode in modes:
+            for dedup in [False, True]:
+                plan = self.plan_downloads(params_yaml_file, mode, dedup=dedup)
+                summaries.append(summarize_download_plan(plan).assign(mode=mode, dedup=dedup))
+        
+        summary = pd.concat(summaries, ignore_index=True)
+        return summary[["mode", "dedup", "n_tasks", "n_images", "n_rows", "est_bytes", "est_megabytes"]]
+    
+    
+    def execute_plan(self, plan: Union[str, pd.DataFrame]) -> List[ee.batch.Task]:
+        """Submits the tasks of a plan generated by plan_downloads().
+        
+        Args:
+            plan (Union[str, pd.DataFrame]): Plan or path to a plan CSV file.
+        
+        Returns:
+            List[ee.batch.Task]: The started download tasks.
+        """
+        
+        if isinstance(plan, str):
+            plan = pd.read_csv(plan, keep_default_na=False)
+        print(f"STATUS UPDATE: Executing {len(plan)} planned downloads.")
+        
+        return parallel_function(
             delayed(self._download_samples_util)(
-                download_config=config_i, 
-                params=params, 
-                mode=mode
+                download_config=(
+                    (row.Latitude, row.Longitude, row.NameMnemonic, row.StateCode), 
+                    tuple(row.variable.split("+")) if row.mode == "monthly_multiband" else row.variable, 
+                    row.model or None, 
+                    row.scenario,
+                ), 
+                params={
+                    "start_date": row.start_date, 
+                    "end_date": row.end_date, 
+                    "description_suffix": getattr(row, "description_suffix", ""),
+                }, 
+                mode=row.mode,
             )
-            for config_i in download_configs
+            for row in plan.itertuples(index=False)
         )
+    
+    
+    def download_samples(self, params_yaml_file: str, mode: str, policy: str="product", priorities: dict=None, dedup: bool=True) -> List[ee.batch.Task]:
+        """Download all the data samples from the Google Earth Engine based on
+        YAML file download configuration parameters.
+        
+        The tasks are generated with plan_downloads() and submitted with 
+        execute_plan(), so the configurations with duplicate outputs of the 
+        'average_daily' and 'monthly' modes are submitted only once.
+        
+        Args:
+            params_yaml_files (str): Path to the YAML file containing all the download configuration parameters.
+            mode (str): Type of dataset to download from Google Earth Engine.
+            policy (str, optional): Submission order of the tasks. Refer to 
+                schedule_download_configs(). Defaults to 'product'.
+            priorities (dict, optional): Scenario and variable priorities. 
+                Refer to schedule_download_configs(). Defaults to None.
+            dedup (bool, optional): Drop the tasks with duplicate outputs. 
+                Defaults to True.
+        
+        Returns:
+            List[ee.batch.Task]: The started download tasks.
+        
+        Raises:
+            ValueError: If the value for mode is not one of the specified options.
+        """
+        
+        # All download configurations in the submission order
+        plan = self.plan_downloads(params_yaml_file, mode, dedup=dedup, policy=policy, priorities=priorities)
+        print(f"STATUS UPDATE: Generated {len(plan)} download configurations.")
+        
+        return self.execute_plan(plan)
+
+
+def summarize_download_plan(plan: pd.DataFrame) -> pd.DataFrame:
+    """Totals of a plan generated by SitesDownloader.plan_downloads().
+    
+    Args:
+        plan (pd.DataFrame): Download plan.
+    
+    Returns:
+        pd.DataFrame: Single row with the number of tasks, images, rows and 
+            the estimated export size.
+    """
+    
+    est_bytes = int(plan["est_bytes"].sum()) if len(plan) else 0
+    return pd.DataFrame([{
+        "n_tasks": len(plan),
+        "n_images": int(plan["n_images"].sum()) if len(plan) else 0,
+        "n_rows": int(plan["n_rows"].sum()) if len(plan) else 0,
+        "est_bytes": est_bytes,
+        "est_megabytes": est_bytes / 1e6,
+    }])
+
+
+def append_downloads(plan: pd.DataFrame, download_dir: str, datadir: str) -> pd.DataFrame:
+    """Appends the delta files of an executed SitesDownloader.plan_incremental() 
+    plan to the local series in place.
+    
+    Only the rows after the last local date are appended, in the column order 
+    of the local file, so re-running the append is a no-op. Series without a 
+    local file are copied. The appended series are marked stale in the 
+    catalog.mark_stale() registry of datadir, so that the dependent 
+    preprocess outputs can be recomputed for those sites only.
+    
+    Args:
+        plan (pd.DataFrame): Plan generated by SitesDownloader.plan_incremental().
+        download_dir (str): Local copy of the export folders, i.e. the delta 
+            files are '{download_dir}/{folder}/{description}{description_suffix}.csv'.
+        datadir (str): Parent directory containing the local series.
+    
+    Returns:
+        pd.DataFrame: One row per task with the number of appended rows and 
+            the new last date. Tasks without a delta file have n_appended nan.
+    """
+    
+    summary = []
+    with tqdm(list(plan.itertuples(index=False))) as tqdm_plan:
+        tqdm_plan.set_description("Appending")
+        
+        for row in tqdm_plan:
+            delta_path = os.path.join(download_dir, row.folder, f"{row.description}{row.description_suffix}.csv")
+            record = {"local_path": row.local_path, "n_appended": np.nan, "last_date": None}
+            
+            if not os.path.exists(delta_path):
+                print(f"WARNING: {delta_path} does not exist. Continuing to the next file.")
+                summary.append(record)
+                continue
+            
+            delta = pd.read_csv(delta_path, dtype={"date": str})
+            if os.path.exists(row.local_path):
+                last = _last_date(row.local_path)
+                columns = pd.read_csv(row.local_path, nrows=0).columns
+                if set(delta.columns) != set(columns):
+                    print(f"WARNING: The columns of {delta_path} do not match the columns of {row.local_path}. Continuing to the next file.")
+                    summary.append(record)
+                    continue
+                if last is not None:
+                    delta = delta[pd.to_datetime(delta["date"]) > last]
+                delta.reindex(columns=columns).to_csv(row.local_path, mode="a", header=False, index=False)
+            else:
+                os.makedirs(os.path.dirname(row.local_path), exist_ok=True)
+                delta.to_csv(row.local_path, index=False)
+            
+            record.update(n_appended=len(delta), last_date=delta["date"].iloc[-1] if len(delta) else None)
+            summary.append(record)
+            
+            if len(delta):
+                variables = row.variable.split("+") if row.mode == "monthly_multiband" else [row.variable]
+                for variable in variables:
+                    catalog.mark_stale(datadir, row.scenario, variable, row.NameMnemonic, row.StateCode)
+    
+    summary = pd.DataFrame(summary)
+    print(f"STATUS UPDATE: Appended {int(summary['n_appended'].sum()) if len(summary) else 0} rows to {int((summary['n_appended'] > 0).sum()) if len(summary) else 0} local series.")
+    return summary
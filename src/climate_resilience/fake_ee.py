@@ -0,0 +1,504 @@
+import os
+import time
+import zlib
+import random
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Union
+
+
+# Models that are returned by the unfiltered fake collections
+FAKE_MODELS = ["ACCESS1-0", "bcc-csm1-1", "CCSM4"]
+
+# Pandas frequency of the images and the models of the fake datasets.
+# The ensemble statistics have one image per date without any model.
+FAKE_DATASETS = {
+    "NASA/NEX-GDDP": {"freq": "D", "models": FAKE_MODELS},
+    "NASA/NEX-DCP30_ENSEMBLE_STATS": {"freq": "MS", "models": [None]},
+}
+
+# First date of the NEX datasets
+SERIES_EPOCH = pd.Timestamp("1950-01-01")
+
+# Earth Engine date formats used by the downloader and their strftime equivalents
+DATE_FORMATS = {
+    "YYYY-MM-DD": "%Y-%m-%d",
+    "YYYY-MM": "%Y-%m",
+}
+
+
+class EEException(Exception):
+    """Stand-in for ee.ee_exception.EEException."""
+
+
+class _Namespace:
+    """Attribute container that mimics the nested ee modules."""
+
+    def __init__(self, **attrs: object) -> None:
+        self.__dict__.update(attrs)
+
+
+def synthesize_series(
+    dataset: str,
+    band: str,
+    scenario: str,
+    model: str,
+    lon: float,
+    lat: float,
+    dates: pd.DatetimeIndex,
+    seed: int=0,
+) -> np.ndarray:
+    """Generates a deterministic series in the native units of the datasets,
+    i.e. precipitation in kg/m^2/s and temperatures in K. The same arguments
+    always generate the same values, and the value of a date does not depend
+    on the other dates, so partial date ranges match the full range.
+
+    Args:
+        dataset (str): Image collection id.
+        band (str): Band of interest, e.g. 'pr' or 'tasmax_mean'.
+        scenario (str): Scenario of interest.
+        model (str): Model of interest.
+        lon (float): Longitude of the site.
+        lat (float): Latitude of the site.
+        dates (pd.DatetimeIndex): Dates of the images.
+        seed (int, optional): Seed of the fake backend. Defaults to 0.
+
+    Returns:
+        np.ndarray: Values of the series.
+    """
+
+    key = f"{seed}|{dataset}|{band}|{scenario}|{model}|{lon:.4f}|{lat:.4f}"
+    rng = np.random.default_rng(zlib.crc32(key.encode()))
+
+    # The random values are drawn for every day since SERIES_EPOCH and indexed by date
+    offsets = (dates - SERIES_EPOCH).days.to_numpy()
+    n_days = int(offsets.max()) + 1 if len(offsets) else 0
+
+    season = np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 200) / 365.25)
+    if band.startswith("pr"):
+        return rng.gamma(0.5, 4.0, n_days)[offsets] / 86400
+    if band.startswith("tasmin"):
+        return 278.0 - 0.3 * abs(lat) + 10.0 * season + rng.normal(0, 3, n_days)[offsets]
+    return 290.0 - 0.3 * abs(lat) + 12.0 * season + rng.normal(0, 3, n_days)[offsets]
+
+
+class FakeGeometry:
+    """Stand-in for ee.Geometry. Only points are supported."""
+
+    def __init__(self, lon: float, lat: float) -> None:
+        self.lon = float(lon)
+        self.lat = float(lat)
+
+    @classmethod
+    def Point(cls, lon: float, lat: float) -> "FakeGeometry":
+        return cls(lon, lat)
+
+
+class FakeFilter:
+    """Stand-in for ee.Filter. Only equality filters are supported."""
+
+    def __init__(self, name: str, value: object) -> None:
+        self.name = name
+        self.value = value
+
+    @classmethod
+    def eq(cls, name: str, value: object) -> "FakeFilter":
+        return cls(name, value)
+
+
+class FakeReducer:
+    """Stand-in for ee.Reducer. Only the mean reducer is supported."""
+
+    def __init__(self, name: str, outputs: List[str]=None) -> None:
+        self.name = name
+        self.outputs = outputs
+
+    @classmethod
+    def mean(cls) -> "FakeReducer":
+        return cls("mean")
+
+    def setOutputs(self, outputs: List[str]) -> "FakeReducer":
+        if len(outputs) != 1:
+            raise EEException(f"The '{self.name}' reducer has 1 output, but {len(outputs)} output names were given.")
+        return FakeReducer(self.name, list(outputs))
+
+
+class FakeDate:
+    """Stand-in for ee.Date of an image."""
+
+    def __init__(self, fmt: str=None) -> None:
+        self.fmt = fmt
+
+    def format(self, fmt: str) -> "FakeDate":
+        if fmt not in DATE_FORMATS:
+            raise EEException(f"Unsupported date format '{fmt}' in the fake backend.")
+        return FakeDate(fmt)
+
+
+def _date(value: object) -> FakeDate:
+    """Stand-in for the ee.Date() constructor."""
+
+    return value if isinstance(value, FakeDate) else FakeDate()
+
+
+class FakeImage:
+    """Symbolic image of a collection. Records the arithmetic operations that
+    are applied to the selected bands so they can be replayed on the
+    synthesized series."""
+
+    def __init__(
+        self,
+        bands: List[str]=None,
+        ops: List[Tuple[str, object]]=None,
+        constant: np.ndarray=None,
+        source_bands: List[str]=None,
+    ) -> None:
+        self.bands = list(bands or [])
+        self.ops = list(ops or [])
+        self.constant_values = constant
+        # Bands of the collection that the operations are applied to
+        self.source_bands = list(self.bands if source_bands is None else source_bands)
+
+    @classmethod
+    def constant_image(cls, value: Union[float, List[float]]) -> "FakeImage":
+        return cls(constant=np.atleast_1d(np.asarray(value, dtype=np.float64)))
+
+    def _with(self, op: str, value: object) -> "FakeImage":
+        if isinstance(value, FakeImage):
+            value = value.constant_values
+        return FakeImage(self.bands, self.ops + [(op, value)], source_bands=self.source_bands)
+
+    def multiply(self, value: Union[float, "FakeImage"]) -> "FakeImage":
+        return self._with("multiply", value)
+
+    def add(self, value: Union[float, "FakeImage"]) -> "FakeImage":
+        return self._with("add", value)
+
+    def select(self, *bands: Union[str, List[str]]) -> "FakeImage":
+        bands = list(bands[0]) if len(bands) == 1 and isinstance(bands[0], (list, tuple)) else list(bands)
+        return FakeImage(bands, self.ops + [("select", bands)], source_bands=self.source_bands)
+
+    def rename(self, *names: Union[str, List[str]]) -> "FakeImage":
+        names = list(names[0]) if len(names) == 1 and isinstance(names[0], (list, tuple)) else list(names)
+        return FakeImage(names, self.ops + [("rename", names)], source_bands=self.source_bands)
+
+    def date(self) -> FakeDate:
+        return FakeDate()
+
+    def copyProperties(self, source: "FakeImage", properties: List[str]=None) -> "FakeImage":
+        # Image properties are not modeled, the dates are always available
+        return self
+
+    def reduceRegions(self, collection: FakeGeometry, reducer: FakeReducer, scale: float=None) -> "FakeFeatureCollection":
+        return FakeFeatureCollection(features=[FakeFeature(self, collection, reducer)])
+
+    def evaluate(self, values: np.ndarray) -> Tuple[List[str], np.ndarray]:
+        """Replays the recorded operations on a band x image array of the
+        source bands."""
+
+        bands = self.source_bands
+        for op, value in self.ops:
+            if op == "select":
+                values = values[[bands.index(band) for band in value]]
+                bands = list(value)
+            elif op == "rename":
+                bands = list(value)
+            else:
+                value = np.asarray(value, dtype=np.float64).reshape(-1, 1) if np.ndim(value) else value
+                values = values * value if op == "multiply" else values + value
+        return bands, values
+
+
+class _FakeImageFactory:
+    """Stand-in for the ee.Image constructor and ee.Image.constant()."""
+
+    def __call__(self, image: FakeImage) -> FakeImage:
+        return image
+
+    def constant(self, value: Union[float, List[float]]) -> FakeImage:
+        return FakeImage.constant_image(value)
+
+
+class FakeFeature:
+    """Result of reduceRegions(...).first() on a symbolic image."""
+
+    def __init__(self, image: FakeImage, geometry: FakeGeometry, reducer: FakeReducer, properties: dict=None) -> None:
+        self.image = image
+        self.geometry = geometry
+        self.reducer = reducer
+        self.properties = dict(properties or {})
+
+    def set(self, name: str, value: object) -> "FakeFeature":
+        return FakeFeature(self.image, self.geometry, self.reducer, {**self.properties, name: value})
+
+
+class FakeFeatureCollection:
+    """Stand-in for ee.FeatureCollection. Either wraps the per-image features
+    of a mapped image collection or a list of features."""
+
+    def __init__(self, collection: object=None, features: List[FakeFeature]=None) -> None:
+        if isinstance(collection, FakeFeatureCollection):
+            features = collection.features
+            collection = collection.collection
+        self.collection = collection
+        self.features = list(features or [])
+
+    def first(self) -> FakeFeature:
+        return self.features[0]
+
+
+class FakeImageCollection:
+    """Stand-in for ee.ImageCollection. Filters and mapped functions are
+    recorded lazily and evaluated when an export task is started."""
+
+    def __init__(
+        self,
+        dataset: str,
+        start: str=None,
+        end: str=None,
+        bands: List[str]=None,
+        filters: dict=None,
+        image: FakeImage=None,
+        feature: FakeFeature=None,
+    ) -> None:
+        if dataset not in FAKE_DATASETS:
+            raise EEException(f"Image collection '{dataset}' is not supported by the fake backend.")
+
+        self.dataset = dataset
+        self.start = start
+        self.end = end
+        self.bands = list(bands or [])
+        self.filters = dict(filters or {})
+        self.image = image
+        self.feature = feature
+
+    def _copy(self, **changes: object) -> "FakeImageCollection":
+        attrs = {
+            "dataset": self.dataset, "start": self.start, "end": self.end, "bands": self.bands,
+            "filters": self.filters, "image": self.image, "feature": self.feature,
+        }
+        attrs.update(changes)
+        return FakeImageCollection(**attrs)
+
+    def filterDate(self, start: object, end: object) -> "FakeImageCollection":
+        return self._copy(start=pd.Timestamp(start), end=pd.Timestamp(end))
+
+    def select(self, *bands: Union[str, List[str]]) -> "FakeImageCollection":
+        bands = list(bands[0]) if len(bands) == 1 and isinstance(bands[0], (list, tuple)) else list(bands)
+        return self._copy(bands=bands)
+
+    def filter(self, ee_filter: FakeFilter) -> "FakeImageCollection":
+        return self._copy(filters={**self.filters, ee_filter.name: ee_filter.value})
+
+    def map(self, func: object) -> "FakeImageCollection":
+        if self.feature is not None:
+            raise EEException("Mapping over a collection of features is not supported by the fake backend.")
+
+        result = func(self.image if self.image is not None else FakeImage(self.bands))
+
+        if isinstance(result, FakeFeatureCollection):
+            result = result.first()
+        if isinstance(result, FakeFeature):
+            return self._copy(feature=result)
+        return self._copy(image=result)
+
+    def dates(self) -> pd.DatetimeIndex:
+        """Dates of the images between the filter dates (end exclusive)."""
+
+        dates = pd.date_range(self.start, self.end, freq=FAKE_DATASETS[self.dataset]["freq"])
+        return dates[dates < self.end]
+
+
+class FakeTask:
+    """Stand-in for ee.batch.Task of a table export. start() synthesizes the
+    table after the configured latency and decides deterministically whether
+    the task fails."""
+
+    def __init__(self, backend: "FakeEarthEngine", collection: FakeFeatureCollection, config: dict) -> None:
+        self.backend = backend
+        self.collection = collection
+        self.config = config
+        self.id = f"FAKE_{zlib.crc32(config['description'].encode()):08X}"
+        self.state = "UNSUBMITTED"
+        self.error_message = None
+        self.submitted_at = None
+        self.finished_at = None
+        self.n_rows = 0
+
+    def start(self) -> None:
+        backend = self.backend
+        self.submitted_at = time.time()
+        time.sleep(backend.latency)
+
+        # The n-th attempt of a description always has the same outcome
+        attempt = backend._attempts.get(self.config["description"], 0)
+        backend._attempts[self.config["description"]] = attempt + 1
+        rng = random.Random(f"{backend.seed}|{self.config['description']}|{attempt}")
+
+        if rng.random() < backend.failure_rate:
+            self.state = "FAILED"
+            self.error_message = "Fake backend: simulated task failure."
+        else:
+            table = self.to_dataframe()
+            self.n_rows = len(table)
+            if backend.output_dir is not None:
+                folder = os.path.join(backend.output_dir, self.config.get("folder") or "")
+                if not os.path.isdir(folder):
+                    os.makedirs(folder, exist_ok=True)
+                table.to_csv(os.path.join(folder, f"{self.config['description']}.csv"), index=False)
+            self.state = "COMPLETED"
+
+        self.finished_at = time.time()
+
+    def status(self) -> dict:
+        status = {
+            "id": self.id,
+            "state": self.state,
+            "description": self.config["description"],
+        }
+        if self.error_message is not None:
+            status["error_message"] = self.error_message
+        return status
+
+    def active(self) -> bool:
+        return self.state in ["READY", "RUNNING"]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Synthesizes the exported table."""
+
+        ic = self.collection.collection
+        feature = ic.feature
+        dates = ic.dates()
+        models = [ic.filters["model"]] if "model" in ic.filters else FAKE_DATASETS[ic.dataset]["models"]
+        scenario = ic.filters.get("scenario")
+
+        tables = []
+        for model in models:
+            raw = np.vstack([
+                synthesize_series(ic.dataset, band, scenario, model, feature.geometry.lon, feature.geometry.lat, dates, self.backend.seed)
+                for band in feature.image.source_bands
+            ])
+            bands, values = feature.image.evaluate(raw)
+
+            # A single band mean reduction is named after the reducer (or its renamed output), 
+            # otherwise after the bands
+            names = (feature.reducer.outputs or [feature.reducer.name]) if len(bands) == 1 else bands
+            table = pd.DataFrame(dict(zip(names, values)))
+            prefix = "" if model is None else f"{model}_"
+            table.insert(0, "system:index", [f"{prefix}{date:%Y%m%d}" for date in dates])
+            for name, value in feature.properties.items():
+                table[name] = dates.strftime(DATE_FORMATS[value.fmt]) if isinstance(value, FakeDate) else value
+            tables.append(table)
+
+        table = pd.concat(tables, ignore_index=True)
+        selectors = self.config.get("selectors")
+        return table[selectors] if selectors else table
+
+
+class FakeEarthEngine:
+    """In-process stand-in for the subset of the ee module that is used by
+    SitesDownloader, for offline end-to-end and load tests.
+
+    The series are synthesized deterministically from the site, band,
+    scenario and model, and every task start sleeps for 'latency' seconds
+    and fails with probability 'failure_rate'. The object is picklable, so it
+    is also used by the joblib worker processes of download_samples().
+
+    Example Usage:
+        backend = FakeEarthEngine(latency=0.05, failure_rate=0.1, output_dir="fake_drive")
+        sd_obj = SitesDownloader(folder="test", site_json_file_path=path, backend=backend)
+        tasks = sd_obj.download_samples(params_yaml_file=yaml_path, mode="daily")
+        task_table(tasks)
+    """
+
+    def __init__(self, latency: float=0.0, failure_rate: float=0.0, seed: int=0, output_dir: str=None) -> None:
+        """Initializes the FakeEarthEngine object.
+
+        Args:
+            latency (float, optional): Seconds that every task submission
+                takes. Defaults to 0.
+            failure_rate (float, optional): Probability in the range [0, 1]
+                that a task fails. Defaults to 0.
+            seed (int, optional): Seed of the synthesized series and the
+                failures. Defaults to 0.
+            output_dir (str, optional): Local directory standing in for
+                Google Drive. The exported tables are written to
+                '{output_dir}/{folder}/{description}.csv'. Defaults to None,
+                i.e. the tables are synthesized but not written.
+        """
+
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.output_dir = output_dir
+        # Number of starts per task description in this process
+        self._attempts = {}
+
+        self.ee_exception = _Namespace(EEException=EEException)
+        self.Geometry = FakeGeometry
+        self.Filter = FakeFilter
+        self.Reducer = FakeReducer
+        self.Date = _date
+        self.Image = _FakeImageFactory()
+        self.ImageCollection = FakeImageCollection
+        self.FeatureCollection = FakeFeatureCollection
+        self.batch = _Namespace(
+            Task=FakeTask,
+            Export=_Namespace(table=_Namespace(toDrive=self._export_table_to_drive)),
+        )
+
+    def _key(self) -> tuple:
+        return (self.latency, self.failure_rate, self.seed, self.output_dir)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FakeEarthEngine) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        # Copies in the worker processes share the cached expressions
+        return hash(self._key())
+
+    def Initialize(self, *args: object, **kwargs: object) -> None:
+        """Authentication is not needed for the fake backend."""
+
+    def _export_table_to_drive(
+        self,
+        collection: FakeFeatureCollection,
+        description: str="myExportTableTask",
+        folder: str=None,
+        fileFormat: str="csv",
+        selectors: List[str]=None,
+        **kwargs: object
+    ) -> FakeTask:
+        """Stand-in for ee.batch.Export.table.toDrive()."""
+
+        if not isinstance(collection, FakeFeatureCollection) or collection.collection is None:
+            raise EEException("The fake backend can only export mapped image collections.")
+
+        config = {
+            "description": description,
+            "folder": folder,
+            "fileFormat": fileFormat,
+            "selectors": list(selectors) if selectors is not None else None,
+        }
+        return FakeTask(self, collection, config)
+
+
+def task_table(tasks: List[FakeTask]) -> pd.DataFrame:
+    """Summarizes the started fake tasks, e.g. to measure the submission
+    throughput of a load test.
+
+    Args:
+        tasks (List[FakeTask]): Started tasks.
+
+    Returns:
+        pd.DataFrame: One row per task with the description, state, number of
+            rows, submission time and duration in seconds.
+    """
+
+    return pd.DataFrame({
+        "description": [task.config["description"] for task in tasks],
+        "state": [task.state for task in tasks],
+        "n_rows": [task.n_rows for task in tasks],
+        "submitted_at": [task.submitted_at for task in tasks],
+        "duration": [None if task.finished_at is None else task.finished_at - task.submitted_at for task in tasks],
+    })
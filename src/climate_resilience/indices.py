@@ -0,0 +1,271 @@
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Callable, Dict
+
+from climate_resilience import utils
+from climate_resilience import aggregators
+from climate_resilience import preprocess
+from climate_resilience import series_store
+
+warnings.formatwarning = utils.warning_format
+
+
+def _annual_count(mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Number of True values per year."""
+
+    return np.add.reduceat(mask, starts, axis=-1)
+
+
+def _annual_max_run(mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Longest run of True values within each year."""
+
+    return np.maximum.reduceat(aggregators.run_lengths(mask, resets=starts), starts, axis=-1)
+
+
+def _annual_spell_days(mask: np.ndarray, starts: np.ndarray, min_length: int) -> np.ndarray:
+    """Number of days per year that are part of a spell of at least min_length days."""
+
+    spells = aggregators.spell_lengths(mask, resets=starts)
+    return np.add.reduceat(spells >= min_length, starts, axis=-1)
+
+
+def _baseline_percentile(baseline: np.ndarray, q: float) -> np.ndarray:
+    """Per-site qth percentile of the baseline period as a site x 1 array."""
+
+    return aggregators.percentile(baseline, q=q)[:, None]
+
+
+# ETCCDI-style indices. Every index is calculated from a single variable and
+# maps a site x day array and the year offsets to a site x year array.
+# Indices with 'baseline' set to True also get the site x day array of the
+# base period of the historical scenario to calculate the thresholds.
+INDICES: Dict[str, dict] = {
+    "rx1day": {
+        "variable": "pr",
+        "func": lambda block, starts: np.fmax.reduceat(block, starts, axis=-1),
+    },
+    "rx5day": {
+        "variable": "pr",
+        "func": lambda block, starts: np.fmax.reduceat(aggregators.rolling_sum(block, 5), starts, axis=-1),
+    },
+    "cdd": {
+        "variable": "pr",
+        "func": lambda block, starts: _annual_max_run(block < 1.0, starts),
+    },
+    "cwd": {
+        "variable": "pr",
+        "func": lambda block, starts: _annual_max_run(block >= 1.0, starts),
+    },
+    "r10mm": {
+        "variable": "pr",
+        "func": lambda block, starts: _annual_count(block >= 10.0, starts),
+    },
+    "r20mm": {
+        "variable": "pr",
+        "func": lambda block, starts: _annual_count(block >= 20.0, starts),
+    },
+    "prcptot": {
+        "variable": "pr",
+        "func": lambda block, starts: np.add.reduceat(np.where(block >= 1.0, block, 0.0), starts, axis=-1),
+    },
+    "txx": {
+        "variable": "tasmax",
+        "func": lambda block, starts: np.fmax.reduceat(block, starts, axis=-1),
+    },
+    "tnn": {
+        "variable": "tasmin",
+        "func": lambda block, starts: np.fmin.reduceat(block, starts, axis=-1),
+    },
+    "su": {
+        "variable": "tasmax",
+        "func": lambda block, starts: _annual_count(block > 25.0, starts),
+    },
+    "tr": {
+        "variable": "tasmin",
+        "func": lambda block, starts: _annual_count(block > 20.0, starts),
+    },
+    "wsdi": {
+        "variable": "tasmax",
+        "baseline": True,
+        "func": lambda block, starts, baseline: _annual_spell_days(block > _baseline_percentile(baseline, 90), starts, 6),
+    },
+    "csdi": {
+        "variable": "tasmin",
+        "baseline": True,
+        "func": lambda block, starts, baseline: _annual_spell_days(block < _baseline_percentile(baseline, 10), starts, 6),
+    },
+}
+
+
+def register_index(name: str, variable: str, func: Callable, baseline: bool=False) -> None:
+    """Adds an index to the INDICES registry.
+
+    Args:
+        name (str): Name of the index.
+        variable (str): Variable that the index is calculated from.
+        func (Callable): func(block, starts) -> site x year array, or
+            func(block, starts, baseline) if baseline is True.
+        baseline (bool, optional): Whether the index needs the base period
+            values. Defaults to False.
+    """
+
+    INDICES[name] = {"variable": variable, "func": func, "baseline": baseline}
+
+
+def _load_block(
+    sites: pd.DataFrame,
+    scenario: str,
+    variable: str,
+    datadir: str,
+    store: series_store.SeriesStore=None,
+    start: str=None,
+    end: str=None,
+    cube_path: str=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the dates and the site x day array of a scenario and variable,
+    either from the series store, the cube or the ensemble CSVs."""
+
+    if store is not None:
+        return store.load_block(scenario, variable, sites, start, end)
+
+    groups = preprocess._load_calendar_groups(sites, [scenario], [variable], datadir, description=f"Reading '{scenario}_{variable}'", cube_path=cube_path)
+    dates = groups[0]["dates"]
+    if len(groups) > 1:
+        # Aligning the sites with different calendars on the union of all dates
+        dates = np.unique(np.concatenate([group["dates"] for group in groups]))
+
+    block = np.full((len(sites), len(dates)), np.nan)
+    for group in groups:
+        block[np.ix_(group["rows"], np.searchsorted(dates, group["dates"]))] = group["block"]
+
+    keep = np.ones(len(dates), dtype=bool)
+    if start is not None:
+        keep &= dates >= np.datetime64(pd.Timestamp(start), "D")
+    if end is not None:
+        keep &= dates <= np.datetime64(pd.Timestamp(end), "D")
+    return dates[keep], block[:, keep]
+
+
+def get_extreme_indices(
+    sites: pd.DataFrame,
+    scenarios: List[str],
+    indices: List[str],
+    datadir: str,
+    store_dir: str=None,
+    cube_path: str=None,
+    base_period: Tuple[str]=("1961-01-01", "1990-12-31"),
+) -> Dict[str, pd.DataFrame]:
+    """Calculates ETCCDI-style extreme indices for every site, scenario and
+    year.
+
+    Every index is calculated for all the sites of a scenario at once on the
+    site x day array: rolling windows use cumulative sums and spells use
+    run-length encoding, so there is no loop over the sites or the years.
+    Spells are split at the year boundaries.
+
+    The available indices are the keys of INDICES:
+        'rx1day': Annual maximum 1-day precipitation.
+        'rx5day': Annual maximum consecutive 5-day precipitation.
+        'cdd': Maximum number of consecutive days with precipitation < 1 mm.
+        'cwd': Maximum number of consecutive days with precipitation >= 1 mm.
+        'r10mm' | 'r20mm': Number of days with precipitation >= 10 | 20 mm.
+        'prcptot': Total precipitation on wet days (>= 1 mm).
+        'txx' | 'tnn': Annual maximum of tasmax | minimum of tasmin.
+        'su': Number of summer days (tasmax > 25 degC).
+        'tr': Number of tropical nights (tasmin > 20 degC).
+        'wsdi': Warm spell duration, i.e. number of days in spells of at least
+            6 days with tasmax above the 90th percentile of the base period.
+        'csdi': Cold spell duration, i.e. number of days in spells of at least
+            6 days with tasmin below the 10th percentile of the base period.
+    The spell thresholds are per-site percentiles of the whole base period
+    instead of the ETCCDI calendar-day percentiles. Sites without any data in
+    the base period get nan values for these indices (with a warning).
+
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information.
+        scenarios (List[str]):  Scenarios of interest.
+        indices (List[str]): Indices of interest.
+        datadir (str): Parent directory containing all the data files.
+            The generated output files are also stored here.
+        store_dir (str, optional): Series store generated by
+            series_store.build_series_store(). Defaults to None, in which case
+            the ensemble CSVs in datadir are read.
+        cube_path (str, optional): Cube generated by cube.build_cube() that is
+            read if no store_dir is given. Defaults to None.
+        base_period (Tuple[str], optional): Start and end date of the base
+            period within the 'historical' scenario.
+            Defaults to ('1961-01-01', '1990-12-31').
+
+    Returns:
+        Dict[str, pd.DataFrame]: The output DataFrame of every index that is
+            written to '{index}_extreme_indices.csv'. Each row is a site and
+            each column is '{scenario}_{year}', merged with the sites data frame.
+
+    Raises:
+        ValueError: If any of the indices is not one of the specified options.
+    """
+
+    for index in indices:
+        if index not in INDICES:
+            raise ValueError(f"Incorrect index '{index}'. Expecting one of these: {' | '.join(INDICES)}.")
+
+    store = None if store_dir is None else series_store.open_store(store_dir)
+
+    # Calculating the indices per variable so that every block is read once
+    variables = list(dict.fromkeys(INDICES[index]["variable"] for index in indices))
+    df_columns = {index: {} for index in indices}
+    for var in variables:
+        var_indices = [index for index in indices if INDICES[index]["variable"] == var]
+
+        baseline = None
+        if any(INDICES[index].get("baseline", False) for index in var_indices):
+            _, baseline = _load_block(sites, "historical", var, datadir, store, *base_period, cube_path=cube_path)
+
+            # The thresholds of sites without base period data are nan, which would silently count no spell days
+            no_baseline = np.all(np.isnan(baseline), axis=-1)
+            if no_baseline.any():
+                missing = [f"{name}_{state}" for name, state in zip(sites.NameMnemonic[no_baseline], sites.StateCode[no_baseline])]
+                print(f"WARNING: The 'historical_{var}' series has no data in the base period {base_period[0]} - {base_period[1]} for {len(missing)} site(s): {', '.join(missing)}. Storing nan values for the indices based on the base period.")
+
+        for sce in scenarios:
+            dates, block = _load_block(sites, sce, var, datadir, store, cube_path=cube_path)
+            years, starts = preprocess._year_offsets(dates)
+
+            for index in var_indices:
+                spec = INDICES[index]
+                with np.errstate(invalid="ignore"):
+                    if spec.get("baseline", False):
+                        values = np.asarray(spec["func"](block, starts, baseline), dtype=np.float64)
+                        values[no_baseline] = np.nan
+                    else:
+                        values = spec["func"](block, starts)
+
+                for j, year in enumerate(years):
+                    df_columns[index][f"{sce}_{year}"] = values[:, j]
+
+    outputs = {}
+    for index in indices:
+        df_index = pd.DataFrame({
+            "OBJECTID": sites.OBJECTID.to_numpy(),
+            "ID": sites.ID.to_numpy(),
+            **df_columns[index],
+        })
+
+        # Merge the generated data with the original Data Frame
+        df_final = pd.merge(sites, df_index,
+                            how="inner",
+                            left_on=["OBJECTID", "ID"],
+                            right_on=["OBJECTID", "ID"],
+                            suffixes=(None, "_copy"),
+                           )
+
+        # Write to CSV
+        output_csv_path = os.path.join(datadir, f"{index}_extreme_indices.csv")
+        df_final.to_csv(output_csv_path)
+        print(f"STATUS UPDATE: The output file generated from get_extreme_indices() function is stored as {output_csv_path}.")
+
+        outputs[index] = df_final
+
+    return outputs
@@ -1,26 +1,79 @@
 import os
-import glob
 import datetime
+import functools
+import hashlib
+import itertools
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from typing import List, Tuple, Callable
+from typing import List, Tuple, Callable, Union, Iterator
 
 from climate_resilience import utils
+from climate_resilience import aggregators
+from climate_resilience import bootstrap
+from climate_resilience import catalog
+from climate_resilience import constants
+from climate_resilience import cube
+from climate_resilience import dataset
+from climate_resilience import sketches
 
 import warnings
 warnings.formatwarning = utils.warning_format
 
 
+def _read_site_series(
+    datadir: str, 
+    name: str, 
+    state: str, 
+    sce: str, 
+    var: str, 
+    file_catalog: catalog.Catalog, 
+    cube_ds: object=None,
+) -> pd.DataFrame:
+    """Reads the 'date' and 'mean' columns of the ensemble series of a site 
+    from its CSV file, or from the cube if cube_ds is given. The dates are 
+    'YYYY-MM-DD' strings in both cases. Prints a warning and returns None if 
+    the series does not exist."""
+    
+    if cube_ds is not None:
+        site = pd.DataFrame({"NameMnemonic": [name], "StateCode": [state]})
+        dates, block = cube.cube_block(cube_ds, site, sce, var)
+        if not len(dates):
+            print(f"WARNING: The {sce}_{var} series of {name}_{state} does not exist in the cube. Continuing to the next file.")
+            return None
+        return pd.DataFrame({"date": np.datetime_as_string(dates, unit="D"), "mean": block[0]})
+    
+    csv_path = os.path.join(datadir, f"{sce}_{var}_ensemble", f"{name}_{state}_{sce}_{var}.csv")
+    if not file_catalog.exists(csv_path):
+        print(f"WARNING: {csv_path} does not exist. Continuing to the next file.")
+        return None
+    return pd.read_csv(csv_path, usecols=["date", "mean"])
+
+
 def calculate_Nth_percentile(
     sites: pd.DataFrame, 
     scenarios: List[str], 
     variables: List[str], 
     datadir: str, 
     N: int=99,
+    approx: bool=False,
+    compression: float=200,
+    chunksize: int=100_000,
+    n_bootstrap: int=0,
+    block_length: int=30,
+    confidence: float=0.95,
+    seed: int=0,
+    n_jobs: int=1,
+    cube_path: str=None,
 ) -> None:
     """Calculates the Nth percentile.
     
+    With n_bootstrap > 0, block bootstrap confidence intervals of the 
+    percentiles are added as '{scenario}_{variable}_percentile_ci_low' and 
+    '..._ci_high' columns. The resamples are shared by all the sites with the 
+    same number of days and evaluated in batches (refer to 
+    bootstrap.bootstrap_ci()).
+    
     Args:
         sites (pd.DataFrame): Data Frame containing all the site information. 
         scenarios (List[str]):  Scenarios of interest.
@@ -28,25 +81,62 @@ def calculate_Nth_percentile(
         datadir (str): Parent directory containing all the data files.
             The generated output file is also stored here.
         N (int): Nth percentile will be calculated.
+        approx (bool, optional): If True, the percentile is estimated with a 
+            streaming sketch (sketches.TDigest) while reading the CSV files 
+            chunk-by-chunk, instead of materializing and sorting the full 
+            series. Defaults to False.
+        compression (float, optional): Compression of the sketch. Larger 
+            values are more accurate. Only used if approx is True. 
+            Defaults to 200.
+        chunksize (int, optional): Number of rows read at a time. Only used 
+            if approx is True. Defaults to 100,000.
+        n_bootstrap (int, optional): Number of bootstrap resamples. 
+            Defaults to 0, i.e. no confidence intervals.
+        block_length (int, optional): Number of consecutive days per 
+            bootstrap block. Defaults to 30.
+        confidence (float, optional): Confidence level of the intervals. 
+            Defaults to 0.95.
+        seed (int, optional): Seed of the bootstrap resamples. Defaults to 0.
+        n_jobs (int, optional): Number of worker processes used to evaluate 
+            the resamples. Defaults to 1.
+        cube_path (str, optional): Cube generated by cube.build_cube() that is 
+            read instead of the ensemble CSVs. The series of a site is read 
+            from the cube at once, so with approx the sketch is updated with 
+            the whole series. Defaults to None.
     
     Returns:
         pd.DataFrame: The output DataFrame that is written to a csv file is also returned.
         
     Raises:
         ValueError: If the integer value of N is outside the range [0, 100].
+        ValueError: If n_bootstrap > 0 is combined with approx, which does 
+            not keep the values of the series.
     """
     
     # Verify the value of N
     if N < 0 or N > 100:
         raise ValueError("Incorrect value for N. N must be between 0 and 100.")
     
+    if n_bootstrap > 0 and approx:
+        raise ValueError("Bootstrap confidence intervals are not supported with approx=True.")
+    
+    # Scanning datadir once instead of checking every file separately
+    file_catalog = catalog.get_catalog(datadir)
+    cube_ds = cube.open_cube(cube_path) if cube_path is not None else None
+    
     # Declare variables that will be used to convert the processed data to a DataFrame
     df_array = []
     df_colnames = []
     
+    # Series kept for the bootstrap: {(scenario, variable, n_days): ([rows], [values])}
+    bootstrap_series = {}
+    
+    # Sites of every scenario and variable that are calculated from their current series
+    regenerated = {}
+    
     # Loop over all the sites. 
     # ID and Object ID are stored only to inspect the final result with the corresponding site
-    for _oid, _id, name, state in zip(sites.OBJECTID, sites.ID, sites.NameMnemonic, sites.StateCode):
+    for row, (_oid, _id, name, state) in enumerate(zip(sites.OBJECTID, sites.ID, sites.NameMnemonic, sites.StateCode)):
         array_ind = [_oid, _id, name, state]
         df_colnames = ["OBJECTID", "ID", "NameMnemonic", "StateCode"]
         
@@ -58,16 +148,30 @@ def calculate_Nth_percentile(
                                         f"{sce}_{var}_ensemble", 
                                         f"{name}_{state}_{sce}_{var}.csv")
                 
-                if not os.path.exists(csv_path):
-                    print(f"WARNING: {csv_path} does not exist. Continuing to the next file.")
-                    continue
-                
                 # Preprocessing step
-                df = pd.read_csv(csv_path)
-                df1 = df.set_index('date')
-                
-                mean_val = np.percentile(df1['mean'], N)  
-                
+                if approx and cube_ds is None:
+                    if not file_catalog.exists(csv_path):
+                        print(f"WARNING: {csv_path} does not exist. Continuing to the next file.")
+                        continue
+                    mean_val = sketches.sketch_csvs([csv_path], "mean", compression, chunksize).percentile(N)
+                else:
+                    df = _read_site_series(datadir, name, state, sce, var, file_catalog, cube_ds)
+                    if df is None:
+                        continue
+                    df1 = df.set_index('date')
+                    
+                    if approx:
+                        mean_val = sketches.TDigest(compression).update(df1['mean']).percentile(N)
+                    else:
+                        mean_val = np.percentile(df1['mean'], N)  
+                    
+                    if n_bootstrap > 0:
+                        rows, values = bootstrap_series.setdefault((sce, var, len(df1)), ([], []))
+                        rows.append(row)
+                        values.append(df1['mean'].to_numpy(dtype=np.float64))
+
+                regenerated.setdefault((sce, var), []).append((name, state))
+
                 # Update the column names
                 colname = f"{sce}_{var}_percentile"
                 if colname not in df_colnames:
@@ -83,6 +187,22 @@ def calculate_Nth_percentile(
     df_pr = pd.DataFrame(df_array)
     df_pr.columns = df_colnames
     
+    # Bootstrap confidence intervals of all the sites of a scenario and variable at once
+    for (sce, var, _), (rows, values) in bootstrap_series.items():
+        intervals = bootstrap.bootstrap_ci(
+            np.vstack(values), 
+            lambda resampled: {"percentile": np.percentile(resampled, N, axis=-1)}, 
+            n_resamples=n_bootstrap, 
+            block_length=block_length, 
+            confidence=confidence, 
+            seed=seed, 
+            n_jobs=n_jobs,
+        )
+        for colname, bound in zip(bootstrap.ci_colnames(f"{sce}_{var}_percentile"), intervals["percentile"]):
+            if colname not in df_pr:
+                df_pr[colname] = np.nan
+            df_pr.loc[rows, colname] = bound
+    
     # Merge the generated data with the original Data Frame
     df_pr = pd.merge(sites, df_pr, 
                      how="inner", 
@@ -94,20 +214,66 @@ def calculate_Nth_percentile(
     # Write to CSV
     output_csv_path = os.path.join(datadir, f"LMsites_{N}th_percentile.csv")
     df_pr.to_csv(output_csv_path)
+    # The output is only as current as the ensemble output or the cube it was read from
+    catalog.clear_stale(datadir, output_csv_path, regenerated, upstream=cube_path or os.path.join(datadir, catalog.ENSEMBLE_STAGE))
     print(f"STATUS UPDATE: The output file generated from calculate_Nth_percentile() function is stored as {output_csv_path}.")
     
     return df_pr
     
 
+# Columns of the exceedance events table of calculate_pr_count_amount()
+EVENTS_TABLE_COLUMNS = ["NameMnemonic", "StateCode", "scenario", "variable", "date", "spell_length", "magnitude", "total"]
+
+
+def _exceedance_spells(dates: np.ndarray, values: np.ndarray, threshold: float) -> dict:
+    """Run-length encodes the days of a series above the threshold into 
+    spells of consecutive days. Missing days break the spells.
+    
+    Args:
+        dates (np.ndarray): Sorted datetime64[D] dates.
+        values (np.ndarray): Values of the dates.
+        threshold (float): Exceedance threshold.
+    
+    Returns:
+        dict: 'mask' of the exceedance days and the 'date' (first day), 
+            'spell_length', 'magnitude' (peak value) and 'total' (sum of the 
+            values) of every spell.
+    """
+    
+    mask = values > threshold
+    
+    # A spell continues if the previous day is the previous calendar day and an exceedance as well
+    cont = np.r_[False, mask[1:] & mask[:-1] & (np.diff(dates) == np.timedelta64(1, "D"))]
+    first = mask & ~cont
+    
+    exceed_values = values[mask]
+    spell_starts = np.flatnonzero(first[mask])
+    if len(spell_starts) == 0:
+        return {"mask": mask, "date": dates[:0], "spell_length": np.array([], dtype=np.int64), "magnitude": exceed_values, "total": exceed_values}
+    
+    return {
+        "mask": mask,
+        "date": dates[first],
+        "spell_length": np.diff(np.r_[spell_starts, len(exceed_values)]),
+        "magnitude": np.maximum.reduceat(exceed_values, spell_starts),
+        "total": np.add.reduceat(exceed_values, spell_starts),
+    }
+
+
 def calculate_pr_count_amount(
     sites: pd.DataFrame, 
     scenarios: List[str], 
     variables: List[str], 
     datadir: str, 
-    df_pr_csv_path: str
+    df_pr_csv_path: str,
+    events: bool=False,
+    cube_path: str=None,
 ) -> None:
     """Calculates precipitation count and amount.
     
+    The counts and amounts are normalized by the number of years present in 
+    each series, e.g. 56 for a 1950-2005 'historical' series.
+    
     Args:
         sites (pd.DataFrame): Data Frame containing all the site information. 
         scenarios (List[str]): Scenarios of interest.
@@ -116,6 +282,14 @@ def calculate_pr_count_amount(
             The generated output file is also stored here.
         df_pr_csv_path (str): This data frame can be generated using the calculate_Nth_percentile() function.
             The csv file generated from this function is passed here as argument.
+        events (bool, optional): Also write the exceedance events of all the 
+            sites to 'LMsites_exceedance_events.csv' in datadir. The 
+            consecutive exceedance days are merged into spells with one row 
+            per spell: NameMnemonic, StateCode, scenario, variable, date 
+            (first day), spell_length (days), magnitude (peak value) and 
+            total (sum of the values). Defaults to False.
+        cube_path (str, optional): Cube generated by cube.build_cube() that is 
+            read instead of the ensemble CSVs. Defaults to None.
     
     Returns:
         pd.DataFrame: The output DataFrame that is written to a csv file is also returned.
@@ -125,15 +299,20 @@ def calculate_pr_count_amount(
             exist in the df_pr data frame that is mentioned in df_pr_csv_path.
     """
     
-    nyr_hist = 56    # QUESTION: fixed values or random values for experiment?
-    nyr_proj = 93    # QUESTION: fixed values or random values for experiment?
-    
     # df_pr is required to calculate counts and amounts greater than 'historical' values
     df_pr = pd.read_csv(df_pr_csv_path)
     
+    # Scanning datadir once instead of checking every file separately
+    file_catalog = catalog.get_catalog(datadir)
+    cube_ds = cube.open_cube(cube_path) if cube_path is not None else None
+    
     # Declare variables that will be used to convert the processed data to a DataFrame
     df_array = []
     df_colnames = []
+    events_list = []
+
+    # Sites of every scenario and variable that are calculated from their current series
+    regenerated = {}
     
     # Loop over all the sites. 
     # ID and Object ID are stored only to inspect the final result with the corresponding site
@@ -150,21 +329,33 @@ def calculate_pr_count_amount(
                 if historical_col_name not in df_pr:
                     raise KeyError(f"{historical_col_name} column does not exist in the percentile data frame. Check the df_pr_csv_path argument.")
                 
-                csv_path = os.path.join(datadir, 
-                                        f"{sce}_{var}_ensemble", 
-                                        f"{name}_{state}_{sce}_{var}.csv")
-                
-                if not os.path.exists(csv_path):
-                    print(f"WARNING: {csv_path} does not exist. Continuing to the next file.")
+                df = _read_site_series(datadir, name, state, sce, var, file_catalog, cube_ds)
+                if df is None:
                     continue
                 
                 # Preprocessing step
-                df = pd.read_csv(csv_path)
-                df1 = df.set_index('date')
+                dates = pd.to_datetime(df["date"]).values.astype("datetime64[D]")
+                values = df["mean"].to_numpy(dtype=np.float64)
+                
+                # The exceedance mask, counts, amounts, and spells are calculated in the same pass
+                spells = _exceedance_spells(dates, values, df_pr[historical_col_name].iloc[i])
+                n_years = len(_year_offsets(dates)[0])
+                count = np.count_nonzero(spells["mask"]) / n_years
+                amount = np.mean(values[spells["mask"]]) / n_years
+                
+                if events:
+                    events_list.append(pd.DataFrame({
+                        "NameMnemonic": name,
+                        "StateCode": state,
+                        "scenario": sce,
+                        "variable": var,
+                        "date": spells["date"],
+                        "spell_length": spells["spell_length"],
+                        "magnitude": spells["magnitude"],
+                        "total": spells["total"],
+                    }))
 
-                div_const = nyr_hist if sce == "historical" else nyr_proj
-                count = np.count_nonzero(df1['mean'] > df_pr[historical_col_name].iloc[i]) / div_const
-                amount = np.mean(df1[df1['mean'] > df_pr[historical_col_name].iloc[i]]['mean']) / div_const
+                regenerated.setdefault((sce, var), []).append((name, state))
 
                 # Update the column names and store the row information
                 colname = f"{sce}_{var}_counts"
@@ -196,8 +387,16 @@ def calculate_pr_count_amount(
     # Write to CSV
     output_csv_path = os.path.join(datadir, "LMsites_counts_amounts.csv")
     df_pr_counts_amounts.to_csv(output_csv_path)
+    # The output is only as current as the ensemble output or the cube it was read from
+    catalog.clear_stale(datadir, output_csv_path, regenerated, upstream=cube_path or os.path.join(datadir, catalog.ENSEMBLE_STAGE))
     print(f"STATUS UPDATE: The output file generated from calculate_pr_count_amount() function is stored as {output_csv_path}.")    
     
+    if events:
+        events_table = pd.concat(events_list, ignore_index=True) if events_list else pd.DataFrame(columns=EVENTS_TABLE_COLUMNS)
+        events_csv_path = os.path.join(datadir, "LMsites_exceedance_events.csv")
+        events_table[EVENTS_TABLE_COLUMNS].to_csv(events_csv_path, index=False)
+        print(f"STATUS UPDATE: The {len(events_table)} exceedance events generated from calculate_pr_count_amount() function are stored as {events_csv_path}.")
+    
     return df_pr_counts_amounts
     
 
@@ -207,7 +406,8 @@ def calculate_temporal_mean(
     variables: List[str], 
     datadir: str, 
     start_date: str, 
-    end_date: str
+    end_date: str,
+    cube_path: str=None,
 ) -> None:
         
     """Calculates mean precipitation for the 'historical' scenario or 
@@ -221,16 +421,25 @@ def calculate_temporal_mean(
             The generated output file is also stored here.
         start_date (str): Must be in the format 'YYYY-MM' or 'YYYY-MM-DD'.
         end_date (str): Must be in the format 'YYYY-MM' or 'YYYY-MM-DD'.
+        cube_path (str, optional): Cube generated by cube.build_cube() that is 
+            read instead of the ensemble CSVs. Defaults to None.
     
     Returns:
         pd.DataFrame: The output DataFrame that is written to a csv file is also returned.
         
     """
 
+    # Scanning datadir once instead of checking every file separately
+    file_catalog = catalog.get_catalog(datadir)
+    cube_ds = cube.open_cube(cube_path) if cube_path is not None else None
+    
     # Declare variables that will be used to convert the processed data to a DataFrame
     df_array = []
     df_colnames = []
 
+    # Sites of every scenario and variable that are calculated from their current series
+    regenerated = {}
+
     # Loop over all the sites. 
     # ID and Object ID are stored only to inspect the final result with the corresponding site
     for _oid, _id, name, state in zip(sites.OBJECTID, sites.ID, sites.NameMnemonic, sites.StateCode):
@@ -241,16 +450,11 @@ def calculate_temporal_mean(
         for sce in scenarios:
             for var in variables:
                 
-                csv_path = os.path.join(datadir, 
-                                        f"{sce}_{var}_ensemble", 
-                                        f"{name}_{state}_{sce}_{var}.csv")
-                
-                if not os.path.exists(csv_path):
-                    print(f"WARNING: {csv_path} does not exist. Continuing to the next file.")
+                df = _read_site_series(datadir, name, state, sce, var, file_catalog, cube_ds)
+                if df is None:
                     continue
                 
                 # Preprocessing step
-                df = pd.read_csv(csv_path)
                 df1 = df.set_index('date')
                 
                 # 'historial' scenario dates from 1950 to 2006.
@@ -267,7 +471,9 @@ def calculate_temporal_mean(
                     
                     # Generate column names
                     colname = f"{sce}_{var}_mean"
-                
+
+                regenerated.setdefault((sce, var), []).append((name, state))
+
                 # Update the column names
                 if colname not in df_colnames:
                     df_colnames.append(colname)
@@ -293,67 +499,731 @@ def calculate_temporal_mean(
     # Write to CSV
     output_csv_path = os.path.join(datadir, "LMsites_seg.csv")
     df_pr.to_csv(output_csv_path)
+    # The output is only as current as the ensemble output or the cube it was read from
+    catalog.clear_stale(datadir, output_csv_path, regenerated, upstream=cube_path or os.path.join(datadir, catalog.ENSEMBLE_STAGE))
     print(f"STATUS UPDATE: The output file generated from calculate_temporal_mean() function is stored as {output_csv_path}.")    
     
     return df_pr
 
 
+def _iter_model_blocks(all_files: List[str], block_days: int, mismatched: List[str]=None) -> Iterator[np.ndarray]:
+    """Reads the model CSVs of a site in blocks of rows.
+    
+    Only block_days rows of every model file are held in memory at a time. 
+    The rows are aligned by position and the first file decides the number 
+    of rows, i.e. longer files are truncated and shorter files are nan padded.
+    
+    Args:
+        all_files (List[str]): Model CSV files of a site, scenario and variable.
+        block_days (int): Number of rows (days) in each block.
+        mismatched (List[str], optional): The files whose number of rows 
+            differs from the first file are appended to this list. 
+            Defaults to None.
+    
+    Yields:
+        np.ndarray: Day x model array of the values of a block.
+    """
+    
+    differs = [False] * len(all_files)
+    readers = [pd.read_csv(filename, index_col=None, header=0, chunksize=block_days) for filename in all_files]
+    for chunks in itertools.zip_longest(*readers):
+        if chunks[0] is None:
+            # The files that still have rows are longer than the first file
+            differs = [differs[i] or chunk is not None for i, chunk in enumerate(chunks)]
+            break
+        
+        values = np.full((len(chunks[0]), len(chunks)), np.nan)
+        for i, chunk in enumerate(chunks):
+            if chunk is None or len(chunk) != len(chunks[0]):
+                differs[i] = True
+            if chunk is not None:
+                column = chunk.iloc[:len(values), 1].to_numpy(dtype=np.float64)
+                values[:len(column), i] = column
+        yield values
+    
+    if mismatched is not None:
+        mismatched.extend(filename for filename, flag in zip(all_files, differs) if flag)
+
+
+def _is_leap_day(dates: np.ndarray) -> np.ndarray:
+    """Boolean mask of the 29th February dates of a datetime64[D] array."""
+    
+    dates = pd.DatetimeIndex(dates)
+    return np.asarray((dates.month == 2) & (dates.day == 29))
+
+
+def _iter_models_aligned(all_files: List[str], block_days: int, gaps: List[dict]=None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Reads the model CSVs of a site in blocks of rows and aligns them on 
+    their real dates.
+    
+    The shared calendar is the sorted union of the dates of all the models. 
+    The files are merged like sorted runs: every file is read block_days rows 
+    at a time, and the dates up to the smallest last buffered date of the 
+    files that are not exhausted are complete, so they are placed on the 
+    calendar (searchsorted) and yielded. Only about one block of every model 
+    is held in memory at a time.
+    
+    The files are expected to be sorted by date, as exported by 
+    SitesDownloader. Duplicate dates keep their first value. Rows dated 
+    before a previous row of the same file, and unparsable dates (e.g. 30th 
+    February of 360-day calendars), are dropped and reported as invalid dates. 
+    Models without any 29th February in leap years are treated as 365-day 
+    (no-leap) calendars, so the missing leap days are not reported as gaps.
+    
+    Args:
+        all_files (List[str]): Model CSV files of a site, scenario and variable.
+        block_days (int): Number of rows (days) read from every file at a time.
+        gaps (List[dict], optional): One dictionary per model with missing or 
+            dropped dates is appended to this list once all the files are 
+            read. Defaults to None.
+    
+    Yields:
+        Tuple[np.ndarray, np.ndarray]: Dates (datetime64[D]) of a block of the 
+            shared calendar and the day x model array of the values (nan where 
+            a model has no value).
+    """
+    
+    n_models = len(all_files)
+    readers = [pd.read_csv(filename, index_col=None, header=0, chunksize=block_days) for filename in all_files]
+    exhausted = [False] * n_models
+    buffers = [(np.array([], dtype="datetime64[D]"), np.array([])) for _ in all_files]
+    last_dates = [None] * n_models
+    
+    # Per model counts of the missing dates, kept separately for the leap days
+    n_invalid = [0] * n_models
+    has_leap_day = [False] * n_models
+    calendar_has_leap_day = False
+    missing = [{"n": 0, "n_leap": 0, "first": None, "last": None, "first_noleap": None, "last_noleap": None} for _ in all_files]
+    
+    def refill(i: int) -> None:
+        # Reading blocks of a file until some rows are kept or the file is exhausted
+        while not exhausted[i] and len(buffers[i][0]) == 0:
+            chunk = next(readers[i], None)
+            if chunk is None:
+                exhausted[i] = True
+                break
+            
+            dates = pd.to_datetime(chunk["date"], errors="coerce")
+            valid = dates.notna().to_numpy()
+            dates = dates[valid].to_numpy().astype("datetime64[D]")
+            values = chunk.iloc[:, 1].to_numpy(dtype=np.float64)[valid]
+            
+            # Dates below the latest previous date of the file are out of order, dates equal to it are duplicates
+            days = dates.astype(np.int64)
+            previous = np.iinfo(np.int64).min if last_dates[i] is None else last_dates[i].astype(np.int64)
+            latest = np.maximum.accumulate(np.concatenate([[previous], days]))[:-1]
+            keep = days > latest
+            n_invalid[i] += int((~valid).sum()) + int((days < latest).sum())
+            
+            if keep.any():
+                buffers[i] = (dates[keep], values[keep])
+                last_dates[i] = dates[keep][-1]
+    
+    while True:
+        for i in range(n_models):
+            refill(i)
+        
+        pending = [i for i in range(n_models) if len(buffers[i][0])]
+        if not pending:
+            break
+        
+        # Dates up to the horizon are complete in all the files
+        open_files = [i for i in pending if not exhausted[i]]
+        horizon = min(buffers[i][0][-1] for i in open_files) if open_files else max(buffers[i][0][-1] for i in pending)
+        
+        parts = []
+        for i in range(n_models):
+            dates, values = buffers[i]
+            n = int(np.searchsorted(dates, horizon, side="right"))
+            parts.append((dates[:n], values[:n]))
+            buffers[i] = (dates[n:], values[n:])
+        
+        calendar = np.unique(np.concatenate([dates for dates, _ in parts]))
+        leap = _is_leap_day(calendar)
+        calendar_has_leap_day = calendar_has_leap_day or bool(leap.any())
+        
+        block = np.full((len(calendar), n_models), np.nan)
+        for i, (dates, values) in enumerate(parts):
+            block[np.searchsorted(calendar, dates), i] = values
+            has_leap_day[i] = has_leap_day[i] or bool(_is_leap_day(dates).any())
+            
+            absent = ~np.isin(calendar, dates, assume_unique=True)
+            if absent.any():
+                stats = missing[i]
+                stats["n"] += int(absent.sum())
+                stats["n_leap"] += int((absent & leap).sum())
+                stats["first"] = stats["first"] or str(calendar[absent][0])
+                stats["last"] = str(calendar[absent][-1])
+                if (absent & ~leap).any():
+                    stats["first_noleap"] = stats["first_noleap"] or str(calendar[absent & ~leap][0])
+                    stats["last_noleap"] = str(calendar[absent & ~leap][-1])
+        
+        yield calendar, block
+    
+    if gaps is None:
+        return
+    
+    for i, filename in enumerate(all_files):
+        stats = missing[i]
+        noleap = calendar_has_leap_day and not has_leap_day[i]
+        n_missing = stats["n"] - stats["n_leap"] if noleap else stats["n"]
+        
+        if n_missing > 0 or n_invalid[i] > 0:
+            gaps.append({
+                "file": os.path.basename(filename), 
+                "n_missing": n_missing, 
+                "first_missing": stats["first_noleap" if noleap else "first"], 
+                "last_missing": stats["last_noleap" if noleap else "last"], 
+                "n_invalid_dates": n_invalid[i], 
+                "noleap": noleap,
+            })
+
+
+def _ensemble_stats(values: np.ndarray, quantiles: List[float]=None) -> dict:
+    """Calculates the cross-model mean, std, and quantiles of every day.
+    
+    Args:
+        values (np.ndarray): Day x model array.
+        quantiles (List[float], optional): Percentiles between 0 and 100. 
+            Defaults to None, i.e. no quantiles.
+    
+    Returns:
+        dict: Column name to day array, i.e. 'mean', 'std', and 'q{quantile}' 
+            for every quantile.
+    """
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)    # days without any model value
+        stats = {
+            "mean": np.nanmean(values, axis=1),
+            "std": np.nanstd(values, axis=1, ddof=1),
+        }
+        
+        if quantiles:
+            # np.nanpercentile() partially sorts (partitions) the models of each day
+            bands = np.nanpercentile(values, quantiles, axis=1)
+            for q, band in zip(quantiles, bands):
+                stats[f"q{q:g}"] = band
+    
+    return stats
+
+
 def get_climate_ensemble(
     sites: pd.DataFrame, 
     scenarios: List[str], 
     variables: List[str], 
     datadir: str, 
+    output_format: str="csv",
+    quantiles: List[float]=None,
+    block_days: int=366,
+    align_dates: bool=False,
 ) -> None:
     """Calculates the mean and std of data for each site.
     
+    The model files are read in blocks of block_days rows, so only one block 
+    of all the models is held in memory at a time. Cross-model quantile bands 
+    can be added to the output using the quantiles argument.
+    
+    By default the model files are aligned by row position and the dates are 
+    generated starting from 1950-01-01. With align_dates=True the real dates of 
+    the model files are used instead, so truncated or partial model exports 
+    are aligned correctly and the gaps are reported in 
+    'climate_ensemble_gaps.csv' in datadir.
+    
+    The regenerated site series are no longer stale for the output of this 
+    function (refer to catalog.mark_stale()). After an incremental download 
+    only the catalog.stale_sites() of os.path.join(datadir, 
+    catalog.ENSEMBLE_STAGE) need to be passed. The downstream functions stay 
+    stale for a site until this function is run for it.
+    
     Args:
         sites (pd.DataFrame): Data Frame containing all the site information. 
         scenarios (List[str]):  Scenarios of interest.
         variables (List[str]):  Variables of interest.
         datadir (str): Parent directory containing all the data files.
             The generated output file is also stored here.
+        output_format (str, optional): Format of the generated output. 
+            Defaults to 'csv'.
+            Options: 'csv' | 'parquet'
+            'csv': One CSV per site, scenario and variable in the 
+                'climate_ensemble' directory.
+            'parquet': A single 'climate_ensemble.parquet' dataset partitioned 
+                by scenario and variable. The per-site CSVs can still be 
+                generated from it using dataset.export_site_csvs().
+        quantiles (List[float], optional): Cross-model percentiles between 
+            0 and 100 that are added as 'q{quantile}' columns, 
+            e.g. [10, 50, 90] adds 'q10', 'q50', and 'q90'. 
+            Defaults to None, i.e. only mean and std.
+        block_days (int, optional): Number of days read from every model file 
+            at a time. Defaults to 366.
+        align_dates (bool, optional): Align the model files on the dates in 
+            their 'date' column. The files are also read in blocks of 
+            block_days rows and are expected to be sorted by date. 
+            Defaults to False, i.e. aligned by row position with a warning 
+            if the model files have different numbers of rows.
+    
+    Raises:
+        ValueError: If the value of output_format is not one of the specified options.
+        ValueError: If any of the quantiles is outside the range [0, 100].
     """
+    
+    if quantiles is not None and any(q < 0 or q > 100 for q in quantiles):
+        raise ValueError("Incorrect value for quantiles. All quantiles must be between 0 and 100.")
+    
+    if output_format not in ["csv", "parquet"]:
+        raise ValueError("Incorrect value for output_format. Expecting one of these two: 'csv' | 'parquet'.")
+    
     # Create the output directory where the generated CSVs will be stored
-    output_dir = os.path.join(datadir, "climate_ensemble")
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
+    if output_format == "csv":
+        output_dir = os.path.join(datadir, "climate_ensemble")
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+    else:
+        output_dir = os.path.join(datadir, "climate_ensemble.parquet")
+    
+    # Scanning datadir once instead of globbing the model files of every site
+    file_catalog = catalog.get_catalog(datadir)
+    
+    # Missing dates of the model files found with align_dates
+    all_gaps = []
+    
+    # Site series whose model files have different numbers of rows without align_dates
+    mismatched_series = []
+    
+    # Sites of every scenario and variable whose ensemble is written
+    regenerated = {}
+    
+    if output_format == "parquet":
+        writer = dataset.PartitionedDatasetWriter(output_dir, partition_cols=["scenario", "variable"])
+    
+    try:
+        # Iterating over all sites
+        name_state_list = list(zip(sites.NameMnemonic, sites.StateCode))
+        with tqdm(name_state_list) as tqdm_name_state_list:
+            tqdm_name_state_list.set_description("LM Sites")
+            
+            for name, state in tqdm_name_state_list:
+
+                # Iterating over all combinations of scenarios and variables
+                for scenario in scenarios:
+                    for variable in variables:
+
+                        filepath_format = os.path.join(datadir, f"{scenario}_{variable}", f"{name}_{state}*.csv")
+                        all_files = file_catalog.model_files(scenario, variable, name, state)
+                        
+                        if not all_files:
+                            print(f"WARNING: {filepath_format} does not match any file. Continuing to the next file.")
+                            continue
+
+                        # Creating a new data frame that contains the ensemble mean and std values
+                        df2 = pd.DataFrame()
+
+                        if align_dates:
+                            # Iterating over blocks of the shared calendar of all the models to calculate the ensemble stats
+                            gaps, calendar, block_stats = [], [], []
+                            for dates, values in _iter_models_aligned(all_files, block_days, gaps):
+                                calendar.append(dates)
+                                block_stats.append(_ensemble_stats(values, quantiles))
+                            for gap in gaps:
+                                all_gaps.append({"NameMnemonic": name, "StateCode": state, "scenario": scenario, "variable": variable, **gap})
+                            
+                            if not block_stats:
+                                print(f"WARNING: The files matching {filepath_format} do not have any valid date. Continuing to the next file.")
+                                continue
+                            df2["date"] = pd.DatetimeIndex(np.concatenate(calendar))
+                        else:
+                            # Iterating over blocks of days of all the models to calculate the ensemble stats
+                            mismatched = []
+                            block_stats = [_ensemble_stats(values, quantiles) for values in _iter_model_blocks(all_files, block_days, mismatched)]
+                            n_days = sum(len(stats["mean"]) for stats in block_stats)
+                            if mismatched:
+                                mismatched_series.append((name, state, scenario, variable))
+
+                            start_date = datetime.date(1950, 1, 1)    # NOTE: Use align_dates=True to read the dates from the CSV files.
+                            end_date = start_date + datetime.timedelta(days=n_days-1)
+                            df2["date"] = pd.date_range(start_date, end_date)
+
+                        for colname in block_stats[0]:
+                            df2[colname] = np.concatenate([stats[colname] for stats in block_stats])
+
+                        if output_format == "csv":
+                            output_csv_path = os.path.join(output_dir, f"{name}_{state}_{scenario}_{variable}.csv")
+                            df2.to_csv(output_csv_path)
+                            # print(f"STATUS UPDATE: The output file is stored as {output_csv_path}.")
+                        else:
+                            writer.write(df2.assign(NameMnemonic=name, StateCode=state, scenario=scenario, variable=variable))
+                        
+                        regenerated.setdefault((scenario, variable), []).append((name, state))
+    finally:
+        # Flushing the buffered rows also when a site fails
+        if output_format == "parquet":
+            writer.close()
+    
+    # Only the written ensembles are up to date with the model files again. Both 
+    # output formats are recorded as the ENSEMBLE_STAGE, the input of the downstream functions.
+    catalog.clear_stale(datadir, os.path.join(datadir, catalog.ENSEMBLE_STAGE), regenerated)
+    
+    if all_gaps:
+        gaps_csv_path = os.path.join(datadir, "climate_ensemble_gaps.csv")
+        pd.DataFrame(all_gaps).to_csv(gaps_csv_path)
+        warnings.warn(f"{len(all_gaps)} model files have missing or invalid dates. The gaps are listed in {gaps_csv_path}.")
+    
+    if mismatched_series:
+        examples = ", ".join("_".join(series) for series in mismatched_series[:3])
+        warnings.warn(f"The model files of {len(mismatched_series)} site series have different numbers of rows (e.g. {examples}). "
+                      "They were aligned by row position, i.e. truncated or nan padded to the first model file. "
+                      "Use align_dates=True to align them on their dates.")
+    
+    print(f"STATUS UPDATE: The {output_format} output generated from get_climate_ensemble() function is stored in '{output_dir}'.")
+
+
+def _read_ensemble_series(
+    datadir: str, 
+    name: str, 
+    state: str, 
+    scenarios: List[str], 
+    variables: List[str],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads the ensemble 'mean' series of a site for all combinations of 
+    scenarios and variables and concatenates them in chronological order.
+    
+    Args:
+        datadir (str): Parent directory containing all the data files.
+        name (str): Name Mnemonic of the site.
+        state (str): Site location state code.
+        scenarios (List[str]):  Scenarios of interest.
+        variables (List[str]):  Variables of interest.
+    
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Dates (datetime64[D]) and the 
+            corresponding values, stably sorted by date.
+    """
+    
+    dates_list = []
+    values_list = []
+    for sce in scenarios:
+        for var in variables:
+            csv_path = os.path.join(datadir, f"{sce}_{var}_ensemble", f"{name}_{state}_{sce}_{var}.csv")
+            df_i = pd.read_csv(csv_path, usecols=["date", "mean"])
+            
+            # Converting the dates once per file instead of once per concatenation
+            dates_list.append(pd.to_datetime(df_i["date"]).values.astype("datetime64[D]"))
+            values_list.append(df_i["mean"].to_numpy(dtype=np.float64))
+    
+    dates = np.concatenate(dates_list)
+    values = np.concatenate(values_list)
+    
+    # Stable sort keeps the scenario order for overlapping dates
+    order = np.argsort(dates, kind="stable")
+    return dates[order], values[order]
+
+
+def _year_offsets(dates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the year axis and the offset of the first day of each year.
+    
+    The offsets can be used directly with the numpy ufunc reduceat() 
+    functions to reduce the daily values into annual values.
+    
+    Args:
+        dates (np.ndarray): Sorted datetime64 dates.
+    
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Years present in the data and the index 
+            of the first day of each of these years.
+    """
+    
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    return years[starts], starts
+
+
+def _load_calendar_groups(
+    sites: pd.DataFrame, 
+    scenarios: List[str], 
+    variables: List[str], 
+    datadir: str, 
+    description: str="LM Sites",
+    cube_path: str=None,
+) -> List[dict]:
+    """Reads the ensemble series of all sites and stacks the sites that share 
+    the same calendar into site x day arrays.
+    
+    Usually all the sites share a single calendar, so the date based indexes 
+    (year offsets, date range masks) are calculated only once.
+    
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information. 
+        scenarios (List[str]):  Scenarios of interest.
+        variables (List[str]):  Variables of interest.
+        datadir (str): Parent directory containing all the data files.
+        description (str, optional): Progress bar description.
+        cube_path (str, optional): Cube generated by cube.build_cube(). If 
+            given, the site x day arrays are read from the cube in one 
+            vectorized read per scenario and variable instead of the CSVs. 
+            All the sites then share the time axis of the cube.
+    
+    Returns:
+        List[dict]: One dictionary per calendar with the following keys:
+            'dates': datetime64[D] dates of the calendar.
+            'rows': Positions of the sites of the group in the sites data frame.
+            'block': Site x day array of the values.
+    """
+    
+    if cube_path is not None:
+        ds = cube.open_cube(cube_path)
+        cube_dates, cube_blocks = [], []
+        for sce in scenarios:
+            for var in variables:
+                dates, block = cube.cube_block(ds, sites, sce, var)
+                if not len(dates):
+                    print(f"WARNING: The {sce}_{var} series does not exist in the cube {cube_path}. Storing nan values for all the sites.")
+                cube_dates.append(dates)
+                cube_blocks.append(block)
+        
+        dates = np.concatenate(cube_dates)
+        order = np.argsort(dates, kind="stable")
+        return [{
+            "dates": dates[order], 
+            "rows": np.arange(len(sites)), 
+            "block": np.hstack(cube_blocks)[:, order],
+        }]
     
-    # Iterating over all sites
+    calendars = {}
     name_state_list = list(zip(sites.NameMnemonic, sites.StateCode))
     with tqdm(name_state_list) as tqdm_name_state_list:
-        tqdm_name_state_list.set_description("LM Sites")
-        
-        for name, state in tqdm_name_state_list:
+        tqdm_name_state_list.set_description(description)
 
-            # Iterating over all combinations of scenarios and variables
-            for scenario in scenarios:
-                for variable in variables:
+        for row, (name, state) in enumerate(tqdm_name_state_list):
+            dates, values = _read_ensemble_series(datadir, name, state, scenarios, variables)
+            
+            calendar = calendars.setdefault(dates.tobytes(), {"dates": dates, "rows": [], "values": []})
+            calendar["rows"].append(row)
+            calendar["values"].append(values)
+    
+    groups = []
+    for calendar in calendars.values():
+        groups.append({
+            "dates": calendar["dates"], 
+            "rows": np.array(calendar["rows"]), 
+            "block": np.vstack(calendar["values"]),
+        })
+    
+    return groups
 
-                    filepath_format = os.path.join(datadir, f"{scenario}_{variable}", f"{name}_{state}*.csv")
-                    all_files = glob.glob(filepath_format)
 
-                    # Iterating over all_files to create a single data frame of mean values of all the models
-                    for i, filename in enumerate(all_files):
-                        if i == 0:
-                            df = pd.read_csv(filename, index_col=None, header=0)
-                        else:
-                            df[str(i)] = pd.read_csv(filename, index_col=None, header=0).iloc[:, 1]
+def _approx_sub_period_stats(
+    datadir: str,
+    name: str,
+    state: str,
+    scenarios: List[str],
+    var: str,
+    date_ranges: List[Tuple[str]],
+    comp_function: Callable,
+    get_stats: bool,
+    q: float=99,
+    compression: float=200,
+    chunksize: int=100_000,
+) -> List[Tuple[float, float, float]]:
+    """Estimates the qth percentile of a site for every date range with
+    sketches.TDigest while reading the ensemble CSVs chunk-by-chunk, so the
+    CSVs are never held in memory as data frames.
+
+    Every CSV is read once. If get_stats is True, the values of the date
+    ranges are also kept as float arrays to count them in comparison with the
+    estimated percentiles.
+
+    Returns:
+        List[Tuple[float, float, float]]: Percentile, count and amount of
+            every date range. The count and amount are totals (not per year)
+            and are nan if get_stats is False.
+    """
+
+    csv_paths = [os.path.join(datadir, f"{sce}_{var}_ensemble", f"{name}_{state}_{sce}_{var}.csv") for sce in scenarios]
+    bounds = [(np.datetime64(pd.to_datetime(start_date), "D"), np.datetime64(pd.to_datetime(end_date), "D")) for start_date, end_date in date_ranges]
+
+    def read_chunks() -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yields the dates and values of the CSVs chunk-by-chunk."""
+
+        for csv_path in csv_paths:
+            for df_i in pd.read_csv(csv_path, usecols=["date", "mean"], chunksize=chunksize):
+                yield pd.to_datetime(df_i["date"]).values.astype("datetime64[D]"), df_i["mean"].to_numpy(dtype=np.float64)
+
+    digests = [sketches.TDigest(compression) for _ in date_ranges]
+    kept = [[] for _ in date_ranges]
+    for dates, values in read_chunks():
+        for i, (start, end) in enumerate(bounds):
+            values_i = values[(dates >= start) & (dates <= end)]
+            digests[i].update(values_i)
+            if get_stats:
+                kept[i].append(values_i)
+    agg_vals = [digest.percentile(q) for digest in digests]
+
+    counts = np.full(len(date_ranges), np.nan)
+    amounts = np.full(len(date_ranges), np.nan)
+    if get_stats:
+        for i, values_i in enumerate(kept):
+            values_i = np.concatenate(values_i) if values_i else np.empty(0)
+            query = comp_function(values_i[None, :], np.array([[agg_vals[i]]]))[0]
+            counts[i] = np.count_nonzero(query)
+            amounts[i] = np.nansum(np.where(query, values_i, 0.0))
+
+    return list(zip(agg_vals, counts, amounts))
+
+
+def _reduceat_nanmean(block: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Mean of each segment starting at 'starts' ignoring the nan values."""
+    
+    valid = ~np.isnan(block)
+    sums = np.add.reduceat(np.where(valid, block, 0.0), starts, axis=-1)
+    counts = np.add.reduceat(valid, starts, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def _reduceat_nanstd(block: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Sample std (ddof=1) of each segment starting at 'starts' ignoring the 
+    nan values."""
+    
+    # Values before the first segment are not part of any segment
+    block = block[..., starts[0]:]
+    starts = starts - starts[0]
+    
+    # Two pass calculation (sample std, ddof=1) to avoid cancellation errors
+    mean = _reduceat_nanmean(block, starts)
+    lengths = np.diff(np.r_[starts, block.shape[-1]])
+    dev = block - np.repeat(mean, lengths, axis=-1)
+    valid = ~np.isnan(dev)
+    sq_sums = np.add.reduceat(np.where(valid, dev * dev, 0.0), starts, axis=-1)
+    counts = np.add.reduceat(valid, starts, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 1, np.sqrt(sq_sums / (counts - 1)), np.nan)
+
+
+# Annual reducers that can be requested in get_per_year_stats().
+# Each reducer maps a site x day array and the year offsets to a site x year array.
+# The annual maximum of daily precipitation (Rx1day) is the 'maximum' reducer.
+ANNUAL_REDUCERS = {
+    "maximum": lambda block, starts: np.fmax.reduceat(block, starts, axis=-1),
+    "minimum": lambda block, starts: np.fmin.reduceat(block, starts, axis=-1),
+    "mean": _reduceat_nanmean,
+    "std": _reduceat_nanstd,
+    "sum": lambda block, starts: np.add.reduceat(np.nan_to_num(block), starts, axis=-1),
+    "rx5day": lambda block, starts: np.fmax.reduceat(aggregators.rolling_sum(block, 5), starts, axis=-1),
+}
+
+
+# Suffix of the append-only checkpoint files of the long running preprocess functions
+CHECKPOINT_SUFFIX = ".partial"
+
+
+def _site_chunks(sites: pd.DataFrame, checkpoint_every: int=None) -> List[pd.DataFrame]:
+    """Splits the sites into chunks of checkpoint_every sites. A single chunk 
+    of all the sites if checkpoint_every is None."""
+    
+    chunk_size = checkpoint_every or max(len(sites), 1)
+    return [sites.iloc[r0:r0+chunk_size] for r0 in range(0, len(sites), chunk_size)]
+
+
+def _atomic_to_csv(df: pd.DataFrame, csv_path: str, **kwargs: object) -> None:
+    """Writes the CSV to a temporary file first and renames it, so that the 
+    file at csv_path is either the previous or the complete new version."""
+    
+    tmp_path = f"{csv_path}.tmp"
+    df.to_csv(tmp_path, **kwargs)
+    os.replace(tmp_path, csv_path)
 
-                    # Creating a new data frame that contains the ensemble mean and std values
-                    df2 = pd.DataFrame()
 
-                    start_date = datetime.date(1950, 1, 1)    # TODO: Ideally this should be read from the CSV file but the date in the CSV file seems incorrect.
-                    end_date = start_date + datetime.timedelta(days=len(df)-1)    # TODO: Ideally this should be read from the CSV file but the date in the CSV file seems incorrect.
-                    df2["date"] = pd.date_range(start_date, end_date)
+def _signature_value(value: object) -> object:
+    """Stable representation of an argument of _checkpoint_signature().
+    
+    Callables are represented by their module and qualified name, and 
+    functools.partial objects also by their arguments. Anonymous callables 
+    (lambdas, nested functions, callable objects) have no name that 
+    identifies them in another run, so they are refused.
+    
+    Raises:
+        ValueError: If the value is or contains an anonymous callable.
+    """
+    
+    if isinstance(value, (list, tuple)):
+        return type(value)(_signature_value(item) for item in value)
+    
+    if isinstance(value, functools.partial):
+        return (_signature_value(value.func), _signature_value(value.args), _signature_value(sorted(value.keywords.items())))
+    
+    if callable(value):
+        name = getattr(value, "__qualname__", None) or getattr(value, "__name__", None)
+        if name is None or "<" in name:
+            raise ValueError(f"Checkpoints cannot identify the anonymous callable {value!r}. "
+                             "Pass a module-level function or a functools.partial of one, or checkpoint_every=None.")
+        return f"{getattr(value, '__module__', None)}.{name}"
+    
+    return value
+
+
+def _checkpoint_signature(**arguments: object) -> str:
+    """Hash of the arguments that determine the rows of a checkpoint. Callables 
+    are represented by their name and partial arguments 
+    (refer to _signature_value())."""
+    
+    arguments = {key: _signature_value(value) for key, value in arguments.items()}
+    return hashlib.sha1(repr(sorted(arguments.items())).encode()).hexdigest()[:16]
 
-                    df2["mean"] = df.mean(axis=1, numeric_only=True)    # avoids the date column
-                    df2["std"] = df.std(axis=1, numeric_only=True)    # avoids the date column
 
-                    output_csv_path = os.path.join(output_dir, f"{name}_{state}_{scenario}_{variable}.csv")
-                    df2.to_csv(output_csv_path)
-                    # print(f"STATUS UPDATE: The output file is stored as {output_csv_path}.")
+def _append_checkpoint(checkpoint_path: str, df: pd.DataFrame, signature: str) -> None:
+    """Appends the rows of the completed sites to the checkpoint file and 
+    syncs it to disk. Every row starts with the signature of the arguments 
+    (refer to _checkpoint_signature())."""
     
-    print(f"STATUS UPDATE: The CSVs generated from get_climate_ensemble() function are stored in the '{output_dir}' directory.")
+    header = not os.path.exists(checkpoint_path) or os.path.getsize(checkpoint_path) == 0
+    with open(checkpoint_path, "a") as f:
+        f.write(df.assign(checkpoint_signature=signature)[["checkpoint_signature"] + list(df.columns)].to_csv(header=header, index=False))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_checkpoint(checkpoint_path: str, columns: List[str], signature: str, resume: bool=True) -> pd.DataFrame:
+    """Reads the rows of the sites completed by a previous run.
+    
+    Args:
+        checkpoint_path (str): Path of the checkpoint file.
+        columns (List[str]): Expected columns of the checkpoint file.
+        signature (str): Signature of the arguments of the current run.
+        resume (bool, optional): If False, an existing checkpoint is deleted. 
+            Defaults to True.
+    
+    Returns:
+        pd.DataFrame: Completed rows (without the signature), or None if there 
+            is no checkpoint.
+    
+    Raises:
+        ValueError: If the checkpoint was generated with different arguments, 
+            i.e. has different columns or a different signature.
+    """
+    
+    if not os.path.exists(checkpoint_path):
+        return None
+    
+    if not resume:
+        os.remove(checkpoint_path)
+        return None
+    
+    # Dropping the incomplete last line of an interrupted append
+    with open(checkpoint_path, "rb+") as f:
+        content = f.read()
+        f.truncate(content.rfind(b"\n") + 1)
+    
+    # Empty strings are the only missing values, so that site names such as 'NA' are kept
+    if os.path.getsize(checkpoint_path):
+        done = pd.read_csv(checkpoint_path, keep_default_na=False, na_values=[""], dtype={"NameMnemonic": str, "StateCode": str})
+    else:
+        done = pd.DataFrame(columns=["checkpoint_signature"] + list(columns))
+    if list(done.columns) != ["checkpoint_signature"] + list(columns) or (done["checkpoint_signature"].astype(str) != signature).any():
+        raise ValueError(f"The checkpoint {checkpoint_path} was generated with different arguments. Delete it or pass resume=False.")
+    done = done.drop(columns="checkpoint_signature")
+    
+    print(f"STATUS UPDATE: Resuming from {checkpoint_path}. Skipping {len(done)} checkpointed sites.")
+    return done
 
 
 def get_per_year_stats(
@@ -361,68 +1231,161 @@ def get_per_year_stats(
     scenarios: List[str], 
     variables: List[str], 
     datadir: str, 
+    reducers: List[str]=None,
+    output_format: str="csv",
+    cube_path: str=None,
+    checkpoint_every: int=None,
+    resume: bool=True,
 ) -> None:
     """Calculates the year-wise max, mean, and std of data for each site.
     
+    The year offsets are computed once for all the sites that share the same 
+    calendar and all the annual statistics are calculated for the site x day 
+    array using reduceat() instead of a separate groupby pass per statistic.
+    The years in the output are derived from the data.
+    
     Args:
         sites (pd.DataFrame): Data Frame containing all the site information. 
         scenarios (List[str]):  Scenarios of interest.
         variables (List[str]):  Variables of interest.
         datadir (str): Parent directory containing all the data files.
             The generated output file is also stored here.
+        reducers (List[str], optional): Annual statistics to calculate. 
+            Defaults to None, i.e. ['maximum', 'mean', 'std'].
+            Options: any key of ANNUAL_REDUCERS, i.e. 'maximum' | 'minimum' | 
+            'mean' | 'std' | 'sum' | 'rx5day'. The Rx1day index is 'maximum'.
+        output_format (str, optional): Format of the generated output. 
+            Defaults to 'csv'.
+            Options: 'csv' | 'parquet'
+            'csv': One '{name}_{state}_PMP.csv' per site in the 
+                'per_year_stats' directory.
+            'parquet': A single 'per_year_stats.parquet' dataset. The per-site 
+                CSVs can still be generated from it using 
+                dataset.export_site_csvs().
+        cube_path (str, optional): Cube generated by cube.build_cube() that is 
+            read instead of the ensemble CSVs. Defaults to None.
+        checkpoint_every (int, optional): Number of sites that are read and 
+            written at a time. The completed sites of every chunk are appended 
+            to the 'per_year_stats/.checkpoint.partial' file and skipped when 
+            the function is run again after a failure. The file is deleted 
+            once all the sites are done. Only supported for the 'csv' output 
+            format. Defaults to None, i.e. all the sites at once without 
+            checkpoints.
+        resume (bool, optional): Skip the sites of an existing checkpoint. 
+            Otherwise the checkpoint is deleted and all the sites are 
+            recalculated. Defaults to True.
+    
+    Raises:
+        ValueError: If any of the reducers is not one of the specified options.
+        ValueError: If the value of output_format is not one of the specified options.
+        ValueError: If checkpoint_every is used with the 'parquet' output format.
+        ValueError: If an existing checkpoint was generated with different 
+            scenarios, variables, reducers or cube_path.
     """
+    
+    if reducers is None:
+        reducers = ["maximum", "mean", "std"]
+    
+    # Verify the reducers before reading any data
+    for reducer in reducers:
+        if reducer not in ANNUAL_REDUCERS:
+            raise ValueError(f"Incorrect reducer '{reducer}'. Expecting one of these: {' | '.join(ANNUAL_REDUCERS)}.")
+    
+    if output_format not in ["csv", "parquet"]:
+        raise ValueError("Incorrect value for output_format. Expecting one of these two: 'csv' | 'parquet'.")
+    
+    if checkpoint_every is not None and output_format != "csv":
+        raise ValueError("Checkpoints are only supported for the 'csv' output format.")
+    
     # Create the output directory where the generated CSVs will be stored
-    output_dir = os.path.join(datadir, "per_year_stats")
+    output_dir = os.path.join(datadir, "per_year_stats" if output_format == "csv" else "per_year_stats.parquet")
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
+    elif output_format == "csv":
+        warnings.warn(f"{output_dir} already exists! The generated output will be added or overwritten in this directory.")
     else:
-        warnings.warn(f"{output_dir} already exists! The generated CSVs will be added or overwritten in this directory.")
+        warnings.warn(f"{output_dir} already exists! The existing dataset will be replaced by the generated output.")
     
-    # Iterating over all sites
-    name_state_list = list(zip(sites.NameMnemonic, sites.StateCode))
-    with tqdm(name_state_list) as tqdm_name_state_list:
-        tqdm_name_state_list.set_description("LM Sites")
-
-        for name, state in tqdm_name_state_list:
-            df_array = []
-
-            # Iterating over all combinations of scenarios and variables and 
-            # concating data for all combinations in a single data frame
-            df = pd.DataFrame()
-            for sce in scenarios:
-                for var in variables:
-                    csv_path = os.path.join(datadir, f"{sce}_{var}_ensemble", f"{name}_{state}_{sce}_{var}.csv")
-                    df_i = pd.read_csv(csv_path)
-                    df_i = df_i.set_index("date")
-
-                    if df.empty:
-                        df = df_i
-                    else:
-                        df = pd.concat([df, df_i])
-
-                    df.index = pd.to_datetime(df.index)
-
-            # Calculating the year-wise max, mean, and std for the data
-            max_val = df['mean'].groupby(pd.Grouper(freq='1Y')).max()
-            mean_val = df['mean'].groupby(pd.Grouper(freq='1Y')).mean()
-            std_val = df['mean'].groupby(pd.Grouper(freq='1Y')).std()
-
-            # Adding data to the data frame array
-            df_array.append(max_val)
-            df_array.append(mean_val)
-            df_array.append(std_val)
+    # Skipping the sites that were completed by a previous run
+    checkpoint_path = os.path.join(output_dir, f".checkpoint{CHECKPOINT_SUFFIX}")
+    todo = sites
+    signature = _checkpoint_signature(scenarios=scenarios, variables=variables, reducers=reducers, cube_path=cube_path)
+    if checkpoint_every is not None:
+        done = _read_checkpoint(checkpoint_path, ["NameMnemonic", "StateCode"], signature, resume)
+        if done is not None:
+            done_keys = set(zip(done.NameMnemonic.astype(str), done.StateCode.astype(str)))
+            todo = sites[[(str(name), str(state)) not in done_keys for name, state in zip(sites.NameMnemonic, sites.StateCode)]]
+    
+    if output_format == "parquet":
+        writer = dataset.PartitionedDatasetWriter(output_dir)
+    
+    try:
+        for chunk in _site_chunks(todo, checkpoint_every):
+            # Reading the data of the sites and grouping the sites by their calendar 
+            # so that the year offsets are shared by all the sites in a group
+            groups = _load_calendar_groups(chunk, scenarios, variables, datadir, cube_path=cube_path)
+            
+            names = chunk.NameMnemonic.to_numpy()
+            states = chunk.StateCode.to_numpy()
+            for group in groups:
+                years, starts = _year_offsets(group["dates"])
+                
+                # Calculating all the year-wise stats for all the sites in the group
+                stats = {reducer: ANNUAL_REDUCERS[reducer](group["block"], starts) for reducer in reducers}
 
-            # Converting data frame array to data frame
-            df_pr = pd.DataFrame(np.array(df_array).T)
-            df_pr.columns = ["maximum", "mean", "std"]
-            df_pr.index = range(1950,2100)
+                for i, row in enumerate(group["rows"]):
+                    name, state = names[row], states[row]
+                    df_pr = pd.DataFrame({reducer: stats[reducer][i] for reducer in reducers}, index=years)
 
-            # Write to CSV file
-            output_csv_path = os.path.join(output_dir, f"{name}_{state}_PMP.csv")
-            df_pr.to_csv(output_csv_path)
+                    if output_format == "csv":
+                        # Write to CSV file. The rename keeps the previous file intact until the new one is complete.
+                        output_csv_path = os.path.join(output_dir, f"{name}_{state}_PMP.csv")
+                        _atomic_to_csv(df_pr, output_csv_path)
+                    else:
+                        writer.write(df_pr.rename_axis("year").reset_index().assign(NameMnemonic=name, StateCode=state))
+            
+            if checkpoint_every is not None:
+                _append_checkpoint(checkpoint_path, chunk[["NameMnemonic", "StateCode"]], signature)
+    finally:
+        # Flushing the buffered rows also when a site fails
+        if output_format == "parquet":
+            writer.close()
+    
+    # All the sites are done
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    
+    # Only the sites recomputed by this run, the sites of the checkpoint were read by a previous run.
+    # The output is only as current as the ensemble output or the cube it was read from.
+    name_state_list = list(zip(todo.NameMnemonic, todo.StateCode))
+    catalog.clear_stale(datadir, output_dir, {(sce, var): name_state_list for sce in scenarios for var in variables}, 
+                        upstream=cube_path or os.path.join(datadir, catalog.ENSEMBLE_STAGE))
+    
+    print(f"STATUS UPDATE: The {output_format} output generated from get_per_year_stats() function is stored in the '{output_dir}' directory.")
     
-    print(f"STATUS UPDATE: The CSVs generated from get_per_year_stats() function are stored in the '{output_dir}' directory.")
+
+def _sub_period_colnames(
+    date_ranges: List[Tuple[str]], 
+    agg_name: str, 
+    comp_name: str, 
+    get_stats: bool, 
+    n_bootstrap: int,
+) -> List[str]:
+    """Columns of the get_sub_period_stats() output before the merge with the sites."""
     
+    colnames = ["OBJECTID", "ID", "NameMnemonic", "StateCode"]
+    for start_date, end_date in date_ranges:
+        start_yr = pd.to_datetime(start_date).year
+        end_yr = pd.to_datetime(end_date).year
+        stat_colnames = [f"{start_yr}_{end_yr}_{agg_name}"]
+        if get_stats:
+            stat_colnames += [f"{start_yr}_{end_yr}_count_{comp_name}_{agg_name}", f"{start_yr}_{end_yr}_amount_{comp_name}_{agg_name}"]
+        for colname in stat_colnames:
+            colnames.append(colname)
+            if n_bootstrap > 0:
+                colnames.extend(bootstrap.ci_colnames(colname))
+    return colnames
+
 
 def get_sub_period_stats(
     sites: pd.DataFrame, 
@@ -430,13 +1393,32 @@ def get_sub_period_stats(
     variables: List[str], 
     datadir: str, 
     date_ranges: List[Tuple[str]], 
-    comp_function: str="gt", 
+    comp_function: Union[str, Callable]="gt", 
     get_stats: bool=True, 
-    agg_function: Callable=None, 
+    agg_function: Union[str, Callable]=None, 
+    approx: bool=False,
+    cube_path: str=None,
+    n_bootstrap: int=0,
+    block_length: int=30,
+    confidence: float=0.95,
+    seed: int=0,
+    n_jobs: int=1,
+    checkpoint_every: int=None,
+    resume: bool=True,
     **kwargs: object
 ) -> None:
     """Calculates some stats within a specified date range.
     
+    Named aggregators from aggregators.AGGREGATORS operate on the whole 
+    site x day array of a date range at once. A callable agg_function is 
+    still supported but is called once per site per date range.
+    
+    With n_bootstrap > 0, block bootstrap confidence intervals of the 
+    aggregation, count and amount columns are added as '{column}_ci_low' and 
+    '{column}_ci_high' columns. The aggregation and the stats are evaluated 
+    for all the resamples x sites of a date range at once 
+    (refer to bootstrap.bootstrap_ci()).
+    
     Args:
         sites (pd.DataFrame): Data Frame containing all the site information. 
         scenarios (List[str]):  Scenarios of interest.
@@ -445,19 +1427,56 @@ def get_sub_period_stats(
             The generated output file is also stored here.
         date_ranges (List[Tuple[str]]): Each tuple contains a start date and 
             an end date as string in the format 'YYYY-MM' or 'YYYY-MM-DD'.
-        comp_function (str, optional): Comparision function between the 
-            aggregation function output and the date range values. 
+        comp_function (Union[str, Callable], optional): Comparision function 
+            between the aggregation function output and the date range values. 
             This is used to get stats. Defaults to 'gt' (greater).
             Options: 'eq' (equal) | 'gt' (greater) | 'lt' (lesser)
-            Can be a callable as well but that can be implemented if needed.
+            Can also be a callable that compares a site x day array with a 
+            site x 1 array and returns a boolean array, e.g. np.greater_equal.
         get_stats (bool, optional): Count and Amount values are calculated only 
             if this flag is set to True. Otherwise only the aggregation of 
             values between the dates is performed. 
             Defaults to True.
-        agg_function (Callable, optional): This is the function that is used to 
-            aggregate the data between the given time ranges. 
+        agg_function (Union[str, Callable], optional): This is the function 
+            that is used to aggregate the data between the given time ranges. 
             Defaults to None, in which case 99th percentile is calculated. 
+            Can be the name of a registered aggregator (fast path), i.e. 
+            'percentile' | 'mean' | 'max' | 'sum' | 'rolling_max' | 
+            'consecutive_dry_days' or any aggregator added using 
+            aggregators.register_aggregator().
+            Can also be a callable that takes the pd.Series of a single site 
+            (slow path).
             All argument other than an input array can be passed as kwargs.
+        approx (bool, optional): If True and agg_function is None, the 99th 
+            percentile is estimated with a streaming sketch (sketches.TDigest) 
+            instead of np.percentile(). The ensemble CSVs of every site are 
+            then read once chunk-by-chunk instead of loading the site x day 
+            arrays. The output columns have the same names as without approx. 
+            The 'compression' and 'chunksize' of the sketch can be passed as 
+            kwargs. Not supported with cube_path. Defaults to False.
+        cube_path (str, optional): Cube generated by cube.build_cube() that is 
+            read instead of the ensemble CSVs. Defaults to None.
+        n_bootstrap (int, optional): Number of bootstrap resamples. Only 
+            supported with named aggregators. Defaults to 0, i.e. no 
+            confidence intervals.
+        block_length (int, optional): Number of consecutive days per 
+            bootstrap block. Defaults to 30.
+        confidence (float, optional): Confidence level of the intervals. 
+            Defaults to 0.95.
+        seed (int, optional): Seed of the bootstrap resamples. Defaults to 0.
+        n_jobs (int, optional): Number of worker processes used to evaluate 
+            the resamples. Defaults to 1.
+        checkpoint_every (int, optional): Number of sites that are read and 
+            processed at a time. The rows of every completed chunk are 
+            appended to '{var}_sub_period_stats.csv.partial' and skipped when 
+            the function is run again after a failure. The checkpoint is 
+            deleted once the output is written. Callable arguments must be 
+            module-level functions or functools.partial objects of them, so 
+            that they can be identified in the next run. Defaults to None, 
+            i.e. all the sites at once without checkpoints.
+        resume (bool, optional): Skip the sites of an existing checkpoint. 
+            Otherwise the checkpoint is deleted and all the sites are 
+            recalculated. Defaults to True.
         kwargs (object, optional): All the parameters that are needed as input 
             for the agg_function can be passed in sequence at the end.
             Example: agg_function(data, **kwargs)
@@ -465,15 +1484,58 @@ def get_sub_period_stats(
     Raises:
         ValueError: Raises this exception if the value of comp_function() is 
             anything other than the specified options.
+        ValueError: Raises this exception if agg_function is not a registered 
+            aggregator name or a callable, or if n_bootstrap > 0 is combined 
+            with a callable agg_function.
         ValueError: Raises this exception if the input format or type of dates 
             in date_ranges is incorrect.
+        ValueError: Raises this exception if an existing checkpoint was 
+            generated with different arguments, or if checkpoint_every is 
+            combined with an anonymous callable, e.g. a lambda.
+        ValueError: Raises this exception if approx is combined with 
+            cube_path or with n_bootstrap > 0.
     """
     
     # If a default aggregation function is not provided, the 99th percentile is 
     # calculated for the data within the date range.
+    streaming = False
     if agg_function is None:
-        agg_function = np.percentile
+        if approx and cube_path is not None:
+            raise ValueError("approx=True reads the ensemble CSVs chunk-by-chunk and cannot be combined with cube_path.")
+        
+        agg_function = "percentile"
         kwargs["q"] = 99    # qth percentile for the percentile function
+        
+        # The sketches are updated while reading the CSVs chunk-by-chunk instead of loading the site x day arrays.
+        # The output columns are named after the percentile aggregator in both cases.
+        streaming = approx
+    
+    if isinstance(agg_function, str):
+        if agg_function not in aggregators.AGGREGATORS:
+            raise ValueError(f"Incorrect value passed for the 'agg_function'. Expecting a callable or one of these: {' | '.join(aggregators.AGGREGATORS)}.")
+        agg_name = agg_function
+    elif callable(agg_function):
+        # functools.partial objects are named after their function
+        agg_name = getattr(agg_function, "func", agg_function).__name__
+    else:
+        raise ValueError("Incorrect value passed for the 'agg_function'. Expecting a callable or a registered aggregator name.")
+    
+    if n_bootstrap > 0 and not isinstance(agg_function, str):
+        raise ValueError("Bootstrap confidence intervals are only supported with a registered aggregator name as 'agg_function'.")
+    
+    if n_bootstrap > 0 and streaming:
+        raise ValueError("Bootstrap confidence intervals are not supported with approx=True.")
+    
+    # Verify the comparison function before reading any data
+    if isinstance(comp_function, str):
+        if comp_function not in aggregators.COMPARISON_FUNCTIONS:
+            raise ValueError("Incorrect value passed for the 'comp_function'. Expecting one of these three: 'eq' | 'gt' | 'lt'.")
+        comp_name = comp_function
+        comp_function = aggregators.COMPARISON_FUNCTIONS[comp_function]
+    elif callable(comp_function):
+        comp_name = getattr(comp_function, "func", comp_function).__name__
+    else:
+        raise ValueError("Incorrect value passed for the 'comp_function'. Expecting one of these three: 'eq' | 'gt' | 'lt'.")
     
     # Checking the type and format of input date_ranges
     try:
@@ -487,91 +1549,132 @@ def get_sub_period_stats(
             OR\
             [('YYYY-MM', 'YYYY-MM'), ('YYYY-MM', 'YYYY-MM'), ...]")
     
-    # Declare variables that will be used to convert the processed data to a DataFrame
-    df_array = []
-    df_colnames = []
-    
     # Generates a different CSV for each variables
     for var in variables:
-        oid_id_name_state_list = list(zip(sites.OBJECTID, sites.ID, sites.NameMnemonic, sites.StateCode))
-        with tqdm(oid_id_name_state_list) as tqdm_oid_id_name_state_list:
-            tqdm_oid_id_name_state_list.set_description(f"Iterating LM Sites for '{var}' variable.")
-
-            for _oid, _id, name, state in tqdm_oid_id_name_state_list:
-                array_ind = [_oid, _id, name, state]
-                df_colnames = ["OBJECTID", "ID", "NameMnemonic", "StateCode"]
-
-                # Iterating over all combinations of scenarios and variables and 
-                # concating data for all combinations in a single data frame
-                df = pd.DataFrame()
-                for sce in scenarios:
-                    csv_path = os.path.join(datadir, f"{sce}_{var}_ensemble", f"{name}_{state}_{sce}_{var}.csv")
-                    df_i = pd.read_csv(csv_path)
-                    df_i = df_i.set_index("date")
-
-                    if df.empty:
-                        df = df_i
-                    else:
-                        df = pd.concat([df, df_i])
-
-                    df.index = pd.to_datetime(df.index)
-
-                # Extracting data for each date range
-                for start_date, end_date in date_ranges:
-                    date_range_idxs = df.index.to_series().between(start_date, end_date)
-                    df_date_range = df[date_range_idxs]
-
-                    # Aggregating the values for the date range and storing as a row in formation
-                    agg_val = agg_function(df_date_range['mean'], **kwargs)
-                    array_ind.append(agg_val)
+        output_csv_path = os.path.join(datadir, f"{var}_sub_period_stats.csv")
+        checkpoint_path = f"{output_csv_path}{CHECKPOINT_SUFFIX}"
+        
+        # Skipping the sites that were completed by a previous run
+        df_chunks = []
+        todo = sites
+        if checkpoint_every is not None:
+            signature = _checkpoint_signature(
+                scenarios=scenarios, variable=var, date_ranges=date_ranges, comp_function=comp_function, get_stats=get_stats, 
+                agg_function=agg_function, approx=streaming, cube_path=cube_path, n_bootstrap=n_bootstrap, block_length=block_length, 
+                confidence=confidence, seed=seed, kwargs=sorted(kwargs.items()),
+            )
+            done = _read_checkpoint(checkpoint_path, _sub_period_colnames(date_ranges, agg_name, comp_name, get_stats, n_bootstrap), signature, resume)
+            if done is not None:
+                df_chunks.append(done)
+                done_keys = set(zip(done.OBJECTID, done.ID))
+                todo = sites[[key not in done_keys for key in zip(sites.OBJECTID, sites.ID)]]
+        
+        for chunk in _site_chunks(todo, checkpoint_every):
+            if streaming:
+                groups = []
+                with tqdm(list(zip(chunk.NameMnemonic, chunk.StateCode))) as tqdm_name_state_list:
+                    tqdm_name_state_list.set_description(f"Iterating LM Sites for '{var}' variable.")
+                    site_stats = [
+                        _approx_sub_period_stats(datadir, name, state, scenarios, var, date_ranges, comp_function, get_stats, **kwargs) 
+                        for name, state in tqdm_name_state_list
+                    ]
+            else:
+                # Reading the data of the sites as site x day arrays
+                groups = _load_calendar_groups(chunk, scenarios, [var], datadir, description=f"Iterating LM Sites for '{var}' variable.", cube_path=cube_path)
+            
+            # Declare variables that will be used to convert the processed data to a DataFrame
+            df_columns = {
+                "OBJECTID": chunk.OBJECTID.to_numpy(), 
+                "ID": chunk.ID.to_numpy(), 
+                "NameMnemonic": chunk.NameMnemonic.to_numpy(), 
+                "StateCode": chunk.StateCode.to_numpy(),
+            }
+            
+            # Extracting data for each date range
+            for i, (start_date, end_date) in enumerate(date_ranges):
+                start_yr = pd.to_datetime(start_date).year
+                end_yr = pd.to_datetime(end_date).year
+                delta_yrs = (end_yr - start_yr + 1)
+                
+                agg_colname = f"{start_yr}_{end_yr}_{agg_name}"
+                count_colname = f"{start_yr}_{end_yr}_count_{comp_name}_{agg_name}"
+                amount_colname = f"{start_yr}_{end_yr}_amount_{comp_name}_{agg_name}"
+                stat_colnames = [agg_colname, count_colname, amount_colname] if get_stats else [agg_colname]
+                for colname in stat_colnames:
+                    df_columns[colname] = np.full(len(chunk), np.nan)
+                    if n_bootstrap > 0:
+                        for ci_colname in bootstrap.ci_colnames(colname):
+                            df_columns[ci_colname] = np.full(len(chunk), np.nan)
+                
+                if streaming:
+                    for row, stats in enumerate(site_stats):
+                        agg_val, count, amount = stats[i]
+                        df_columns[agg_colname][row] = agg_val
+                        if get_stats:
+                            df_columns[count_colname][row] = count / delta_yrs
+                            df_columns[amount_colname][row] = amount / delta_yrs
+                
+                for group in groups:
+                    dates = group["dates"]
+                    date_range_idxs = (dates >= np.datetime64(pd.to_datetime(start_date), "D")) & \
+                                      (dates <= np.datetime64(pd.to_datetime(end_date), "D"))
+                    block = group["block"][:, date_range_idxs]
 
-                    # Update the column names
-                    start_yr = pd.to_datetime(start_date).year
-                    end_yr = pd.to_datetime(end_date).year
-                    colname = f"{start_yr}_{end_yr}_{agg_function.__name__}"
-                    if colname not in df_colnames:
-                        df_colnames.append(colname)
+                    # Aggregating the values for the date range of all the sites
+                    if isinstance(agg_function, str):
+                        agg_vals = aggregators.AGGREGATORS[agg_function](block, **kwargs)
+                    else:
+                        # Slow fallback: the callable is invoked for every site
+                        agg_vals = np.array([
+                            agg_function(pd.Series(values, index=dates[date_range_idxs]), **kwargs) for values in block
+                        ])
+                    df_columns[agg_colname][group["rows"]] = agg_vals
 
                     # Calculate stats only if flagged
                     if get_stats:
-                        # Define the query based on the comparison function 
-                        if comp_function == "gt":
-                            query = df_date_range['mean'] > agg_val
-                        elif comp_function == "lt":
-                            query = df_date_range['mean'] < agg_val
-                        elif comp_function == "eq":
-                            query = df_date_range['mean'] == agg_val
-                        else:
-                            raise ValueError("Incorrect value passed for the 'comp_function'. Expecting one of these three: 'eq' | 'gt' | 'lt'.")
-
-                        delta_yrs = (end_yr - start_yr + 1)
+                        query = comp_function(block, np.asarray(agg_vals, dtype=np.float64)[:, None])
 
                         # -----
                         # Count the number of values in comparison with the aggregated value
-                        count = np.count_nonzero(query) / delta_yrs    # count per year - TODO: Ensure that this is fine because it generates the same counts for all the sites.
-                        array_ind.append(count)
-
-                        # Update the column names
-                        colname = f"{start_yr}_{end_yr}_count_{comp_function}_{agg_function.__name__}"
-                        if colname not in df_colnames:
-                            df_colnames.append(colname)
+                        count = np.count_nonzero(query, axis=1) / delta_yrs    # count per year - TODO: Ensure that this is fine because it generates the same counts for all the sites.
+                        df_columns[count_colname][group["rows"]] = count
 
                         # -----
                         # Get the mean of the values in comparison with the aggregated value
-                        amount = np.sum(df_date_range["mean"][query]) / delta_yrs     # mean amount per year
-                        array_ind.append(amount)
-
-                        # Update the column names
-                        colname = f"{start_yr}_{end_yr}_amount_{comp_function}_{agg_function.__name__}"
-                        if colname not in df_colnames:
-                            df_colnames.append(colname)
-
-                # Store the row for conversion to DataFrame
-                df_array.append(array_ind)
+                        amount = np.nansum(np.where(query, block, 0.0), axis=1) / delta_yrs     # mean amount per year
+                        df_columns[amount_colname][group["rows"]] = amount
+                    
+                    if n_bootstrap > 0 and block.shape[1] > 0:
+                        def resampled_stats(resampled: np.ndarray) -> dict:
+                            """Aggregation and stats of site x resample x day arrays."""
+                            
+                            stats = {agg_colname: aggregators.AGGREGATORS[agg_function](resampled, **kwargs)}
+                            if get_stats:
+                                query = comp_function(resampled, np.asarray(stats[agg_colname], dtype=np.float64)[..., None])
+                                stats[count_colname] = np.count_nonzero(query, axis=-1) / delta_yrs
+                                stats[amount_colname] = np.nansum(np.where(query, resampled, 0.0), axis=-1) / delta_yrs
+                            return stats
+                        
+                        intervals = bootstrap.bootstrap_ci(
+                            block, 
+                            resampled_stats, 
+                            n_resamples=n_bootstrap, 
+                            block_length=block_length, 
+                            confidence=confidence, 
+                            seed=seed, 
+                            n_jobs=n_jobs,
+                        )
+                        for colname, bounds in intervals.items():
+                            for ci_colname, bound in zip(bootstrap.ci_colnames(colname), bounds):
+                                df_columns[ci_colname][group["rows"]] = bound
 
-        # Converting data frame array to data frame
-        df_sub_periods = pd.DataFrame(df_array)
-        df_sub_periods.columns = df_colnames
+            # Converting the generated columns to data frame
+            df_sub_periods = pd.DataFrame(df_columns)
+            if checkpoint_every is not None:
+                _append_checkpoint(checkpoint_path, df_sub_periods, signature)
+            df_chunks.append(df_sub_periods)
+            
+        df_sub_periods = pd.concat(df_chunks, ignore_index=True) if df_chunks else pd.DataFrame(columns=_sub_period_colnames(date_ranges, agg_name, comp_name, get_stats, n_bootstrap))
 
         # Merge the generated data with the original Data Frame
         # if any duplicate column names are found, the first one will be left 
@@ -583,7 +1686,163 @@ def get_sub_period_stats(
                             suffixes=(None, "_copy"),
                            )
 
-        # Write to CSV
-        output_csv_path = os.path.join(datadir, f"{var}_sub_period_stats.csv")
-        df_final.to_csv(output_csv_path)
+        # Write to CSV. The rename keeps the previous output intact until the new one is complete.
+        _atomic_to_csv(df_final, output_csv_path)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        
+        # Only the sites recomputed by this run. The output is only as current as 
+        # the ensemble output or the cube it was read from.
+        name_state_list = list(zip(todo.NameMnemonic, todo.StateCode))
+        catalog.clear_stale(datadir, output_csv_path, {(sce, var): name_state_list for sce in scenarios}, 
+                            upstream=cube_path or os.path.join(datadir, catalog.ENSEMBLE_STAGE))
         print(f"STATUS UPDATE: The output file generated from get_sub_period_stats() function is stored as {output_csv_path}.")
+
+
+
+# Identifier columns of the long region tables
+REGION_TABLE_COLUMNS = ["OBJECTID", "ID", "NameMnemonic", "StateCode", "Region", "RegionCode", "Scenario", "Variable", "Period", "Value"]
+
+
+def get_region_period_table(
+    sites: pd.DataFrame, 
+    scenarios: List[str], 
+    variables: List[str], 
+    datadir: str, 
+    date_ranges: List[Tuple[str]], 
+    agg_function: str="mean", 
+    cube_path: str=None,
+    **kwargs: object
+) -> pd.DataFrame:
+    """Generates a boxplot-ready long table with one row per 
+    site x scenario x variable x period.
+    
+    The value of every site and period is aggregated on the site x day array 
+    of all the sites at once. The sites are annotated with their geographical 
+    region using the constants lookup tables, so the output can be passed to 
+    visualize.plot_boxplot() directly, e.g.
+        table = get_region_period_table(sites, ["historical", "rcp85"], ["pr"], datadir, date_ranges)
+        plot_boxplot(data=table[table.Scenario == "rcp85"], x_feature="Period", 
+                     y_feature="Value", hue_feature="Region")
+    
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information. 
+        scenarios (List[str]):  Scenarios of interest.
+        variables (List[str]):  Variables of interest.
+        datadir (str): Parent directory containing all the data files.
+            The generated output file is also stored here.
+        date_ranges (List[Tuple[str]]): Each tuple contains a start date and 
+            an end date as string in the format 'YYYY-MM' or 'YYYY-MM-DD'.
+            The period is labeled '{start_year}_{end_year}'.
+        agg_function (str, optional): Name of a registered aggregator in 
+            aggregators.AGGREGATORS that aggregates the values of a period. 
+            Defaults to 'mean'.
+        cube_path (str, optional): Cube generated by cube.build_cube() that is 
+            read instead of the ensemble CSVs. Defaults to None.
+        kwargs (object, optional): Parameters of the aggregator, 
+            e.g. q=99 for 'percentile'.
+    
+    Returns:
+        pd.DataFrame: The long table with the REGION_TABLE_COLUMNS columns that 
+            is also written to 'region_period_table.csv'. Region and Period are 
+            ordered categoricals. Periods without data for a scenario 
+            are dropped.
+    
+    Raises:
+        ValueError: If agg_function is not a registered aggregator.
+        ValueError: If the input format or type of dates in date_ranges is incorrect.
+    """
+    
+    if agg_function not in aggregators.AGGREGATORS:
+        raise ValueError(f"Incorrect value passed for the 'agg_function'. Expecting one of these: {' | '.join(aggregators.AGGREGATORS)}.")
+    
+    # Checking the type and format of input date_ranges
+    try:
+        bounds = [(np.datetime64(pd.to_datetime(start_date), "D"), np.datetime64(pd.to_datetime(end_date), "D")) 
+                  for start_date, end_date in date_ranges]
+    except Exception as e:
+        raise ValueError("The input format or type of the dates is incorrect. \
+            Input is expected to be in the following format: \
+            [('YYYY-MM-DD', 'YYYY-MM-DD'), ('YYYY-MM-DD', 'YYYY-MM-DD'), ...]\
+            OR\
+            [('YYYY-MM', 'YYYY-MM'), ('YYYY-MM', 'YYYY-MM'), ...]")
+    periods = [f"{start.astype(object).year}_{end.astype(object).year}" for start, end in bounds]
+    
+    # Sites outside of the known states can not be assigned to a region
+    valid = sites.StateCode.isin(list(constants.STATE_REGIONS)).to_numpy()
+    if not valid.all():
+        warnings.warn(f"Ignoring {np.count_nonzero(~valid)} sites with unknown state codes: {sorted(set(sites.StateCode[~valid]))}.")
+        sites = sites[valid]
+    
+    site_columns = pd.DataFrame({
+        "OBJECTID": sites.OBJECTID.to_numpy(), 
+        "ID": sites.ID.to_numpy(), 
+        "NameMnemonic": sites.NameMnemonic.to_numpy(), 
+        "StateCode": sites.StateCode.to_numpy(),
+        "Region": constants.geog_by_states_column(sites.StateCode).to_numpy(),
+        "RegionCode": constants.geog_by_states_code_column(sites.StateCode).to_numpy(),
+    })
+    
+    tables = []
+    for var in variables:
+        for sce in scenarios:
+            groups = _load_calendar_groups(sites, [sce], [var], datadir, description=f"Reading '{sce}_{var}'", cube_path=cube_path)
+            
+            # Site x period values of all the sites
+            values = np.full((len(sites), len(periods)), np.nan)
+            for group in groups:
+                dates = group["dates"]
+                for j, (start, end) in enumerate(bounds):
+                    date_range_idxs = (dates >= start) & (dates <= end)
+                    if date_range_idxs.any():
+                        values[group["rows"], j] = aggregators.AGGREGATORS[agg_function](group["block"][:, date_range_idxs], **kwargs)
+            
+            # Reshaping to long format in a single melt
+            df_wide = pd.concat([site_columns, pd.DataFrame(values, columns=periods)], axis=1)
+            df_long = df_wide.melt(id_vars=list(site_columns.columns), value_vars=periods, var_name="Period", value_name="Value")
+            tables.append(df_long.assign(Scenario=sce, Variable=var))
+    
+    table = pd.concat(tables, ignore_index=True)
+    table = table[table["Value"].notna()].reset_index(drop=True)[REGION_TABLE_COLUMNS]
+    table["Period"] = pd.Categorical(table["Period"], categories=list(dict.fromkeys(periods)), ordered=True)
+    table["Region"] = pd.Categorical(table["Region"], categories=sorted(constants.REGION_CODES, key=constants.REGION_CODES.get), ordered=True)
+    
+    # Write to CSV
+    output_csv_path = os.path.join(datadir, "region_period_table.csv")
+    table.to_csv(output_csv_path, index=False)
+    print(f"STATUS UPDATE: The output file generated from get_region_period_table() function is stored as {output_csv_path}.")
+    
+    return table
+
+
+def summarize_region_periods(
+    table: pd.DataFrame, 
+    quantiles: List[float]=None,
+) -> pd.DataFrame:
+    """Summarizes the long table of get_region_period_table() per 
+    variable x scenario x period x region with a single groupby.
+    
+    Args:
+        table (pd.DataFrame): Output of get_region_period_table().
+        quantiles (List[float], optional): Quantiles in the range [0, 1] that 
+            are added as 'q{100 x quantile}' columns. 
+            Defaults to None, i.e. [0.05, 0.25, 0.5, 0.75, 0.95]. An empty 
+            list adds no quantile columns.
+    
+    Returns:
+        pd.DataFrame: One row per variable, scenario, period and region with 
+            the count, mean, std, min, max and quantile columns.
+    """
+    
+    if quantiles is None:
+        quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+    
+    grouped = table.groupby(["Variable", "Scenario", "Period", "Region"], observed=True, sort=True)["Value"]
+    summary = grouped.agg(["count", "mean", "std", "min", "max"])
+    
+    if quantiles:
+        df_quantiles = grouped.quantile(quantiles).unstack()
+        df_quantiles.columns = [f"q{q * 100:g}" for q in df_quantiles.columns]
+        summary = summary.join(df_quantiles)
+    
+    return summary.reset_index()
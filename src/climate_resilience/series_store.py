@@ -0,0 +1,305 @@
+import os
+import json
+import functools
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from typing import List, Tuple, Union
+
+from climate_resilience import catalog
+from climate_resilience import preprocess
+
+
+INDEX_FILENAME = "index.json"
+
+
+def build_series_store(
+    sites: pd.DataFrame,
+    scenarios: List[str],
+    variables: List[str],
+    datadir: str,
+    store_dir: str,
+) -> str:
+    """Converts the ensemble CSVs into a memory-mappable binary series store.
+
+    Every scenario and variable combination is stored as a single
+    site x day float64 .npy array on a contiguous daily calendar, so the
+    offset of a date is simply the number of days since the first date.
+    The rows are site-major, i.e. the series of a site is contiguous on disk.
+    Missing files and missing days are stored as nan.
+    Every file is read once. The series of the sites are appended one at a
+    time to a temporary binary file, then copied to the memory-mapped array
+    once the shared calendar is known, so only a single site series is held
+    in memory.
+
+    Expected input file and directory structure is the same as for
+    calculate_Nth_percentile(): datadir/{scenario}_{variable}_ensemble/{name}_{state}_{scenario}_{variable}.csv
+
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information.
+        scenarios (List[str]):  Scenarios of interest.
+        variables (List[str]):  Variables of interest.
+        datadir (str): Parent directory containing all the data files.
+        store_dir (str): Output directory of the series store.
+
+    Returns:
+        str: Path of the generated store directory.
+    """
+
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    file_catalog = catalog.get_catalog(datadir)
+    name_state_list = list(zip(sites.NameMnemonic, sites.StateCode))
+    index = {
+        "sites": [[name, state] for name, state in name_state_list],
+        "series": {},
+    }
+
+    # Sites of every scenario and variable that are read from their current series
+    regenerated = {}
+
+    for sce in scenarios:
+        for var in variables:
+            # Reading every site once and appending its series from its first to its last date to a temporary file
+            rows = {}
+            start, end = None, None
+            tmp_path = os.path.join(store_dir, f"{sce}_{var}.npy.tmp")
+            with open(tmp_path, "wb") as tmp_file, tqdm(name_state_list) as tqdm_name_state_list:
+                tqdm_name_state_list.set_description(f"Reading '{sce}_{var}'")
+
+                offset = 0
+                for i, (name, state) in enumerate(tqdm_name_state_list):
+                    csv_path = os.path.join(datadir, f"{sce}_{var}_ensemble", f"{name}_{state}_{sce}_{var}.csv")
+                    if not file_catalog.exists(csv_path):
+                        print(f"WARNING: {csv_path} does not exist. Storing nan values for this site.")
+                        continue
+
+                    dates, values = preprocess._read_ensemble_series(datadir, name, state, [sce], [var])
+                    if not len(dates):
+                        continue
+
+                    row = np.full(int((dates[-1] - dates[0]).astype(np.int64)) + 1, np.nan)
+                    row[(dates - dates[0]).astype(np.int64)] = values
+                    tmp_file.write(row.tobytes())
+
+                    rows[i] = (dates[0], offset, len(row))
+                    offset += len(row)
+                    start = dates[0] if start is None else min(start, dates[0])
+                    end = dates[-1] if end is None else max(end, dates[-1])
+                    regenerated.setdefault((sce, var), []).append((name, state))
+
+            if not rows:
+                os.remove(tmp_path)
+                continue
+
+            n_days = int((end - start).astype(np.int64)) + 1
+
+            # Copying the series to their offsets on the shared calendar one site at a time
+            filename = f"{sce}_{var}.npy"
+            arr = np.lib.format.open_memmap(
+                os.path.join(store_dir, filename), mode="w+", dtype=np.float64, shape=(len(name_state_list), n_days)
+            )
+            tmp = np.memmap(tmp_path, dtype=np.float64, mode="r")
+            for i in range(len(name_state_list)):
+                if i not in rows:
+                    arr[i] = np.nan
+                    continue
+
+                first, offset, length = rows[i]
+                i0 = int((first - start).astype(np.int64))
+                arr[i, :i0] = np.nan
+                arr[i, i0:i0+length] = tmp[offset:offset+length]
+                arr[i, i0+length:] = np.nan
+            arr.flush()
+            del arr, tmp
+            os.remove(tmp_path)
+
+            index["series"][f"{sce}_{var}"] = {
+                "file": filename,
+                "start": str(start),
+                "n_days": n_days,
+            }
+
+    with open(os.path.join(store_dir, INDEX_FILENAME), "w") as f:
+        json.dump(index, f, indent=2)
+
+    # The stores opened before the rebuild have the previous index and array shapes
+    _open_store.cache_clear()
+    catalog.clear_stale(datadir, store_dir, regenerated, upstream=os.path.join(datadir, catalog.ENSEMBLE_STAGE))
+
+    print(f"STATUS UPDATE: The series store generated from build_series_store() function is stored in the '{store_dir}' directory.")
+    return store_dir
+
+
+class SeriesStore:
+    """Random access to the per-site series of a store generated by
+    build_series_store().
+
+    The arrays are opened as read-only memory maps, so slicing a date range of
+    a single site only reads the corresponding pages from disk and returns a
+    view without copying any data.
+
+    Example Usage:
+        store = SeriesStore(store_dir)
+        values = store.load_series("AMB", "rcp45", "pr", "2020-01-01", "2029-12-31")
+        dates = store.dates("rcp45", "pr", "2020-01-01", "2029-12-31")
+    """
+
+    def __init__(self, store_dir: str) -> None:
+        """Initializes the SeriesStore object.
+
+        Args:
+            store_dir (str): Directory of the series store.
+        """
+
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_FILENAME), "r") as f:
+            index = json.load(f)
+
+        self.sites = [tuple(site) for site in index["sites"]]
+        self.series = index["series"]
+
+        # Sites can be referred by either 'name' or 'name_state'
+        self._site_rows = {}
+        for i, (name, state) in enumerate(self.sites):
+            self._site_rows[f"{name}_{state}"] = i
+            self._site_rows.setdefault(name, i)
+
+        self._arrays = {}
+
+    def _array(self, scenario: str, variable: str) -> np.ndarray:
+        """Returns the (cached) memory map of a scenario and variable."""
+
+        key = f"{scenario}_{variable}"
+        if key not in self.series:
+            raise KeyError(f"'{key}' series does not exist in the store '{self.store_dir}'.")
+
+        if key not in self._arrays:
+            self._arrays[key] = np.load(os.path.join(self.store_dir, self.series[key]["file"]), mmap_mode="r")
+        return self._arrays[key]
+
+    def _offsets(self, scenario: str, variable: str, start: str, end: str) -> Tuple[int, int]:
+        """Converts the start and end dates to array offsets (end exclusive)."""
+
+        meta = self.series[f"{scenario}_{variable}"]
+        first = np.datetime64(meta["start"], "D")
+
+        i0 = 0 if start is None else int((np.datetime64(pd.Timestamp(start), "D") - first).astype(np.int64))
+        i1 = meta["n_days"] if end is None else int((np.datetime64(pd.Timestamp(end), "D") - first).astype(np.int64)) + 1
+        return min(max(i0, 0), meta["n_days"]), min(max(i1, 0), meta["n_days"])
+
+    def load_series(
+        self,
+        site: Union[str, Tuple[str, str]],
+        scenario: str,
+        variable: str,
+        start: str=None,
+        end: str=None,
+    ) -> np.ndarray:
+        """Returns the daily values of a site between the start and end dates.
+
+        Args:
+            site (Union[str, Tuple[str, str]]): Name Mnemonic of the site,
+                'name_state', or a (name, state) tuple.
+            scenario (str): Scenario of interest.
+            variable (str): Variable of interest.
+            start (str, optional): First date (inclusive) in the format
+                'YYYY-MM' or 'YYYY-MM-DD'. Defaults to None, i.e. first date
+                in the store.
+            end (str, optional): Last date (inclusive) in the format
+                'YYYY-MM' or 'YYYY-MM-DD'. Defaults to None, i.e. last date
+                in the store.
+
+        Returns:
+            np.ndarray: Read-only view of the memory mapped values.
+
+        Raises:
+            KeyError: If the site or the scenario and variable combination
+                does not exist in the store.
+        """
+
+        if isinstance(site, (tuple, list)):
+            site = f"{site[0]}_{site[1]}"
+        if site not in self._site_rows:
+            raise KeyError(f"Site '{site}' does not exist in the store '{self.store_dir}'.")
+
+        arr = self._array(scenario, variable)
+        i0, i1 = self._offsets(scenario, variable, start, end)
+        return arr[self._site_rows[site], i0:i1]
+
+    def load_block(
+        self,
+        scenario: str,
+        variable: str,
+        sites: pd.DataFrame=None,
+        start: str=None,
+        end: str=None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the site x day array of a scenario and variable.
+
+        Args:
+            scenario (str): Scenario of interest.
+            variable (str): Variable of interest.
+            sites (pd.DataFrame, optional): Sites to return, in this order.
+                Sites missing in the store are returned as nan rows.
+                Defaults to None, i.e. all the sites in the store order.
+            start (str, optional): First date (inclusive). Defaults to None.
+            end (str, optional): Last date (inclusive). Defaults to None.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Dates and the site x day array.
+                The array is a memory mapped view if sites is None.
+        """
+
+        arr = self._array(scenario, variable)
+        i0, i1 = self._offsets(scenario, variable, start, end)
+        dates = self.dates(scenario, variable, start, end)
+
+        if sites is None:
+            return dates, arr[:, i0:i1]
+
+        block = np.full((len(sites), i1 - i0), np.nan)
+        for i, (name, state) in enumerate(zip(sites.NameMnemonic, sites.StateCode)):
+            row = self._site_rows.get(f"{name}_{state}")
+            if row is not None:
+                block[i] = arr[row, i0:i1]
+        return dates, block
+
+    def dates(self, scenario: str, variable: str, start: str=None, end: str=None) -> np.ndarray:
+        """Returns the datetime64[D] dates corresponding to load_series()
+        called with the same arguments."""
+
+        i0, i1 = self._offsets(scenario, variable, start, end)
+        return np.datetime64(self.series[f"{scenario}_{variable}"]["start"], "D") + np.arange(i0, i1)
+
+
+@functools.lru_cache(maxsize=8)
+def _open_store(store_dir: str, index_mtime: int) -> SeriesStore:
+    """Cached SeriesStore objects, keyed by the modification time of the index."""
+
+    return SeriesStore(store_dir)
+
+
+def open_store(store_dir: str) -> SeriesStore:
+    """Returns a cached SeriesStore object for the store directory. The store
+    is opened again if its index was rewritten, e.g. by build_series_store()
+    in another process."""
+
+    store_dir = os.path.abspath(store_dir)
+    return _open_store(store_dir, os.stat(os.path.join(store_dir, INDEX_FILENAME)).st_mtime_ns)
+
+
+def load_series(
+    store_dir: str,
+    site: Union[str, Tuple[str, str]],
+    scenario: str,
+    variable: str,
+    start: str=None,
+    end: str=None,
+) -> np.ndarray:
+    """Shortcut for SeriesStore.load_series() that keeps the opened stores
+    cached between calls. Refer to SeriesStore.load_series() for the arguments.
+    """
+
+    return open_store(store_dir).load_series(site, scenario, variable, start, end)
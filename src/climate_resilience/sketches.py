@@ -0,0 +1,312 @@
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Union, Iterable
+
+
+class TDigest:
+    """Mergeable streaming quantile sketch (t-digest).
+
+    The data is summarized as a sorted set of weighted centroids. Centroids
+    near the tails are kept small, so extreme percentiles such as the 99th
+    are estimated much more accurately than the median. The size of the
+    sketch is bounded by the compression parameter and does not grow with the
+    number of values added.
+
+    Sketches built on different chunks, models or worker processes can be
+    combined with merge() and give the same estimate as a single sketch built
+    on all the data (within the error bound).
+
+    Example Usage:
+        digest = TDigest(compression=200)
+        for chunk in pd.read_csv(csv_path, usecols=["mean"], chunksize=100000):
+            digest.update(chunk["mean"])
+        p99 = digest.percentile(99)
+    """
+
+    def __init__(self, compression: float=200, buffer_size: int=None) -> None:
+        """Initializes the TDigest object.
+
+        Args:
+            compression (float, optional): Compression parameter (delta).
+                The sketch keeps at most ~compression/2 centroids. The rank
+                error at quantile q is roughly proportional to
+                sqrt(q * (1 - q)) / compression, i.e. larger values are more
+                accurate and use more memory. Defaults to 200.
+            buffer_size (int, optional): Number of values buffered before the
+                centroids are recompressed. Defaults to None, in which case
+                10 x compression is used.
+
+        Raises:
+            ValueError: If compression is not a positive value.
+        """
+
+        if compression <= 0:
+            raise ValueError("Incorrect value for compression. compression must be positive.")
+
+        self.compression = compression
+        self.buffer_size = int(10 * compression) if buffer_size is None else buffer_size
+
+        self._means = np.empty(0)
+        self._weights = np.empty(0)
+        self._buffer = []            # Means of the buffered values and merged centroids
+        self._buffer_weights = []    # Weights of the buffered means
+        self._buffered = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self) -> float:
+        """Total weight (number of values) summarized by the sketch."""
+
+        return self._weights.sum() + sum(weights.sum() for weights in self._buffer_weights)
+
+    def update(self, values: Union[np.ndarray, pd.Series, Iterable[float]]) -> "TDigest":
+        """Adds values to the sketch. Nan values are ignored.
+
+        Args:
+            values (Union[np.ndarray, pd.Series, Iterable[float]]): Values to add.
+
+        Returns:
+            TDigest: The updated sketch itself.
+        """
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        self._buffer.append(values)
+        self._buffer_weights.append(np.ones(values.size))
+        self._buffered += values.size
+        if self._buffered >= self.buffer_size:
+            self._compress()
+
+        return self
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        """Merges another sketch into this sketch.
+
+        The centroids (and buffered values) of the other sketch are added to
+        the buffer like new values, so the centroids of many merged sketches
+        are recompressed together instead of once per merge.
+
+        Args:
+            other (TDigest): Sketch to be merged. It is not modified.
+
+        Returns:
+            TDigest: The updated sketch itself.
+        """
+
+        self._buffer.extend([other._means] + other._buffer)
+        self._buffer_weights.extend([other._weights] + other._buffer_weights)
+        self._buffered += other._means.size + other._buffered
+
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self._buffered >= self.buffer_size:
+            self._compress()
+        return self
+
+    @classmethod
+    def merge_all(cls, digests: List["TDigest"], compression: float=None) -> "TDigest":
+        """Returns a new sketch that combines all the input sketches.
+
+        Args:
+            digests (List[TDigest]): Sketches to be combined.
+            compression (float, optional): Compression of the combined sketch.
+                Defaults to None, in which case the compression of the first
+                sketch is used.
+        """
+
+        digests = list(digests)
+        if compression is None:
+            compression = digests[0].compression if digests else 200
+
+        merged = cls(compression=compression)
+        for digest in digests:
+            merged.merge(digest)
+        return merged
+
+    def _compress(self) -> None:
+        """Merges the buffered values and centroids into the centroids.
+
+        If the existing centroids or the buffer hold weighted centroids, i.e.
+        after the first compression or a merge, the clusters are rebuilt with
+        _merge_centroids(), which keeps every cluster within the size limit
+        of the scale function. Otherwise the clusters are assigned in one
+        vectorized pass: every value goes to the unit interval of the arcsine
+        scale function that contains the center of its cumulative weight.
+        """
+
+        merged = np.any(self._weights != 1) or any(np.any(weights != 1) for weights in self._buffer_weights)
+        means = np.concatenate([self._means] + self._buffer)
+        weights = np.concatenate([self._weights] + self._buffer_weights)
+
+        self._buffer = []
+        self._buffer_weights = []
+        self._buffered = 0
+        if means.size == 0:
+            return
+
+        if merged:
+            self._means, self._weights = self._merge_centroids(means, weights)
+            return
+
+        order = np.argsort(means, kind="stable")
+        means = means[order]
+        weights = weights[order]
+
+        total = weights.sum()
+        q_mid = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q_mid - 1)
+        cluster = np.floor(k - k[0]).astype(np.int64)
+
+        new_weights = np.bincount(cluster, weights=weights)
+        new_means = np.bincount(cluster, weights=weights * means)
+        nonempty = new_weights > 0
+
+        self._weights = new_weights[nonempty]
+        self._means = new_means[nonempty] / self._weights
+
+    def _merge_centroids(self, means: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Merges weighted centroids in a single pass over their sorted means.
+
+        A centroid is added to the current cluster as long as the cumulative
+        weight of the cluster stays within one unit of the arcsine scale
+        function from the start of the cluster, i.e. the size limit of the
+        t-digest. Unlike the binning of _compress(), a heavy centroid never
+        makes a cluster exceed its limit.
+        """
+
+        order = np.argsort(means, kind="stable")
+        means = means[order]
+        weights = weights[order]
+
+        total = weights.sum()
+        scale = self.compression / (2 * np.pi)
+
+        def weight_limit(start: float) -> float:
+            """Cumulative weight at one unit of the scale function after start."""
+
+            k = scale * np.arcsin(2 * start / total - 1) + 1
+            return total * (np.sin(min(k / scale, np.pi / 2)) + 1) / 2
+
+        new_means, new_weights = [], []
+        cluster_weight, cluster_sum, limit, cum = 0.0, 0.0, weight_limit(0.0), 0.0
+        for mean, weight in zip(means.tolist(), weights.tolist()):
+            if cluster_weight > 0 and cum + weight > limit:
+                new_means.append(cluster_sum / cluster_weight)
+                new_weights.append(cluster_weight)
+                cluster_weight, cluster_sum, limit = 0.0, 0.0, weight_limit(cum)
+            cluster_weight += weight
+            cluster_sum += weight * mean
+            cum += weight
+
+        new_means.append(cluster_sum / cluster_weight)
+        new_weights.append(cluster_weight)
+        return np.array(new_means), np.array(new_weights)
+
+    def quantile(self, q: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Estimates the qth quantile(s).
+
+        If the sketch was never compressed (every centroid is a single value),
+        the result is exact and matches np.quantile().
+
+        Args:
+            q (Union[float, np.ndarray]): Quantile(s) between 0 and 1.
+
+        Returns:
+            Union[float, np.ndarray]: Estimated quantile value(s). nan if the
+                sketch is empty.
+
+        Raises:
+            ValueError: If q is outside the range [0, 1].
+        """
+
+        q_arr = np.asarray(q, dtype=np.float64)
+        if np.any((q_arr < 0) | (q_arr > 1)):
+            raise ValueError("Incorrect value for q. q must be between 0 and 1.")
+
+        if self._buffer:
+            if self._weights.size == 0 and all(np.all(weights == 1) for weights in self._buffer_weights):
+                # Exact answer for small inputs that never filled the buffer
+                return np.quantile(np.concatenate(self._buffer), q)
+            self._compress()
+
+        if self._weights.size == 0:
+            return np.full(q_arr.shape, np.nan)[()]
+
+        if np.all(self._weights == 1):
+            return np.quantile(self._means, q)
+
+        # Linear interpolation between the centroid means positioned at the
+        # center of their cumulative weights, anchored at the exact min and max.
+        total = self._weights.sum()
+        centers = np.cumsum(self._weights) - self._weights / 2
+        xp = np.concatenate([[0.0], centers, [total]])
+        fp = np.concatenate([[self.min], self._means, [self.max]])
+        return np.interp(q_arr * total, xp, fp)[()]
+
+    def percentile(self, p: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Estimates the pth percentile(s). Same as quantile(p / 100)."""
+
+        return self.quantile(np.asarray(p, dtype=np.float64) / 100)
+
+
+def sketch_csvs(
+    csv_paths: List[str],
+    column: str="mean",
+    compression: float=200,
+    chunksize: int=100_000,
+) -> TDigest:
+    """Builds a single sketch over a column of multiple CSV files by reading
+    them chunk-by-chunk, e.g. all the model files of a site.
+
+    Args:
+        csv_paths (List[str]): Paths of the CSV files.
+        column (str, optional): Column to summarize. Defaults to 'mean'.
+        compression (float, optional): Compression of the sketch.
+            Defaults to 200.
+        chunksize (int, optional): Number of rows read at a time.
+            Defaults to 100,000.
+
+    Returns:
+        TDigest: Sketch of all the values.
+    """
+
+    digest = TDigest(compression=compression)
+    for csv_path in csv_paths:
+        for chunk in pd.read_csv(csv_path, usecols=[column], chunksize=chunksize):
+            digest.update(chunk[column])
+    return digest
+
+
+def approx_percentile(
+    a: Union[np.ndarray, pd.Series],
+    q: Union[float, np.ndarray],
+    compression: float=200,
+    chunksize: int=100_000,
+) -> Union[float, np.ndarray]:
+    """Drop-in replacement for np.percentile(a, q) based on the TDigest sketch.
+    Can be passed as agg_function to preprocess.get_sub_period_stats().
+
+    Args:
+        a (Union[np.ndarray, pd.Series]): Input values.
+        q (Union[float, np.ndarray]): Percentile(s) between 0 and 100.
+        compression (float, optional): Compression of the sketch.
+            Defaults to 200.
+        chunksize (int, optional): Number of values added at a time.
+            Defaults to 100,000.
+
+    Returns:
+        Union[float, np.ndarray]: Estimated percentile value(s).
+    """
+
+    a = np.asarray(a, dtype=np.float64).ravel()
+    digest = TDigest(compression=compression)
+    for i in range(0, a.size, chunksize):
+        digest.update(a[i:i+chunksize])
+    return digest.percentile(q)
@@ -0,0 +1,238 @@
+import os
+import math
+import warnings
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from typing import List, Dict
+
+from climate_resilience import aggregators
+from climate_resilience import dataset
+
+
+# Trend statistics calculated by trend_stats() for every site
+TREND_STATS = ["n_years", "ols_slope", "sens_slope", "mk_s", "mk_z", "mk_pvalue"]
+
+# Vectorized complementary error function used for the normal p-values
+_erfc = np.vectorize(math.erfc, otypes=[np.float64])
+
+
+def _tie_correction(values: np.ndarray) -> np.ndarray:
+    """Sum of t(t-1)(2t+5) over the groups of t tied values of every site,
+    i.e. the tie correction of the Mann-Kendall variance."""
+
+    ordered = np.sort(values, axis=-1)    # nan values are sorted last and never tie
+    ties = ordered[:, 1:] == ordered[:, :-1]
+
+    # The run length at the last position of a run of ties is t - 1
+    run_ends = ties & ~np.c_[ties[:, 1:], np.zeros((len(ties), 1), dtype=bool)]
+    t = np.where(run_ends, aggregators.run_lengths(ties) + 1, 0)
+    return np.sum(t * (t - 1) * (2 * t + 5), axis=-1)
+
+
+def trend_stats(values: np.ndarray, years: np.ndarray, site_chunk: int=256) -> Dict[str, np.ndarray]:
+    """Calculates the OLS slope, Sen's slope and the Mann-Kendall test of
+    every site of a site x year array in closed form.
+
+    All the (i, j) year pairs are evaluated at once for a chunk of sites, so
+    the memory is bounded by site_chunk x number of year pairs values. Missing
+    years (nan) are ignored by all the statistics.
+
+    Args:
+        values (np.ndarray): Site x year array, e.g. the 'maximum' statistic
+            of get_per_year_stats() of all the sites.
+        years (np.ndarray): Years of the columns.
+        site_chunk (int, optional): Number of sites per chunk. Defaults to 256.
+
+    Returns:
+        Dict[str, np.ndarray]: One value per site of every statistic in
+            TREND_STATS. The slopes are in units per year, mk_pvalue is the
+            two-sided p-value of the Mann-Kendall test with tie correction.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    x = np.asarray(years, dtype=np.float64)
+    pair_i, pair_j = np.triu_indices(len(x), k=1)
+
+    outputs = {stat: np.full(len(values), np.nan) for stat in TREND_STATS}
+    for r0 in range(0, len(values), site_chunk):
+        y = values[r0:r0+site_chunk]
+        valid = ~np.isnan(y)
+        n = valid.sum(axis=-1)
+
+        # OLS slope: sum(dx * dy) / sum(dx^2) over the valid years of every site
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x_mean = (valid * x).sum(axis=-1) / n
+            y_mean = np.nansum(y, axis=-1) / n
+            dx = np.where(valid, x - x_mean[:, None], 0.0)
+            dy = np.where(valid, y - y_mean[:, None], 0.0)
+            ols_slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+
+        # Differences of all the year pairs (j > i)
+        pair_dy = y[:, pair_j] - y[:, pair_i]
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)    # Sites with less than 2 years have no slope
+            s = np.nansum(np.sign(pair_dy), axis=-1)
+            sens_slope = np.nanmedian(pair_dy / (x[pair_j] - x[pair_i]), axis=-1) if len(pair_i) else np.full(len(y), np.nan)
+
+            variance = (n * (n - 1) * (2 * n + 5) - _tie_correction(y)) / 18
+            z = np.where(variance > 0, (s - np.sign(s)) / np.sqrt(np.where(variance > 0, variance, 1.0)), 0.0)    # all values tied: no trend
+
+        enough = n >= 3
+        rows = slice(r0, r0 + len(y))
+        outputs["n_years"][rows] = n
+        outputs["ols_slope"][rows] = np.where(n >= 2, ols_slope, np.nan)
+        outputs["sens_slope"][rows] = np.where(n >= 2, sens_slope, np.nan)
+        outputs["mk_s"][rows] = np.where(enough, s, np.nan)
+        outputs["mk_z"][rows] = np.where(enough, z, np.nan)
+        outputs["mk_pvalue"][rows] = np.where(enough, _erfc(np.abs(z) / np.sqrt(2)), np.nan)
+
+    return outputs
+
+
+def trends_table(per_year: Dict[str, pd.DataFrame], site_chunk: int=256) -> pd.DataFrame:
+    """Trend statistics of site x year data frames, e.g. the output of
+    read_per_year_stats() or chunked.annual_stats().
+
+    Args:
+        per_year (Dict[str, pd.DataFrame]): Site x year data frame of every
+            annual statistic. The columns are the years.
+        site_chunk (int, optional): Number of sites per chunk. Defaults to 256.
+
+    Returns:
+        pd.DataFrame: One row per site (same index as the input data frames)
+            with a '{statistic}_{trend stat}' column per TREND_STATS entry.
+    """
+
+    columns = {}
+    index = None
+    for statistic, df in per_year.items():
+        index = df.index
+        site_trends = trend_stats(df.to_numpy(dtype=np.float64), df.columns.to_numpy(dtype=np.float64), site_chunk)
+        for stat in TREND_STATS:
+            columns[f"{statistic}_{stat}"] = site_trends[stat]
+
+    return pd.DataFrame(columns, index=index)
+
+
+def read_per_year_stats(
+    sites: pd.DataFrame,
+    datadir: str,
+    reducers: List[str]=None,
+    output_format: str="csv",
+) -> Dict[str, pd.DataFrame]:
+    """Reads the outputs of preprocess.get_per_year_stats() into one
+    site x year data frame per annual statistic.
+
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information.
+        datadir (str): Parent directory containing all the data files.
+        reducers (List[str], optional): Annual statistics to read. Defaults
+            to None, i.e. all the statistics in the files.
+        output_format (str, optional): Format of the get_per_year_stats()
+            output. Defaults to 'csv'.
+            Options: 'csv' | 'parquet'
+
+    Returns:
+        Dict[str, pd.DataFrame]: Site x year data frame of every statistic,
+            in the order of the sites. Missing sites and years are nan.
+
+    Raises:
+        ValueError: If the value of output_format is not one of the specified options.
+    """
+
+    if output_format not in ["csv", "parquet"]:
+        raise ValueError("Incorrect value for output_format. Expecting one of these two: 'csv' | 'parquet'.")
+
+    site_index = pd.MultiIndex.from_arrays([sites.NameMnemonic, sites.StateCode], names=["NameMnemonic", "StateCode"])
+
+    if output_format == "parquet":
+        long = dataset.read_dataset(os.path.join(datadir, "per_year_stats.parquet"))
+    else:
+        frames = []
+        with tqdm(list(site_index)) as tqdm_site_index:
+            tqdm_site_index.set_description("Reading per year stats")
+
+            for name, state in tqdm_site_index:
+                csv_path = os.path.join(datadir, "per_year_stats", f"{name}_{state}_PMP.csv")
+                if not os.path.exists(csv_path):
+                    print(f"WARNING: {csv_path} does not exist. Storing nan values for this site.")
+                    continue
+                frames.append(pd.read_csv(csv_path, index_col=0).rename_axis("year").reset_index().assign(NameMnemonic=name, StateCode=state))
+        long = pd.concat(frames, ignore_index=True)
+
+    if reducers is None:
+        reducers = [col for col in long.columns if col not in ["year", "NameMnemonic", "StateCode"]]
+
+    per_year = {}
+    for reducer in reducers:
+        wide = long.pivot_table(index=["NameMnemonic", "StateCode"], columns="year", values=reducer, aggfunc="first", dropna=False)
+        per_year[reducer] = wide.reindex(site_index).sort_index(axis=1)
+    return per_year
+
+
+def get_trends(
+    sites: pd.DataFrame,
+    datadir: str,
+    reducers: List[str]=None,
+    start_year: int=None,
+    end_year: int=None,
+    output_format: str="csv",
+    site_chunk: int=256,
+) -> pd.DataFrame:
+    """Calculates the OLS slope, Sen's slope and Mann-Kendall p-value of the
+    get_per_year_stats() statistics of all the sites.
+
+    Replaces fitting a regression per site: the trends of all the sites are
+    calculated in closed form over the site x year array of every statistic
+    (refer to trend_stats()). The output is written to 'per_year_trends.csv'
+    in datadir.
+
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information.
+        datadir (str): Parent directory containing all the data files.
+            The generated output file is also stored here.
+        reducers (List[str], optional): Annual statistics to use. Defaults
+            to None, i.e. all the statistics of the per year stats.
+        start_year (int, optional): First year of the trend (inclusive).
+            Defaults to None, i.e. the first year in the data.
+        end_year (int, optional): Last year of the trend (inclusive).
+            Defaults to None, i.e. the last year in the data.
+        output_format (str, optional): Format of the get_per_year_stats()
+            output. Defaults to 'csv'.
+            Options: 'csv' | 'parquet'
+        site_chunk (int, optional): Number of sites per chunk. Defaults to 256.
+
+    Returns:
+        pd.DataFrame: The output DataFrame that is written to a csv file is also returned.
+    """
+
+    per_year = read_per_year_stats(sites, datadir, reducers, output_format)
+
+    for reducer, df in per_year.items():
+        years = df.columns.to_numpy()
+        keep = np.ones(len(years), dtype=bool)
+        if start_year is not None:
+            keep &= years >= start_year
+        if end_year is not None:
+            keep &= years <= end_year
+        per_year[reducer] = df.loc[:, keep]
+
+    df_trends = trends_table(per_year, site_chunk).reset_index(drop=True)
+    df_trends.insert(0, "OBJECTID", sites.OBJECTID.to_numpy())
+    df_trends.insert(1, "ID", sites.ID.to_numpy())
+
+    # Merge the generated data with the original Data Frame
+    df_trends = pd.merge(sites, df_trends,
+                         how="inner",
+                         left_on=["OBJECTID", "ID"],
+                         right_on=["OBJECTID", "ID"],
+                         suffixes=(None, "_copy"),
+                        )
+
+    # Write to CSV
+    output_csv_path = os.path.join(datadir, "per_year_trends.csv")
+    df_trends.to_csv(output_csv_path)
+    print(f"STATUS UPDATE: The output file generated from get_trends() function is stored as {output_csv_path}.")
+
+    return df_trends
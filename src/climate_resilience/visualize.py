@@ -1,11 +1,16 @@
 import os
+import functools
 import numpy as np
 import pandas as pd
+import geopandas as gpd
 import seaborn as sns
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import leafmap  # Helps with the colorbar plot. Builds on top of ipyleaflet
 from typing import List, Tuple
+from joblib import Parallel, delayed, cpu_count
 
 from ipyleaflet import (
     basemaps,
@@ -208,6 +213,7 @@ def plot_histogram(
     figsize: Tuple[int] = (12, 6),
     xlabels: List[str] = None,
     colors: List["str"] = None,
+    ax: plt.axes = None,
 ) -> Tuple[plt.figure, plt.axes]:
     """Plot histogram between specified bins for the select features of 
     the sites data frame.
@@ -226,6 +232,9 @@ def plot_histogram(
         colors (List["str"]): List of colors for each data vector. 
             Must match the number features listed. 
             Defaults to None. Matplotlib default colors are used in this case.
+        ax (plt.axes, optional): Existing axes to draw on, e.g. to reuse a 
+            figure. Defaults to None. A new figure of size 'figsize' is 
+            created in this case.
             
     Returns:
         Tuple[plt.figure, plt.axes]: Returns the figure and axes for the 
@@ -236,7 +245,10 @@ def plot_histogram(
     x = np.array(sites[features])
 
     # Creat plot
-    fig, ax = plt.subplots(nrows=1, ncols=1, figsize=figsize)
+    if ax is None:
+        fig, ax = plt.subplots(nrows=1, ncols=1, figsize=figsize)
+    else:
+        fig = ax.figure
 
     if bins is None:
         hist_data, hist_bins, hist_patches = ax.hist(
@@ -271,6 +283,7 @@ def plot_boxplot(
     plot_title: str = "Box Plot",
     figsize: Tuple[int] = (12, 6),
     output_filename: str = None,
+    ax: plt.axes = None,
 ) -> plt.axes:
     """Create boxplot using the provided data.
     
@@ -295,6 +308,9 @@ def plot_boxplot(
         figsize (Tuple[int], optional): Figure canvas size. Defaults to (12,6).
         output_filename (str, optional): Name of the output PNG file. 
             Defaults to None. The output file is not generated in this case.
+        ax (plt.axes, optional): Existing axes to draw on, e.g. to reuse a 
+            figure. Defaults to None. A new figure of size 'figsize' is 
+            created in this case.
     
     Returns:
         plt.axes: Return the plot object axes. This object can be used to 
@@ -306,8 +322,11 @@ def plot_boxplot(
     y_label = y_feature if y_label is None else y_label
 
     # Plotting the box plot
-    fig = plt.figure(figsize=figsize)
-    ax = fig.add_subplot()
+    if ax is None:
+        fig = plt.figure(figsize=figsize)
+        ax = fig.add_subplot()
+    else:
+        fig = ax.figure
     ax = sns.boxplot(
         x=x_feature,
         y=y_feature,
@@ -315,6 +334,7 @@ def plot_boxplot(
         data=data,
         hue_order=hue_order,
         palette=colors,
+        ax=ax,
     )
     ax.legend(bbox_to_anchor=(1.0, 0.8))
     ax.set_title(plot_title)
@@ -326,3 +346,274 @@ def plot_boxplot(
         fig.savefig(output_filename, bbox_inches="tight")
 
     return ax
+
+
+def _site_color_bins(
+    values: np.ndarray, scale_range: List[float], n_colors: int,
+) -> np.ndarray:
+    """Vectorized color binning of the site values into n_colors equal bins of 
+    scale_range. Returns the color index of every value, -1 for the values 
+    that are nan or outside of scale_range."""
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scaled = (np.asarray(values, dtype=np.float64) - scale_range[0]) / (scale_range[1] - scale_range[0])
+
+    x = np.array([i / n_colors for i in range(n_colors + 1)])  # [0, 0.25, 0.5, 0.75, 1]
+    bins = np.maximum(np.searchsorted(x, scaled, side="left") - 1, 0)
+    invalid = np.isnan(scaled) | (scaled < 0) | (scaled > 1)
+    return np.where(invalid, -1, bins)
+
+
+@functools.lru_cache(maxsize=4)
+def _read_basemap(basemap_path: str) -> gpd.GeoDataFrame:
+    """Reads the basemap boundaries once per process."""
+
+    return gpd.read_file(basemap_path)
+
+
+def plot_static_map(
+    sites: pd.DataFrame,
+    feature: str,
+    colors: List[str],
+    scale_range: List[float] = None,
+    basemap_path: str = None,
+    extent: List[float] = None,
+    marker_size: float = 40,
+    plot_colorbar: bool = True,
+    colorbar_label: str = "Colorbar",
+    colorbar_min: float = None,
+    colorbar_max: float = None,
+    plot_title: str = None,
+    figsize: Tuple[int] = (12, 7),
+    output_filename: str = None,
+    ax: plt.axes = None,
+    verbose: bool = False,
+) -> plt.axes:
+    """Static matplotlib alternative of plot_map() for reports.
+    
+    The sites are drawn as color-binned markers on a single figure together 
+    with the discrete colorbar, without creating any map widget, so the 
+    function works headless and can be rendered in batch using 
+    render_figures() with the 'map' kind.
+    
+    The markers that are generated in white color either lie outside the range 
+    specified in 'scale_range' OR have nan values.
+    
+    Args:
+        sites (pd.DataFrame): Data Frame containing all the site information. 
+            Must contain the 'Latitude' and 'Longitude' columns.
+        feature (str): Feature of interest.
+        colors (List[str]): List of colors to be used as markers. 
+            The scale_range is divided into number of colors specified.
+        scale_range (List[float], optional): Range of the scale. 
+            Expects a min and max value to specify the range. Defaults to None.
+            Min and Max value of the sites features are used in this case.
+        basemap_path (str, optional): Any file readable by geopandas, e.g. a 
+            states or coastline shapefile, whose boundaries are drawn below the 
+            markers. The file is read once per process. Defaults to None, 
+            i.e. no basemap.
+        extent (List[float], optional): [lon_min, lon_max, lat_min, lat_max] 
+            of the map. Defaults to None, i.e. the extent of the sites.
+        marker_size (float, optional): Size of the markers. Defaults to 40.
+        plot_colorbar (bool, optional): Boolean flag to spacify if the colorbar 
+            is to be plotted. Defaults to True.
+        colorbar_label (str, optional): Caption for the colorbar. 
+            Defaults to 'Colorbar'.
+        colorbar_min (float, optional): Minimum value label in the color bar. 
+            Defaults to None. Values are taken from scale_range in this case.
+        colorbar_max (float, optional): Maximum value label in the color bar. 
+            Defaults to None. Values are taken from scale_range in this case.
+        plot_title (str, optional): Title of the plot. Defaults to None.
+        figsize (Tuple[int], optional): Figure canvas size. Defaults to (12,7).
+        output_filename (str, optional): Name of the output image file, e.g. 
+            PNG or SVG. Defaults to None. The output file is not generated 
+            in this case.
+        ax (plt.axes, optional): Existing axes to draw on, e.g. to reuse a 
+            figure. Defaults to None. A new figure of size 'figsize' is 
+            created in this case.
+        verbose (bool, optional): Print the name of the saved output file. 
+            Defaults to False.
+    
+    Returns:
+        plt.axes: Return the plot object axes.
+    """
+
+    # Sanity check for the input params
+    if scale_range is None:
+        scale_range = [sites[feature].min(), sites[feature].max()]
+
+    if colorbar_min is None:
+        colorbar_min = scale_range[0]
+
+    if colorbar_max is None:
+        colorbar_max = scale_range[-1]
+
+    if ax is None:
+        fig = plt.figure(figsize=figsize)
+        ax = fig.add_subplot()
+    else:
+        fig = ax.figure
+
+    if basemap_path is not None:
+        _read_basemap(basemap_path).boundary.plot(ax=ax, color="gray", linewidth=0.5, zorder=1)
+
+    # Finding the color for all the sites at once
+    bins = _site_color_bins(sites[feature].to_numpy(), scale_range, len(colors))
+    marker_colors = np.array(list(colors) + ["white"], dtype=object)[bins]
+    ax.scatter(
+        sites["Longitude"].to_numpy(),
+        sites["Latitude"].to_numpy(),
+        c=list(marker_colors),
+        s=marker_size,
+        edgecolors="black",
+        linewidths=0.5,
+        zorder=2,
+    )
+
+    if extent is not None:
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+    ax.set_aspect("equal", adjustable="datalim")
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    if plot_title is not None:
+        ax.set_title(plot_title)
+
+    # Plot the discrete colorbar in the same figure
+    if plot_colorbar:
+        cmap = mpl.colors.ListedColormap(colors)
+        norm = mpl.colors.BoundaryNorm(np.linspace(colorbar_min, colorbar_max, len(colors) + 1), cmap.N)
+        fig.colorbar(
+            mpl.cm.ScalarMappable(norm=norm, cmap=cmap),
+            ax=ax,
+            orientation="horizontal",
+            label=colorbar_label,
+            fraction=0.05,
+            pad=0.1,
+        )
+
+    # Generating the output file
+    if output_filename is not None:
+        fig.savefig(output_filename, bbox_inches="tight")
+        if verbose:
+            print(f"Saved map as {output_filename}.")
+
+    return ax
+
+
+# Plot functions that can be rendered in batch by render_figures()
+PLOT_FUNCTIONS = {
+    "boxplot": plot_boxplot,
+    "histogram": plot_histogram,
+    "map": plot_static_map,
+}
+
+
+def _render_specs(
+    specs: List[Tuple[int, dict]],
+    output_dir: str,
+    formats: List[str],
+    dpi: int,
+) -> List[Tuple[int, List[str]]]:
+    """Worker task: renders a batch of plot specs on the headless Agg backend.
+    One figure per figure size is created and cleared between the plots.
+
+    The figures are attached to an Agg canvas directly instead of going 
+    through pyplot, so the backend and the open figures of the calling process 
+    are left untouched when joblib runs the batch in-process."""
+
+    figures = {}
+    outputs = []
+    for spec_i, spec in specs:
+        params = dict(spec.get("params", {}))
+        figsize = tuple(params.pop("figsize", (12, 6)))
+        params.pop("output_filename", None)
+
+        if figsize not in figures:
+            figures[figsize] = Figure(figsize=figsize)
+            FigureCanvasAgg(figures[figsize])
+        fig = figures[figsize]
+        fig.clf()
+
+        PLOT_FUNCTIONS[spec["kind"]](ax=fig.add_subplot(), **params)
+
+        paths = []
+        for fmt in formats:
+            path = os.path.join(output_dir, f"{spec['name']}.{fmt}")
+            fig.savefig(path, bbox_inches="tight", dpi=dpi)
+            paths.append(path)
+        outputs.append((spec_i, paths))
+
+    return outputs
+
+
+def render_figures(
+    specs: List[dict],
+    output_dir: str,
+    formats: List[str] = None,
+    dpi: int = 100,
+    n_jobs: int = -1,
+    verbose: bool = False,
+) -> List[List[str]]:
+    """Renders many plot_boxplot(), plot_histogram() and plot_static_map() 
+    figures headless in parallel worker processes and writes them to output_dir.
+    
+    The specs are split into one batch per worker. Every worker uses the Agg 
+    backend and reuses its figure objects between the plots of its batch.
+    
+    Example Usage:
+        specs = [
+            {"kind": "boxplot", "name": "pr_rcp45", "params": {"data": df, "x_feature": "Period", 
+                                                             "y_feature": "Value", "hue_feature": "Region"}},
+            {"kind": "histogram", "name": "pr_hist", "params": {"sites": sites, "features": ["pr_mean"]}},
+        ]
+        render_figures(specs, "figures", formats=["png", "svg"])
+    
+    Args:
+        specs (List[dict]): Plot specifications with the following keys:
+            'kind': Key of PLOT_FUNCTIONS, i.e. 'boxplot' | 'histogram' | 'map'.
+            'name': Output file name without the extension.
+            'params': Arguments of the plot function.
+        output_dir (str): Directory where the figures are stored.
+        formats (List[str], optional): Output file formats. 
+            Defaults to None, i.e. ['png'].
+        dpi (int, optional): Resolution of the raster outputs. Defaults to 100.
+        n_jobs (int, optional): Number of worker processes. Defaults to -1, 
+            i.e. all the CPUs.
+        verbose (bool, optional): Print the number of saved figures. 
+            Defaults to False.
+    
+    Returns:
+        List[List[str]]: Paths of the generated files of every spec, in the 
+            order of the specs.
+    
+    Raises:
+        ValueError: If the kind of any spec is not one of the specified options.
+    """
+
+    if formats is None:
+        formats = ["png"]
+
+    for spec in specs:
+        if spec.get("kind") not in PLOT_FUNCTIONS:
+            raise ValueError(f"Incorrect plot kind '{spec.get('kind')}'. Expecting one of these: {' | '.join(PLOT_FUNCTIONS)}.")
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # One batch of specs per worker
+    n_workers = max(1, min(len(specs), cpu_count() + 1 + n_jobs if n_jobs < 0 else n_jobs))
+    batches = [list(enumerate(specs))[w::n_workers] for w in range(n_workers)]
+
+    results = Parallel(n_jobs=n_workers)(
+        delayed(_render_specs)(batch, output_dir, formats, dpi) for batch in batches if batch
+    )
+
+    outputs = [None] * len(specs)
+    for batch_outputs in results:
+        for spec_i, paths in batch_outputs:
+            outputs[spec_i] = paths
+
+    if verbose:
+        print(f"Saved {len(specs)} figures in {output_dir}.")
+    return outputs
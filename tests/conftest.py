@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from climate_resilience import catalog
+
+
+SCENARIO_SPANS = {"historical": ("1960-01-01", "1964-12-31"), "rcp45": ("2006-01-01", "2010-12-31")}
+MODELS = ["ACCESS1-0", "CCSM4", "MIROC5"]
+
+
+@pytest.fixture
+def sites():
+    return pd.DataFrame({
+        "OBJECTID": [1, 2, 3],
+        "ID": [11, 12, 13],
+        "NameMnemonic": ["AMB", "BMB", "CMB"],
+        "StateCode": ["NM", "TX", "HI"],
+        "Latitude": [35.1, 31.0, 21.3],
+        "Longitude": [-106.6, -97.7, -157.8],
+    })
+
+
+@pytest.fixture
+def datadir(tmp_path, sites):
+    """Small datadir with the downloaded model files in '{scenario}_{variable}'
+    and the ensemble series in '{scenario}_{variable}_ensemble'."""
+
+    rng = np.random.default_rng(0)
+    for sce, (start, end) in SCENARIO_SPANS.items():
+        dates = pd.date_range(start, end, freq="D")
+        for var in ["pr", "tasmax"]:
+            os.makedirs(tmp_path / f"{sce}_{var}")
+            os.makedirs(tmp_path / f"{sce}_{var}_ensemble")
+            for name, state in zip(sites.NameMnemonic, sites.StateCode):
+                if var == "pr":
+                    values = np.where(rng.random(len(dates)) < 0.6, 0.0, rng.gamma(0.7, 8.0, len(dates)))
+                else:
+                    values = 20 + 8 * np.sin(np.arange(len(dates)) * 2 * np.pi / 365.25) + rng.normal(0, 3, len(dates))
+
+                for model in MODELS:
+                    pd.DataFrame({"date": dates.strftime("%Y-%m-%d"), "mean": values + rng.normal(0, 0.5, len(dates))}).to_csv(
+                        tmp_path / f"{sce}_{var}" / f"{name}_{state}_{sce}_{var}_{model}.csv", index=False
+                    )
+                pd.DataFrame({"date": dates.strftime("%Y-%m-%d"), "mean": values, "std": rng.random(len(dates))}).to_csv(
+                    tmp_path / f"{sce}_{var}_ensemble" / f"{name}_{state}_{sce}_{var}.csv"
+                )
+
+    # The catalogs are cached per datadir in the process
+    catalog._catalogs.clear()
+    yield str(tmp_path)
+    catalog._catalogs.clear()
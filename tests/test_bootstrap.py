@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from climate_resilience import bootstrap
+from climate_resilience import preprocess
+
+
+def _mean_and_p90(resampled):
+    return {"mean": resampled.mean(axis=-1), "p90": np.percentile(resampled, 90, axis=-1)}
+
+
+def test_bootstrap_ci_does_not_depend_on_the_batches_or_workers():
+    block = np.random.default_rng(1).gamma(0.5, 4.0, (3, 1000))
+    single = bootstrap.bootstrap_ci(block, _mean_and_p90, n_resamples=100)
+    batched = bootstrap.bootstrap_ci(block, _mean_and_p90, n_resamples=100, max_elements=3 * 1000 * 7, n_jobs=2)
+
+    for name in ["mean", "p90"]:
+        np.testing.assert_array_equal(single[name][0], batched[name][0])
+        np.testing.assert_array_equal(single[name][1], batched[name][1])
+
+    # Same as resampling every site separately with the shared indices
+    indices = bootstrap.block_bootstrap_indices(1000, 100)
+    for site in range(3):
+        low, high = np.quantile([block[site, i].mean() for i in indices], [0.025, 0.975])
+        assert single["mean"][0][site] == pytest.approx(low) and single["mean"][1][site] == pytest.approx(high)
+
+
+def test_percentile_confidence_intervals_are_reproducible(datadir, sites):
+    runs = [
+        preprocess.calculate_Nth_percentile(sites, ["rcp45"], ["pr"], datadir, N=95, n_bootstrap=50, seed=3, n_jobs=n_jobs)
+        for n_jobs in [1, 2]
+    ]
+
+    columns = ["rcp45_pr_percentile_ci_low", "rcp45_pr_percentile_ci_high"]
+    assert runs[0][columns].equals(runs[1][columns])
+    assert (runs[0][columns[0]] <= runs[0]["rcp45_pr_percentile"]).all()
+    assert (runs[0]["rcp45_pr_percentile"] <= runs[0][columns[1]]).all()
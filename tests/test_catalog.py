@@ -0,0 +1,89 @@
+import os
+
+import pandas as pd
+import pytest
+
+from climate_resilience import catalog
+
+
+def _write_csv(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({"date": ["1950-01-01"], "mean": [1.0]}).to_csv(path, index=False)
+
+
+@pytest.fixture
+def datadir(tmp_path, monkeypatch):
+    """Small datadir tree with one ensemble and two model files. The working
+    directory is the parent of datadir, so 'data' is a valid relative path."""
+
+    root = tmp_path / "data"
+    _write_csv(str(root / "rcp45_pr_ensemble" / "AMB_NM_rcp45_pr.csv"))
+    _write_csv(str(root / "rcp45_pr" / "AMB_NM_rcp45_pr_CCSM4.csv"))
+    _write_csv(str(root / "rcp45_pr" / "AMB_NM_rcp45_pr_ACCESS1-0.csv"))
+
+    monkeypatch.chdir(tmp_path)
+    catalog._catalogs.clear()
+    yield root
+    catalog._catalogs.clear()
+
+
+@pytest.mark.parametrize("first, second", [("relative", "absolute"), ("absolute", "relative")])
+def test_mixed_relative_and_absolute_datadir(datadir, first, second):
+    paths = {"relative": "data", "absolute": str(datadir)}
+
+    # The first call writes the on-disk cache, the second one reuses it
+    catalog.get_catalog(paths[first])
+    catalog._catalogs.clear()
+    file_catalog = catalog.get_catalog(paths[second])
+
+    for base in paths.values():
+        assert file_catalog.exists(os.path.join(base, "rcp45_pr_ensemble", "AMB_NM_rcp45_pr.csv"))
+        assert not file_catalog.exists(os.path.join(base, "rcp45_pr_ensemble", "XYZ_NM_rcp45_pr.csv"))
+
+    model_files = file_catalog.model_files("rcp45", "pr", "AMB", "NM")
+    assert [os.path.basename(path) for path in model_files] == ["AMB_NM_rcp45_pr_ACCESS1-0.csv", "AMB_NM_rcp45_pr_CCSM4.csv"]
+    assert all(os.path.exists(path) for path in model_files)
+
+
+def test_relative_and_absolute_datadir_share_the_in_memory_catalog(datadir):
+    assert catalog.get_catalog("data") is catalog.get_catalog(str(datadir))
+
+
+def test_stale_sites_are_tracked_per_stage(datadir):
+    sites = pd.DataFrame({"NameMnemonic": ["AMB", "BMB"], "StateCode": ["NM", "NM"]})
+    ensemble_dir = os.path.join(str(datadir), "climate_ensemble")
+    per_year_dir = os.path.join(str(datadir), "per_year_stats")
+
+    catalog.mark_stale(str(datadir), "rcp45", "pr", "AMB", "NM")
+    catalog.mark_stale(str(datadir), "rcp45", "pr", "BMB", "NM")
+
+    # Only the regenerated sites of the regenerated stage are cleared
+    catalog.clear_stale(str(datadir), ensemble_dir, {("rcp45", "pr"): [("AMB", "NM")]})
+    assert catalog.stale_sites(str(datadir), ensemble_dir, sites, ["rcp45"], ["pr"]).NameMnemonic.tolist() == ["BMB"]
+    assert catalog.stale_sites(str(datadir), per_year_dir, sites, ["rcp45"], ["pr"]).NameMnemonic.tolist() == ["AMB", "BMB"]
+    assert catalog.stale_sites(str(datadir), ensemble_dir, sites, ["historical"], ["pr"]).empty
+
+    # A later mark makes a regenerated site stale again
+    catalog.mark_stale(str(datadir), "rcp45", "pr", "AMB", "NM")
+    assert catalog.stale_sites("data", "data/climate_ensemble", sites, ["rcp45"], ["pr"]).NameMnemonic.tolist() == ["AMB", "BMB"]
+
+
+def test_downstream_stage_stays_stale_until_the_upstream_stage_is_regenerated(datadir, capsys):
+    sites = pd.DataFrame({"NameMnemonic": ["AMB"], "StateCode": ["NM"]})
+    ensemble_dir = os.path.join(str(datadir), catalog.ENSEMBLE_STAGE)
+    per_year_dir = os.path.join(str(datadir), "per_year_stats")
+    catalog.mark_stale(str(datadir), "rcp45", "pr", "AMB", "NM")
+
+    # The downstream stage read the stale ensemble
+    catalog.clear_stale(str(datadir), per_year_dir, {("rcp45", "pr"): [("AMB", "NM")]}, upstream=ensemble_dir)
+    assert "WARNING" in capsys.readouterr().out
+    assert catalog.stale_sites(str(datadir), per_year_dir, sites, ["rcp45"], ["pr"]).NameMnemonic.tolist() == ["AMB"]
+
+    # Regenerating the ensemble alone does not refresh the downstream stage
+    catalog.clear_stale(str(datadir), ensemble_dir, {("rcp45", "pr"): [("AMB", "NM")]})
+    assert catalog.stale_sites(str(datadir), ensemble_dir, sites, ["rcp45"], ["pr"]).empty
+    assert catalog.stale_sites(str(datadir), per_year_dir, sites, ["rcp45"], ["pr"]).NameMnemonic.tolist() == ["AMB"]
+
+    catalog.clear_stale(str(datadir), per_year_dir, {("rcp45", "pr"): [("AMB", "NM")]}, upstream=ensemble_dir)
+    assert "WARNING" not in capsys.readouterr().out
+    assert catalog.stale_sites(str(datadir), per_year_dir, sites, ["rcp45"], ["pr"]).empty
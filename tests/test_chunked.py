@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from climate_resilience import chunked
+from climate_resilience import preprocess
+from climate_resilience import series_store
+
+
+def test_annual_stats_match_the_per_year_stats(datadir, sites, tmp_path):
+    reducers = ["maximum", "mean", "std", "rx5day"]
+
+    # The wettest 5 days of AMB span the new year
+    csv_path = os.path.join(datadir, "rcp45_pr_ensemble", "AMB_NM_rcp45_pr.csv")
+    df = pd.read_csv(csv_path, index_col=0)
+    df.loc[df["date"].between("2007-12-30", "2008-01-03"), "mean"] = 100.0
+    df.to_csv(csv_path)
+
+    store_dir = series_store.build_series_store(sites, ["rcp45"], ["pr"], datadir, str(tmp_path / "store"))
+    preprocess.get_per_year_stats(sites, ["rcp45"], ["pr"], datadir, reducers=reducers)
+
+    # Blocks of one year and two sites, so every rx5day window at the start of a year needs the halo
+    stats = chunked.annual_stats(store_dir, "rcp45", "pr", reducers=reducers, site_chunk=2, years_per_chunk=1, halo_days=4, n_jobs=1)
+
+    for name, state in zip(sites.NameMnemonic, sites.StateCode):
+        expected = pd.read_csv(os.path.join(datadir, "per_year_stats", f"{name}_{state}_PMP.csv"), index_col=0)
+        for reducer in reducers:
+            np.testing.assert_allclose(stats[reducer].loc[(name, state)].to_numpy(), expected[reducer].to_numpy())
+    assert stats["rx5day"].loc[("AMB", "NM"), 2008] == 500.0
+
+
+def test_site_stats_match_the_percentile(datadir, sites, tmp_path):
+    store_dir = series_store.build_series_store(sites, ["rcp45"], ["pr"], datadir, str(tmp_path / "store"))
+    percentiles = chunked.site_stats(store_dir, "rcp45", "pr", q=99, site_chunk=2, n_jobs=1)
+
+    for name, state in zip(sites.NameMnemonic, sites.StateCode):
+        df = pd.read_csv(os.path.join(datadir, "rcp45_pr_ensemble", f"{name}_{state}_rcp45_pr.csv"))
+        assert percentiles[(name, state)] == np.percentile(df["mean"], 99)
@@ -0,0 +1,5 @@
+from climate_resilience import constants
+
+
+def test_regions_are_in_the_order_of_the_region_codes():
+    assert list(constants.REGION_STATES) == sorted(constants.REGION_CODES, key=constants.REGION_CODES.get)
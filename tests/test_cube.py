@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("xarray")
+
+from climate_resilience import catalog
+from climate_resilience import cube
+from climate_resilience import dataset
+from climate_resilience import preprocess
+
+
+@pytest.mark.parametrize("ensemble_format", ["csv", "parquet"])
+def test_build_cube_from_the_climate_ensemble_output(datadir, sites, ensemble_format):
+    if ensemble_format == "parquet":
+        pytest.importorskip("pyarrow")
+
+    preprocess.get_climate_ensemble(sites, ["historical", "rcp45"], ["pr"], datadir, output_format=ensemble_format)
+    catalog._catalogs.clear()
+    cube_path = cube.build_cube(sites, ["historical", "rcp45"], ["pr"], datadir, os.path.join(datadir, "cube.nc"),
+                                source="ensemble", ensemble_format=ensemble_format)
+
+    ds = cube.open_cube(cube_path)
+    assert list(ds["model"].values) == cube.ENSEMBLE_MODELS
+    for sce in ["historical", "rcp45"]:
+        dates, block = cube.cube_block(ds, sites, sce, "pr")
+        for row, (name, state) in enumerate(zip(sites.NameMnemonic, sites.StateCode)):
+            expected = pd.read_csv(os.path.join(datadir, "climate_ensemble", f"{name}_{state}_{sce}_pr.csv")) if ensemble_format == "csv" else \
+                dataset.read_dataset(os.path.join(datadir, "climate_ensemble.parquet"), scenario=sce, NameMnemonic=name).sort_values("date")
+            assert np.array_equal(dates, pd.to_datetime(expected["date"]).to_numpy().astype("datetime64[D]"))
+            np.testing.assert_allclose(block[row], expected["mean"], rtol=1e-6)
+    ds.close()
+
+
+def test_missing_scenario_in_the_cube_is_a_warning(datadir, sites, capsys):
+    cube_path = cube.build_cube(sites, ["historical"], ["pr"], datadir, os.path.join(datadir, "cube.nc"))
+
+    ds = cube.open_cube(cube_path)
+    dates, block = cube.cube_block(ds, sites, "rcp45", "pr")
+    assert len(dates) == 0 and block.shape == (len(sites), 0)
+    assert preprocess._read_site_series(datadir, "AMB", "NM", "rcp45", "pr", None, ds) is None
+    assert preprocess._read_site_series(datadir, "AMB", "NM", "historical", "tasmax", None, ds) is None
+    assert "WARNING" in capsys.readouterr().out
+    ds.close()
@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from climate_resilience import dataset
+
+
+def _rows(names):
+    return pd.DataFrame({"NameMnemonic": names, "StateCode": "NM", "year": 1950, "maximum": 1.0})
+
+
+def test_rerun_replaces_the_dataset(tmp_path):
+    root_dir = str(tmp_path / "per_year_stats.parquet")
+
+    with dataset.PartitionedDatasetWriter(root_dir, buffer_rows=1) as writer:
+        for name in ["AMB", "BMB", "CMB"]:
+            writer.write(_rows([name]))
+
+    # A second run on a subset of the sites, e.g. get_per_year_stats() on fewer sites
+    with dataset.PartitionedDatasetWriter(root_dir, buffer_rows=1) as writer:
+        writer.write(_rows(["BMB"]))
+
+    df = dataset.read_dataset(root_dir)
+    assert df.NameMnemonic.tolist() == ["BMB"]
@@ -0,0 +1,178 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+pytest.importorskip("ee")
+
+from climate_resilience import catalog
+from climate_resilience import downloader
+from climate_resilience import fake_ee
+
+
+@pytest.fixture
+def site_json(sites, tmp_path):
+    path = tmp_path / "sites.json"
+    gpd.GeoDataFrame(sites, geometry=gpd.points_from_xy(sites.Longitude, sites.Latitude), crs="EPSG:4326").to_file(path, driver="GeoJSON")
+    return str(path)
+
+
+def _params_yaml(tmp_path, filename, **params):
+    params = {
+        "variables": ["pr", "tasmax"], 
+        "models": ["ACCESS1-0", "CCSM4"], 
+        "scenario_future": ["rcp45"], 
+        "start_date": "2006-01-01", 
+        "end_date": "2007-01-01", 
+        **params,
+    }
+    path = tmp_path / filename
+    with open(path, "w") as f:
+        yaml.safe_dump(params, f)
+    return str(path)
+
+
+def test_download_samples_exports_every_series_to_the_fake_drive(site_json, tmp_path):
+    backend = fake_ee.FakeEarthEngine(output_dir=str(tmp_path / "drive"))
+    sd_obj = downloader.SitesDownloader(folder="exports", site_json_file_path=site_json, backend=backend)
+    tasks = sd_obj.download_samples(_params_yaml(tmp_path, "params.yml"), mode="daily")
+
+    table = fake_ee.task_table(tasks)
+    assert len(table) == 3 * 2 * 2 and (table["state"] == "COMPLETED").all() and (table["n_rows"] == 365).all()
+
+    path = tmp_path / "drive" / "exports" / "rcp45" / "pr" / "AMB_NM_rcp45_pr_CCSM4.csv"
+    df = pd.read_csv(path)
+    assert df.columns.tolist() == ["date", "mean"]
+    assert df["date"].tolist() == pd.date_range("2006-01-01", "2006-12-31").strftime("%Y-%m-%d").tolist()
+
+    # The synthesized series are deterministic
+    downloader.SitesDownloader(folder="exports", site_json_file_path=site_json, 
+                               backend=fake_ee.FakeEarthEngine(output_dir=str(tmp_path / "drive2"))) \
+              .download_samples(_params_yaml(tmp_path, "params.yml"), mode="daily")
+    assert pd.read_csv(tmp_path / "drive2" / "exports" / "rcp45" / "pr" / "AMB_NM_rcp45_pr_CCSM4.csv").equals(df)
+
+
+def test_plan_downloads_dedups_the_model_independent_modes(site_json, tmp_path):
+    params_yaml = _params_yaml(tmp_path, "params.yml")
+    sd_obj = downloader.SitesDownloader(folder="exports", site_json_file_path=site_json, 
+                                        backend=fake_ee.FakeEarthEngine(output_dir=str(tmp_path / "drive")))
+
+    # 'monthly' does not filter by model, so the two models share a task
+    full = sd_obj.plan_downloads(params_yaml, "monthly", dedup=False)
+    plan = sd_obj.plan_downloads(params_yaml, "monthly", output_path=str(tmp_path / "plan.csv"))
+    assert len(full) == 3 * 2 * 2 and len(plan) == 3 * 2
+    assert (plan["n_images"] == 12).all() and (plan["est_bytes"] == 12 * downloader.EXPORT_ROW_BYTES["monthly"]).all()
+
+    daily = sd_obj.plan_downloads(params_yaml, "average_daily")
+    assert (daily["n_images"] == 365 * downloader.NEX_GDDP_N_MODELS).all()
+
+    summary = sd_obj.estimate_download_plans(params_yaml, modes=["daily", "monthly"]).set_index(["mode", "dedup"])
+    assert summary.loc[("daily", False), "n_tasks"] == summary.loc[("daily", True), "n_tasks"] == 12
+    assert summary.loc[("monthly", True), "n_tasks"] == 6
+    assert summary.loc[("monthly", True), "est_bytes"] == plan["est_bytes"].sum()
+
+    # Executing the plan file writes one export per planned task
+    tasks = sd_obj.execute_plan(str(tmp_path / "plan.csv"))
+    assert fake_ee.task_table(tasks)["n_rows"].tolist() == plan["n_rows"].tolist()
+    for row in plan.itertuples():
+        assert len(pd.read_csv(tmp_path / "drive" / row.folder / f"{row.description}.csv")) == row.n_rows
+
+
+def test_schedule_download_configs():
+    llns = [(35.1, -106.6, "AMB", "NM"), (31.0, -97.7, "BMB", "TX")]
+    configs = [(site, var, model, sce) for site in llns for var in ["pr", "tasmax"] for model in ["M1", "M2"] for sce in ["rcp45", "historical"]]
+    buckets = lambda ordered: [(config[3], config[1], config[0][2]) for config in ordered]
+
+    assert downloader.schedule_download_configs(configs) == configs
+
+    # One site (all its models) of every bucket in turn
+    ordered = downloader.schedule_download_configs(configs, "round_robin")
+    assert sorted(ordered) == sorted(configs)
+    assert buckets(ordered)[::2] == [
+        ("rcp45", "pr", "AMB"), ("historical", "pr", "AMB"), ("rcp45", "tasmax", "AMB"), ("historical", "tasmax", "AMB"),
+        ("rcp45", "pr", "BMB"), ("historical", "pr", "BMB"), ("rcp45", "tasmax", "BMB"), ("historical", "tasmax", "BMB"),
+    ]
+    assert [config[2] for config in ordered[:2]] == ["M1", "M2"]
+
+    # The historical buckets first, interleaved round robin
+    ordered = downloader.schedule_download_configs(configs, "historical_first")
+    assert buckets(ordered)[::2] == [
+        ("historical", "pr", "AMB"), ("historical", "tasmax", "AMB"), ("historical", "pr", "BMB"), ("historical", "tasmax", "BMB"),
+        ("rcp45", "pr", "AMB"), ("rcp45", "tasmax", "AMB"), ("rcp45", "pr", "BMB"), ("rcp45", "tasmax", "BMB"),
+    ]
+
+    # Buckets of different priorities are not interleaved
+    ordered = downloader.schedule_download_configs(configs, "historical_first", priorities={"variable": {"tasmax": 0}})
+    assert buckets(ordered)[::2] == [
+        ("historical", "tasmax", "AMB"), ("historical", "tasmax", "BMB"), ("historical", "pr", "AMB"), ("historical", "pr", "BMB"),
+        ("rcp45", "tasmax", "AMB"), ("rcp45", "tasmax", "BMB"), ("rcp45", "pr", "AMB"), ("rcp45", "pr", "BMB"),
+    ]
+
+    # The priorities also order the 'product' policy, stably
+    ordered = downloader.schedule_download_configs(configs, priorities={"scenario": {"historical": 0}})
+    assert ordered == [config for config in configs if config[3] == "historical"] + [config for config in configs if config[3] == "rcp45"]
+
+    with pytest.raises(ValueError):
+        downloader.schedule_download_configs(configs, "fifo")
+
+
+@pytest.mark.parametrize("mode", ["daily", "monthly", "monthly_multiband"])
+def test_incremental_downloads_append_the_new_dates(site_json, tmp_path, mode):
+    datadir, drive = str(tmp_path / "data"), str(tmp_path / "drive")
+    first_yaml = _params_yaml(tmp_path, "first.yml")
+    extended_yaml = _params_yaml(tmp_path, "extended.yml", end_date="2008-01-01")
+    sd_obj = downloader.SitesDownloader(folder="exports", site_json_file_path=site_json, backend=fake_ee.FakeEarthEngine(output_dir=drive))
+
+    # Local copies of the first year
+    plan = sd_obj.plan_downloads(first_yaml, mode)
+    sd_obj.execute_plan(plan)
+    for row in plan.itertuples():
+        local_path = downloader.local_series_path(datadir, mode, row.NameMnemonic, row.StateCode, row.scenario, row.variable, row.model)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        os.replace(os.path.join(drive, row.folder, f"{row.description}.csv"), local_path)
+
+    # Only the second year is planned and exported
+    incremental = sd_obj.plan_incremental(extended_yaml, mode, datadir, output_path=str(tmp_path / "incremental.csv"))
+    assert len(incremental) == len(plan)
+    assert (incremental["start_date"] == "2007-01-01").all() and (incremental["description_suffix"] == "_20070101").all()
+    sd_obj.execute_plan(str(tmp_path / "incremental.csv"))
+
+    incremental = pd.read_csv(tmp_path / "incremental.csv", keep_default_na=False)
+    summary = downloader.append_downloads(incremental, drive, datadir)
+    assert (summary["n_appended"] == incremental["n_rows"]).all()
+    assert downloader.append_downloads(incremental, drive, datadir)["n_appended"].sum() == 0
+    assert len(sd_obj.plan_incremental(extended_yaml, mode, datadir)) == 0
+
+    # The appended series are the same as a full download of both years
+    full_drive = str(tmp_path / "full_drive")
+    sd_obj.ee = fake_ee.FakeEarthEngine(output_dir=full_drive)
+    full = sd_obj.plan_downloads(extended_yaml, mode)
+    sd_obj.execute_plan(full)
+    for row in full.itertuples():
+        local_path = downloader.local_series_path(datadir, mode, row.NameMnemonic, row.StateCode, row.scenario, row.variable, row.model)
+        expected = pd.read_csv(os.path.join(full_drive, row.folder, f"{row.description}.csv"))
+        pd.testing.assert_frame_equal(pd.read_csv(local_path), expected)
+
+    # The extended series are stale for the ensemble
+    stale = catalog.stale_sites(datadir, os.path.join(datadir, catalog.ENSEMBLE_STAGE), sd_obj.sites, ["rcp45"], ["pr", "tasmax"])
+    assert sorted(stale.NameMnemonic) == ["AMB", "BMB", "CMB"]
+
+
+def test_monthly_multiband_export_matches_the_single_band_exports(site_json, tmp_path):
+    drive = tmp_path / "drive"
+    params_yaml = _params_yaml(tmp_path, "params.yml", variables=["pr", "tasmin", "tasmax"])
+    sd_obj = downloader.SitesDownloader(folder="exports", site_json_file_path=site_json, backend=fake_ee.FakeEarthEngine(output_dir=str(drive)))
+
+    tasks = sd_obj.download_samples(params_yaml, mode="monthly_multiband")
+    assert len(tasks) == 3
+    wide = pd.read_csv(drive / "exports" / "rcp45" / "monthly" / "BMB_TX_rcp45_pr-tasmin-tasmax_monthly.csv")
+    assert wide.columns.tolist() == ["date", "pr", "tasmin", "tasmax"] and len(wide) == 12
+
+    sd_obj.download_samples(params_yaml, mode="monthly")
+    for variable in ["pr", "tasmin", "tasmax"]:
+        single = pd.read_csv(drive / "exports" / "rcp45" / variable / f"BMB_TX_rcp45_{variable}_monthly.csv")
+        assert single["date"].tolist() == wide["date"].tolist()
+        np.testing.assert_allclose(single["mean"], wide[variable])
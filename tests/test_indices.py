@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from climate_resilience import indices
+
+
+def _write_series(datadir, name, start, end, rng):
+    dates = pd.date_range(start, end, freq="D")
+    ensemble_dir = os.path.join(datadir, "historical_tasmax_ensemble")
+    os.makedirs(ensemble_dir, exist_ok=True)
+    pd.DataFrame({"date": dates.strftime("%Y-%m-%d"), "mean": 20 + 10 * rng.random(len(dates))}).to_csv(
+        os.path.join(ensemble_dir, f"{name}_NM_historical_tasmax.csv"), index=False
+    )
+
+
+def test_wsdi_is_nan_without_base_period_data(tmp_path, capsys):
+    rng = np.random.default_rng(0)
+    datadir = str(tmp_path)
+    _write_series(datadir, "AMB", "1961-01-01", "1995-12-31", rng)
+    _write_series(datadir, "BMB", "1991-01-01", "1995-12-31", rng)    # Starts after the base period
+    sites = pd.DataFrame({"OBJECTID": [1, 2], "ID": [1, 2], "NameMnemonic": ["AMB", "BMB"], "StateCode": ["NM", "NM"]})
+
+    outputs = indices.get_extreme_indices(sites, ["historical"], ["wsdi", "txx"], datadir)
+
+    assert "WARNING" in capsys.readouterr().out
+    wsdi = outputs["wsdi"].set_index("NameMnemonic")
+    assert wsdi.loc["AMB", "historical_1995"] >= 0
+    assert np.isnan(wsdi.loc["BMB", ["historical_1991", "historical_1995"]].to_numpy(dtype=np.float64)).all()
+    # The indices without a base period are not affected
+    assert not np.isnan(outputs["txx"].set_index("NameMnemonic").loc["BMB", "historical_1995"])
@@ -0,0 +1,205 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from climate_resilience import catalog
+from climate_resilience import preprocess
+
+
+def test_per_year_stats_resume_clears_only_the_recomputed_sites(datadir, sites):
+    per_year_dir = os.path.join(datadir, "per_year_stats")
+    ensemble_dir = os.path.join(datadir, catalog.ENSEMBLE_STAGE)
+    for name, state in zip(sites.NameMnemonic, sites.StateCode):
+        catalog.mark_stale(datadir, "rcp45", "pr", name, state)
+    catalog.clear_stale(datadir, ensemble_dir, {("rcp45", "pr"): list(zip(sites.NameMnemonic, sites.StateCode))})
+
+    # The run fails at the last site after the first two sites were checkpointed
+    csv_path = os.path.join(datadir, "rcp45_pr_ensemble", "CMB_HI_rcp45_pr.csv")
+    os.rename(csv_path, csv_path + ".bak")
+    with pytest.raises(FileNotFoundError):
+        preprocess.get_per_year_stats(sites, ["rcp45"], ["pr"], datadir, checkpoint_every=1)
+    os.rename(csv_path + ".bak", csv_path)
+
+    # AMB is extended again before the resumed run, which only recomputes CMB
+    catalog.mark_stale(datadir, "rcp45", "pr", "AMB", "NM")
+    catalog.clear_stale(datadir, ensemble_dir, {("rcp45", "pr"): [("AMB", "NM")]})
+    preprocess.get_per_year_stats(sites, ["rcp45"], ["pr"], datadir, checkpoint_every=1)
+
+    assert catalog.stale_sites(datadir, per_year_dir, sites, ["rcp45"], ["pr"]).NameMnemonic.tolist() == ["AMB", "BMB"]
+
+
+def _model_values(datadir, name, state, sce, var):
+    paths = sorted(catalog.get_catalog(datadir).model_files(sce, var, name, state))
+    return np.column_stack([pd.read_csv(path)["mean"].to_numpy() for path in paths])
+
+
+@pytest.mark.parametrize("block_days", [1, 100, 10000])
+def test_ensemble_quantile_bands_do_not_depend_on_the_blocks(datadir, sites, block_days):
+    preprocess.get_climate_ensemble(sites, ["rcp45"], ["pr"], datadir, quantiles=[10, 50, 90], block_days=block_days)
+
+    for name, state in zip(sites.NameMnemonic, sites.StateCode):
+        values = _model_values(datadir, name, state, "rcp45", "pr")
+        df = pd.read_csv(os.path.join(datadir, "climate_ensemble", f"{name}_{state}_rcp45_pr.csv"), index_col=0)
+        assert df["date"].iloc[0] == "1950-01-01" and len(df) == len(values)
+        np.testing.assert_allclose(df["mean"], values.mean(axis=1))
+        np.testing.assert_allclose(df["std"], values.std(axis=1, ddof=1))
+        for q in [10, 50, 90]:
+            np.testing.assert_allclose(df[f"q{q}"], np.percentile(values, q, axis=1))
+
+
+def test_ensemble_warns_about_model_files_of_different_lengths(datadir, sites):
+    csv_path = os.path.join(datadir, "rcp45_pr", "BMB_TX_rcp45_pr_CCSM4.csv")
+    pd.read_csv(csv_path).iloc[:-10].to_csv(csv_path, index=False)
+
+    with pytest.warns(UserWarning, match="1 site series have different numbers of rows"):
+        preprocess.get_climate_ensemble(sites, ["rcp45"], ["pr"], datadir, block_days=100)
+
+    # The shorter model is nan padded to the first model file
+    df = pd.read_csv(os.path.join(datadir, "climate_ensemble", "BMB_TX_rcp45_pr.csv"), index_col=0)
+    values = _model_values(datadir, "AMB", "NM", "rcp45", "pr")
+    assert len(df) == len(values) and df["mean"].notna().all()
+
+
+@pytest.mark.parametrize("block_days", [7, 10000])
+def test_ensemble_aligns_the_models_on_their_dates(datadir, sites, block_days):
+    # CCSM4 misses a month, MIROC5 is a no-leap export with an unparsable date and a duplicate date
+    folder = os.path.join(datadir, "historical_pr")
+    ccsm4 = pd.read_csv(os.path.join(folder, "AMB_NM_historical_pr_CCSM4.csv"))
+    ccsm4 = ccsm4[~ccsm4["date"].str.startswith("1961-03")]
+    ccsm4.to_csv(os.path.join(folder, "AMB_NM_historical_pr_CCSM4.csv"), index=False)
+    miroc5 = pd.read_csv(os.path.join(folder, "AMB_NM_historical_pr_MIROC5.csv"))
+    miroc5 = miroc5[~miroc5["date"].str.endswith("-02-29")].reset_index(drop=True)
+    miroc5.loc[40, "date"] = "1960-02-30"
+    pd.concat([miroc5.iloc[:100], miroc5.iloc[99:]]).to_csv(os.path.join(folder, "AMB_NM_historical_pr_MIROC5.csv"), index=False)
+
+    with pytest.warns(UserWarning, match="2 model files have missing or invalid dates"):
+        preprocess.get_climate_ensemble(sites.iloc[:1], ["historical"], ["pr"], datadir, block_days=block_days, align_dates=True)
+
+    gaps = pd.read_csv(os.path.join(datadir, "climate_ensemble_gaps.csv"), index_col=0).set_index("file")
+    assert gaps.loc["AMB_NM_historical_pr_CCSM4.csv", ["n_missing", "first_missing", "last_missing"]].tolist() == [31, "1961-03-01", "1961-03-31"]
+    assert gaps.loc["AMB_NM_historical_pr_MIROC5.csv", ["n_missing", "n_invalid_dates", "noleap"]].tolist() == [1, 1, True]
+    assert gaps.loc["AMB_NM_historical_pr_MIROC5.csv", "first_missing"] == "1960-02-10"
+
+    df = pd.read_csv(os.path.join(datadir, "climate_ensemble", "AMB_NM_historical_pr.csv"), index_col=0)
+    assert df["date"].tolist() == pd.date_range("1960-01-01", "1964-12-31").strftime("%Y-%m-%d").tolist()
+
+    # Every day is the mean of the models that have a value on that day
+    models = [pd.read_csv(path).drop_duplicates("date") for path in sorted(catalog.get_catalog(datadir).model_files("historical", "pr", "AMB", "NM"))]
+    aligned = pd.concat([model.set_index("date")["mean"] for model in models], axis=1).reindex(df["date"])
+    np.testing.assert_allclose(df["mean"], aligned.mean(axis=1))
+
+
+def test_approx_sub_period_stats_keep_the_exact_columns(datadir, sites):
+    date_ranges = [("2006-01-01", "2007-12-31"), ("2008-01-01", "2010-12-31")]
+    preprocess.get_sub_period_stats(sites, ["rcp45"], ["tasmax"], datadir, date_ranges)
+    exact = pd.read_csv(os.path.join(datadir, "tasmax_sub_period_stats.csv"), index_col=0)
+    preprocess.get_sub_period_stats(sites, ["rcp45"], ["tasmax"], datadir, date_ranges, approx=True, chunksize=500)
+    approx = pd.read_csv(os.path.join(datadir, "tasmax_sub_period_stats.csv"), index_col=0)
+
+    assert approx.columns.tolist() == exact.columns.tolist()
+    np.testing.assert_allclose(approx["2006_2007_percentile"], exact["2006_2007_percentile"], rtol=0.01)
+
+    # The counts and amounts per year are exact for the estimated percentile
+    df = pd.read_csv(os.path.join(datadir, "rcp45_tasmax_ensemble", "AMB_NM_rcp45_tasmax.csv"))
+    values = df.loc[df["date"] >= "2008-01-01", "mean"]
+    above = values[values > approx.loc[0, "2008_2010_percentile"]]
+    assert approx.loc[0, "2008_2010_count_gt_percentile"] == pytest.approx(len(above) / 3)
+    assert approx.loc[0, "2008_2010_amount_gt_percentile"] == pytest.approx(above.sum() / 3)
+
+    with pytest.raises(ValueError):
+        preprocess.get_sub_period_stats(sites, ["rcp45"], ["tasmax"], datadir, date_ranges, approx=True, cube_path="cube.nc")
+
+
+def _above(data, threshold=0.0):
+    return np.count_nonzero(np.asarray(data) > threshold)
+
+
+def test_checkpoint_signature_identifies_the_callable_arguments(datadir, sites):
+    date_ranges = [("2006-01", "2010-12")]
+    run = functools.partial(preprocess.get_sub_period_stats, sites, ["rcp45"], ["pr"], datadir, date_ranges, get_stats=False, checkpoint_every=1)
+
+    with pytest.raises(ValueError, match="anonymous callable"):
+        run(agg_function=lambda data: data.max())
+
+    # A checkpoint of a partial with different arguments is not resumed
+    checkpoint_path = os.path.join(datadir, f"pr_sub_period_stats.csv{preprocess.CHECKPOINT_SUFFIX}")
+    signature = preprocess._checkpoint_signature(
+        scenarios=["rcp45"], variable="pr", date_ranges=date_ranges, comp_function=np.greater, get_stats=False, 
+        agg_function=functools.partial(_above, threshold=1.0), approx=False, cube_path=None, n_bootstrap=0, block_length=30, 
+        confidence=0.95, seed=0, kwargs=[],
+    )
+    preprocess._append_checkpoint(checkpoint_path, pd.DataFrame({"OBJECTID": [1], "ID": [11], "NameMnemonic": ["AMB"], "StateCode": ["NM"], "2006_2010__above": [0.0]}), signature)
+    with pytest.raises(ValueError, match="different arguments"):
+        run(agg_function=functools.partial(_above, threshold=5.0))
+    run(agg_function=functools.partial(_above, threshold=5.0), resume=False)
+
+
+def test_per_year_stats_refuse_checkpoints_of_the_parquet_output(datadir, sites):
+    with pytest.raises(ValueError, match="Checkpoints"):
+        preprocess.get_per_year_stats(sites, ["rcp45"], ["pr"], datadir, output_format="parquet", checkpoint_every=1)
+
+
+def test_region_period_table_is_the_long_format_of_the_period_means(datadir, sites):
+    date_ranges = [("1960-01-01", "1962-12-31"), ("2006-01-01", "2010-12-31")]
+    with pytest.warns(UserWarning, match="unknown state codes"):
+        table = preprocess.get_region_period_table(
+            pd.concat([sites, sites.iloc[:1].assign(OBJECTID=9, StateCode="ZZ")], ignore_index=True), 
+            ["historical", "rcp45"], ["pr"], datadir, date_ranges,
+        )
+
+    assert table.columns.tolist() == preprocess.REGION_TABLE_COLUMNS
+    # Every scenario only has data for one of the periods
+    assert len(table) == 2 * len(sites)
+    assert table.groupby("Scenario", observed=True)["Period"].unique().map(list).to_dict() == {"historical": ["1960_1962"], "rcp45": ["2006_2010"]}
+    assert list(table["Period"].cat.categories) == ["1960_1962", "2006_2010"]
+
+    row = table[(table.NameMnemonic == "BMB") & (table.Scenario == "historical")].iloc[0]
+    assert row["Region"] == "S. Great Plains"
+    df = pd.read_csv(os.path.join(datadir, "historical_pr_ensemble", "BMB_TX_historical_pr.csv"))
+    assert row["Value"] == pytest.approx(df.loc[df["date"] <= "1962-12-31", "mean"].mean())
+
+    summary = preprocess.summarize_region_periods(table, quantiles=[0.5])
+    assert summary["count"].sum() == len(table) and "q50" in summary
+
+
+def _brute_force_spells(df, threshold):
+    spells = []
+    for date, value in zip(pd.to_datetime(df["date"]), df["mean"]):
+        if value > threshold:
+            if spells and spells[-1]["last"] == date - pd.Timedelta(days=1):
+                spells[-1].update(last=date, spell_length=spells[-1]["spell_length"] + 1, 
+                                  magnitude=max(spells[-1]["magnitude"], value), total=spells[-1]["total"] + value)
+            else:
+                spells.append({"date": date, "last": date, "spell_length": 1, "magnitude": value, "total": value})
+    return pd.DataFrame(spells).drop(columns="last")
+
+
+def test_exceedance_events_are_the_spells_of_the_counted_days(datadir, sites):
+    # A missing day breaks a spell
+    csv_path = os.path.join(datadir, "rcp45_pr_ensemble", "AMB_NM_rcp45_pr.csv")
+    df = pd.read_csv(csv_path, index_col=0)
+    df.loc[100:104, "mean"] = 50.0
+    df.drop(index=102).to_csv(csv_path)
+
+    percentiles = preprocess.calculate_Nth_percentile(sites, ["historical", "rcp45"], ["pr"], datadir, N=90)
+    counts = preprocess.calculate_pr_count_amount(sites, ["historical", "rcp45"], ["pr"], datadir, 
+                                                  os.path.join(datadir, "LMsites_90th_percentile.csv"), events=True)
+    table = pd.read_csv(os.path.join(datadir, "LMsites_exceedance_events.csv"), dtype={"date": str})
+    assert table.columns.tolist() == preprocess.EVENTS_TABLE_COLUMNS
+
+    # The spell lengths add up to the counts per year of the 5 years of every series
+    totals = table.groupby(["NameMnemonic", "scenario"])["spell_length"].sum()
+    for row in counts.itertuples():
+        for sce in ["historical", "rcp45"]:
+            assert totals[(row.NameMnemonic, sce)] == pytest.approx(getattr(row, f"{sce}_pr_counts") * 5)
+
+    df = pd.read_csv(csv_path)
+    expected = _brute_force_spells(df, percentiles.loc[0, "historical_pr_percentile"])
+    events = table[(table.NameMnemonic == "AMB") & (table.scenario == "rcp45")].reset_index(drop=True)
+    assert events["date"].tolist() == expected["date"].dt.strftime("%Y-%m-%d").tolist()
+    assert events["spell_length"].tolist() == expected["spell_length"].tolist()
+    np.testing.assert_allclose(events[["magnitude", "total"]], expected[["magnitude", "total"]])
+    assert events.loc[events["date"] == df.loc[100, "date"], "spell_length"].tolist() == [2]
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from climate_resilience import series_store
+
+
+def _ensemble_csv(datadir, name, state, sce, var):
+    return os.path.join(datadir, f"{sce}_{var}_ensemble", f"{name}_{state}_{sce}_{var}.csv")
+
+
+def test_store_matches_the_ensemble_csvs(datadir, sites, tmp_path):
+    missing = pd.DataFrame({"OBJECTID": [4], "ID": [14], "NameMnemonic": ["ZZZ"], "StateCode": ["ZZ"]})
+    store_dir = series_store.build_series_store(pd.concat([sites, missing], ignore_index=True), ["historical", "rcp45"], ["pr"],
+                                                datadir, str(tmp_path / "store"))
+
+    for name, state in zip(sites.NameMnemonic, sites.StateCode):
+        df = pd.read_csv(_ensemble_csv(datadir, name, state, "rcp45", "pr"))
+        np.testing.assert_array_equal(series_store.load_series(store_dir, (name, state), "rcp45", "pr"), df["mean"])
+
+        # Date range slices
+        values = series_store.load_series(store_dir, name, "rcp45", "pr", "2007-03", "2007-03-31")
+        np.testing.assert_array_equal(values, df.loc[df.date.between("2007-03-01", "2007-03-31"), "mean"])
+
+    store = series_store.open_store(store_dir)
+    assert store.dates("historical", "pr")[0] == np.datetime64("1960-01-01")
+    dates, block = store.load_block("historical", "pr", missing)
+    assert len(dates) == block.shape[1] and np.isnan(block).all()
+    assert np.isnan(store.load_series("ZZZ_ZZ", "historical", "pr")).all()
+
+
+def test_rebuilt_store_is_reopened(datadir, sites, tmp_path):
+    store_dir = str(tmp_path / "store")
+    series_store.build_series_store(sites, ["rcp45"], ["pr"], datadir, store_dir)
+    assert len(series_store.load_series(store_dir, "AMB", "rcp45", "pr")) == len(pd.date_range("2006-01-01", "2010-12-31"))
+
+    # New dates appended to a single site extend the calendar of all the sites
+    csv_path = _ensemble_csv(datadir, "AMB", "NM", "rcp45", "pr")
+    df = pd.read_csv(csv_path, index_col=0)
+    extra = pd.DataFrame({"date": pd.date_range("2011-01-01", "2011-01-10").strftime("%Y-%m-%d"), "mean": 1.0, "std": 0.0})
+    pd.concat([df, extra], ignore_index=True).to_csv(csv_path)
+    series_store.build_series_store(sites, ["rcp45"], ["pr"], datadir, store_dir)
+
+    values = series_store.load_series(store_dir, "AMB", "rcp45", "pr", "2011-01-01")
+    np.testing.assert_array_equal(values, np.ones(10))
+    assert np.isnan(series_store.load_series(store_dir, "BMB", "rcp45", "pr", "2011-01-01")).all()
+    assert not any(name.endswith(".tmp") for name in os.listdir(store_dir))
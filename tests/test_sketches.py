@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from climate_resilience import sketches
+
+
+def _rank_error(sorted_values, value, q):
+    return abs(np.searchsorted(sorted_values, value) / len(sorted_values) - q)
+
+
+@pytest.mark.parametrize("case", ["gamma", "gamma_per_chunk", "precipitation"])
+def test_merge_all_keeps_the_accuracy(case):
+    rng = np.random.default_rng(0)
+    if case == "gamma":
+        x = rng.gamma(0.5, 4.0, 20 * 55_000)
+    elif case == "gamma_per_chunk":
+        # A different scale per chunk, e.g. one chunk per model
+        x = np.concatenate([rng.gamma(0.5, 4.0 * (1 + i / 10), 55_000) for i in range(20)])
+    else:
+        # Mostly dry days, the median is a tie at 0
+        x = np.where(rng.random(20 * 55_000) < 0.6, 0.0, rng.gamma(0.7, 8.0, 20 * 55_000))
+    x_sorted = np.sort(x)
+
+    single = sketches.TDigest().update(x)
+    merged = sketches.TDigest.merge_all([sketches.TDigest().update(chunk) for chunk in np.array_split(x, 20)])
+
+    for q in [0.5, 0.9, 0.99, 0.999]:
+        if case == "precipitation" and q == 0.5:
+            continue
+        assert _rank_error(x_sorted, single.quantile(q), q) < 0.0003
+        assert _rank_error(x_sorted, merged.quantile(q), q) < 0.0003
+    assert merged.count == x.size
+    assert merged.min == x.min() and merged.max == x.max()
+
+
+def test_merge_does_not_modify_other():
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=5_500)
+    digest = sketches.TDigest().update(rng.normal(size=5_000))
+    other = sketches.TDigest().update(values[:5_000]).update(values[5_000:])    # Leaves values in the buffer
+    reference = sketches.TDigest().update(values[:5_000]).update(values[5_000:])
+    assert other._buffer
+
+    digest.merge(other)
+    digest.percentile(99)
+
+    assert np.array_equal(other._means, reference._means) and np.array_equal(other._weights, reference._weights)
+    assert len(other._buffer) == len(reference._buffer)
+    assert other.count == reference.count
+    assert other.percentile(99) == reference.percentile(99)
+
+
+def test_recompressed_centroids_stay_within_the_size_limit():
+    # Sorted input puts the buffered values next to the heaviest existing centroids
+    rng = np.random.default_rng(2)
+    x = np.sort(rng.gamma(0.5, 4.0, 200_000))
+    digest = sketches.TDigest(compression=100)
+    for chunk in np.array_split(x, 50):
+        digest.update(chunk)
+    digest.percentile(99)
+
+    # Largest cluster of the arcsine scale function, at the median
+    assert digest._weights.max() <= x.size * np.sin(2 * np.pi / digest.compression) / 2
+    assert _rank_error(x, digest.quantile(0.99), 0.99) < 0.001
@@ -0,0 +1,83 @@
+import math
+
+import numpy as np
+import pytest
+
+from climate_resilience import trends
+
+
+def _brute_force_trend(y, x):
+    """Mann-Kendall test and slopes of a single site, one year pair at a time."""
+
+    valid = ~np.isnan(y)
+    y, x = y[valid], x[valid]
+    n = len(y)
+
+    s = sum(np.sign(y[j] - y[i]) for i in range(n) for j in range(i + 1, n))
+    _, t = np.unique(y, return_counts=True)
+    variance = (n * (n - 1) * (2 * n + 5) - np.sum(t * (t - 1) * (2 * t + 5))) / 18
+    if s > 0:
+        z = (s - 1) / math.sqrt(variance)
+    elif s < 0:
+        z = (s + 1) / math.sqrt(variance)
+    else:
+        z = 0.0
+
+    slopes = [(y[j] - y[i]) / (x[j] - x[i]) for i in range(n) for j in range(i + 1, n)]
+    return {
+        "n_years": n,
+        "ols_slope": np.polyfit(x, y, 1)[0],
+        "sens_slope": np.median(slopes),
+        "mk_s": s,
+        "mk_z": z,
+        "mk_pvalue": math.erfc(abs(z) / math.sqrt(2)),
+    }
+
+
+@pytest.mark.parametrize("site_chunk", [1, 4, 256])
+def test_trend_stats_match_brute_force(site_chunk):
+    rng = np.random.default_rng(0)
+    years = np.arange(1990, 2020)
+    values = np.round(rng.normal(size=(9, len(years))) + 0.05 * np.arange(len(years)), 1)    # Rounding creates ties
+    values[1] = np.round(values[1])
+    values[2, [0, 5, 6, 29]] = np.nan
+    values[3, ::2] = np.nan
+    values[4] = np.repeat([1.0, 2.0, 3.0], 10)
+    values[5] = -values[0]
+
+    stats = trends.trend_stats(values, years, site_chunk=site_chunk)
+    assert list(stats) == trends.TREND_STATS
+
+    for k in range(len(values)):
+        expected = _brute_force_trend(values[k], years.astype(np.float64))
+        for stat in trends.TREND_STATS:
+            np.testing.assert_allclose(stats[stat][k], expected[stat], rtol=1e-9, atol=1e-12, err_msg=f"site {k}, {stat}")
+
+
+def test_tie_correction_matches_the_counts_of_the_tied_groups():
+    values = np.array([
+        [1.0, 1.0, 2.0, 3.0, 3.0, 3.0, 4.0],
+        [5.0, np.nan, 5.0, np.nan, 5.0, 5.0, 0.0],
+        [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+    ])
+
+    # t = 2 and 3, t = 4 (the nan values never tie), no ties
+    np.testing.assert_array_equal(trends._tie_correction(values), [2 * 1 * 9 + 3 * 2 * 11, 4 * 3 * 13, 0])
+
+
+def test_degenerate_series():
+    years = np.arange(2000, 2006)
+    values = np.array([
+        [2.0] * 6,                                            # All tied: no trend
+        [np.nan, 1.0, np.nan, 3.0, np.nan, np.nan],           # Slopes only
+        [np.nan, np.nan, np.nan, 4.0, np.nan, np.nan],        # Nothing
+    ])
+
+    stats = trends.trend_stats(values, years)
+
+    assert stats["mk_s"][0] == 0 and stats["mk_z"][0] == 0 and stats["mk_pvalue"][0] == 1
+    assert stats["ols_slope"][0] == 0 and stats["sens_slope"][0] == 0
+    assert stats["ols_slope"][1] == 1 and stats["sens_slope"][1] == 1
+    assert np.isnan([stats[stat][1] for stat in ["mk_s", "mk_z", "mk_pvalue"]]).all()
+    assert stats["n_years"][2] == 1
+    assert np.isnan([stats[stat][2] for stat in trends.TREND_STATS if stat != "n_years"]).all()
@@ -0,0 +1,33 @@
+import os
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+from climate_resilience import visualize
+
+
+def test_render_figures_writes_every_spec_and_format(sites, tmp_path, capsys):
+    sites = sites.assign(pr_mean=[1.0, 2.5, 4.0], pr_max=[10.0, 30.0, 20.0])
+    table = pd.DataFrame({
+        "Period": np.repeat(["1950-1979", "2070-2099"], 6),
+        "Region": np.tile(["West", "South"], 6),
+        "Value": np.random.default_rng(0).random(12),
+    })
+    specs = [
+        {"kind": "boxplot", "name": "box", "params": {"data": table, "x_feature": "Period", "y_feature": "Value", "hue_feature": "Region"}},
+        {"kind": "histogram", "name": "hist", "params": {"sites": sites, "features": ["pr_mean", "pr_max"], "figsize": (6, 4)}},
+        {"kind": "map", "name": "map", "params": {"sites": sites, "feature": "pr_mean", "colors": ["blue", "red"]}},
+    ]
+    backend = matplotlib.get_backend()
+
+    outputs = visualize.render_figures(specs, str(tmp_path / "figures"), formats=["png", "svg"], n_jobs=2)
+
+    assert outputs == [[str(tmp_path / "figures" / f"{spec['name']}.{fmt}") for fmt in ["png", "svg"]] for spec in specs]
+    assert all(os.path.getsize(path) > 0 for paths in outputs for path in paths)
+    assert matplotlib.get_backend() == backend
+    assert capsys.readouterr().out == ""
+
+    with pytest.raises(ValueError):
+        visualize.render_figures([{"kind": "pie", "name": "pie"}], str(tmp_path / "figures"))